@@ -0,0 +1,156 @@
+"""
+Materialized dashboard alerts.
+
+The ``alerts`` table holds one row per (chemical, alert type). Rows are
+reconciled for the chemicals touched by each committing transaction, and by the
+daily ``expiry-sweep`` job for expiry windows that move without any write. Reading alerts
+therefore costs O(alerts) instead of a scan of the whole inventory. Resolved
+alerts are kept as inactive rows for a while so clients polling with
+``since=`` also learn about removals.
+"""
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from models import db, Alert, Chemical, LOW_STOCK_FLAG
+from changes import before_commit, ids
+from scheduler import job
+
+# Chemicals reconciled per SELECT ... WHERE id IN (...)
+BATCH_SIZE = 500
+
+
+def expiry_bounds(today):
+    """``(earliest, latest)`` expiry dates that raise an expiry alert on ``today``."""
+    config = current_app.config
+    return (
+        today - timedelta(days=config['ALERT_EXPIRED_CUTOFF_DAYS']),
+        today + timedelta(days=config['ALERT_EXPIRY_WINDOW_DAYS']),
+    )
+
+
+def desired_alerts(chemical, today, bounds=None):
+    """Return ``{type: (severity, message)}`` for the alerts ``chemical`` should have."""
+    earliest, latest = bounds or expiry_bounds(today)
+    alerts = {}
+    if chemical.minimum_stock is not None and chemical.quantity <= chemical.minimum_stock:
+        alerts['low_stock'] = (
+            'warning',
+            f'{chemical.name} is low on stock ({chemical.quantity} {chemical.unit} remaining)',
+        )
+    if chemical.expiry_date and earliest <= chemical.expiry_date <= latest:
+        verb = 'expired' if chemical.expiry_date < today else 'expires'
+        alerts['expiring'] = ('error', f'{chemical.name} {verb} on {chemical.expiry_date}')
+    return alerts
+
+
+def refresh(session, chemical_ids, today=None):
+    """Bring the alert rows of ``chemical_ids`` in line with the chemicals' current state."""
+    today = today or date.today()
+    bounds = expiry_bounds(today)
+    now = datetime.utcnow()
+    chemical_ids = sorted(i for i in chemical_ids if i is not None)
+
+    for start in range(0, len(chemical_ids), BATCH_SIZE):
+        batch = chemical_ids[start:start + BATCH_SIZE]
+        chemicals = session.execute(
+            select(Chemical.id, Chemical.lab_id, Chemical.name, Chemical.quantity, Chemical.unit,
+                   Chemical.minimum_stock, Chemical.expiry_date)
+            .where(Chemical.id.in_(batch))
+        ).all()
+        labs = {chemical.id: chemical.lab_id for chemical in chemicals}
+        wanted = {}
+        for chemical in chemicals:
+            for alert_type, alert in desired_alerts(chemical, today, bounds).items():
+                wanted[(chemical.id, alert_type)] = alert
+
+        for alert in session.scalars(select(Alert).where(Alert.chemical_id.in_(batch))):
+            key = (alert.chemical_id, alert.type)
+            if key in wanted:
+                severity, message = wanted.pop(key)
+                if not alert.active or alert.severity != severity or alert.message != message:
+                    alert.active = True
+                    alert.severity = severity
+                    alert.message = message
+                    alert.updated_at = now
+            elif alert.active:
+                alert.active = False
+                alert.updated_at = now
+
+        if wanted:
+            # One executemany for the whole batch instead of a flush per object
+            session.execute(insert(Alert), [
+                {'chemical_id': chemical_id, 'lab_id': labs[chemical_id], 'type': alert_type,
+                 'severity': severity, 'message': message, 'active': True, 'updated_at': now}
+                for (chemical_id, alert_type), (severity, message) in wanted.items()
+            ])
+
+
+@before_commit
+def _refresh_changed_chemicals(session, changes):
+    changed = ids(changes, 'chemicals')
+    if changed:
+        refresh(session, changed)
+
+
+def _candidates(session, today):
+    """Ids of the chemicals whose alerts can be out of date without a write."""
+    earliest, latest = expiry_bounds(today)
+    candidates = set(session.scalars(
+        select(Chemical.id).where(LOW_STOCK_FLAG == 1)))
+    candidates.update(session.scalars(
+        select(Chemical.id).where(Chemical.expiry_date.between(earliest, latest))))
+    candidates.update(session.scalars(
+        select(Alert.chemical_id).where(Alert.active.is_(True))))
+    return candidates
+
+
+def backfill(conn):
+    """Migration step raising the alerts existing chemicals already qualify for."""
+    session = Session(bind=conn)
+    try:
+        refresh(session, _candidates(session, date.today()))
+        session.flush()
+    finally:
+        session.close()
+
+
+@job('expiry-sweep', daily='EXPIRY_SWEEP_AT')
+def sweep(today=None):
+    """Reconcile every alert that can change without a write; return the counts.
+
+    Candidates come from the ``expiry_date`` and low-stock indexes plus the
+    currently active alerts, so the sweep is O(alerts), not O(inventory).
+    Inactive alerts older than ``ALERT_TOMBSTONE_DAYS`` are purged.
+    """
+    today = today or date.today()
+    candidates = _candidates(db.session, today)
+    refresh(db.session, candidates, today)
+
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['ALERT_TOMBSTONE_DAYS'])
+    purged = db.session.execute(
+        delete(Alert).where(Alert.active.is_(False), Alert.updated_at < cutoff)).rowcount
+    db.session.commit()
+    return {'chemicals': len(candidates), 'purged': purged}
+
+
+def version():
+    """Cheap validator for the alert set: the newest ``updated_at`` (indexed)."""
+    latest = db.session.scalar(select(func.max(Alert.updated_at)))
+    return latest.isoformat() if latest else '0'
+
+
+def active_alerts():
+    return db.session.scalars(
+        select(Alert).where(Alert.active.is_(True))
+        .order_by(Alert.type.desc(), Alert.chemical_id)
+    ).all()
+
+
+def alerts_since(since):
+    """Every alert created, changed or resolved after ``since`` (a datetime)."""
+    return db.session.scalars(
+        select(Alert).where(Alert.updated_at > since).order_by(Alert.updated_at)
+    ).all()
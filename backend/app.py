@@ -1,35 +1,171 @@
+import logging
+import os
+
+import click
 from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from config import Config
-from models import db
-from routes import auth_bp, inventory_bp, experiments_bp, safety_bp, dashboard_bp
+from werkzeug.utils import import_string
+from config import Config, default_secrets
+from models import db, Lab, User
+from serialization import JSONProvider
+import alerts
+import auth
+import compression
+import database
+import instrumentation
+import ledger
+import links
+import migrations
+import passwords
+import rollups
+import scheduler
+import tenancy
+import units
+
+# API blueprints: name -> (import path, URL prefix). Only the blueprints named
+# in API_BLUEPRINTS (all by default) are registered.
+BLUEPRINTS = {
+    'auth': ('routes:auth_bp', '/api/auth'),
+    'inventory': ('routes:inventory_bp', '/api/inventory'),
+    'experiments': ('routes:experiments_bp', '/api/experiments'),
+    'safety': ('routes:safety_bp', '/api/safety'),
+    'dashboard': ('routes:dashboard_bp', '/api/dashboard'),
+    'search': ('routes:search_bp', '/api/search'),
+    'jobs': ('routes:jobs_bp', '/api/jobs'),
+}
+
+
+def register_blueprints(app):
+    names = app.config['API_BLUEPRINTS'] or list(BLUEPRINTS)
+    unknown = sorted(set(names) - set(BLUEPRINTS))
+    if unknown:
+        raise ValueError(f'Unknown API_BLUEPRINTS: {", ".join(unknown)}. Use {", ".join(BLUEPRINTS)}')
+    for name in names:
+        path, url_prefix = BLUEPRINTS[name]
+        app.register_blueprint(import_string(path), url_prefix=url_prefix)
+
 
 def create_app():
+    """Build the app without touching the database.
+
+    Tables and migrations are applied by ``flask db-upgrade``; connections
+    are only opened by the first request or command that needs one.
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.json = JSONProvider(app)
     
     # Initialize extensions
-    CORS(app)
+    CORS(app, expose_headers=['X-Next-Cursor', 'Link', 'ETag', 'X-Alerts-Version', 'Idempotent-Replayed'])
+    database.configure(app)
+    tenancy.configure(app)
     db.init_app(app)
     JWTManager(app)
+    auth.init_app(app)
+    passwords.init_app(app)
+    instrumentation.init_app(app)
+    scheduler.init_app(app)
+    compression.init_app(app)
+    
+    register_blueprints(app)
+    
+    @app.cli.command('db-upgrade')
+    def db_upgrade_command():
+        """Create missing tables and apply pending schema migrations."""
+        applied, labs_applied = migrations.upgrade_all()
+        print(f'Applied migrations: {applied}' if applied else 'Schema is up to date')
+        for lab_id, lab_applied in labs_applied.items():
+            print(f'Lab {lab_id}: applied migrations {lab_applied}' if lab_applied
+                  else f'Lab {lab_id}: schema is up to date')
     
-    # Register blueprints
-    app.register_blueprint(auth_bp, url_prefix='/api/auth')
-    app.register_blueprint(inventory_bp, url_prefix='/api/inventory')
-    app.register_blueprint(experiments_bp, url_prefix='/api/experiments')
-    app.register_blueprint(safety_bp, url_prefix='/api/safety')
-    app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
+    @app.cli.command('create-lab')
+    @click.argument('name')
+    def create_lab_command(name):
+        """Add a lab (its first admin is moved in with set-lab)."""
+        if Lab.query.filter_by(name=name).first():
+            raise click.ClickException(f'Lab {name!r} already exists')
+        lab = Lab(name=name)
+        db.session.add(lab)
+        db.session.commit()
+        print(f'Created lab {lab.id}: {lab.name}')
     
-    # Create tables
+    @app.cli.command('set-role')
+    @click.argument('username')
+    @click.argument('role', type=click.Choice(auth.ROLES + (auth.OPERATOR,)))
+    def set_role_command(username, role):
+        """Give a user a role, e.g. to make a lab's first admin or an operator."""
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f'No user named {username!r}')
+        user.role = role
+        db.session.commit()
+        print(f'{user.username} is now {role}')
+    
+    @app.cli.command('set-lab')
+    @click.argument('username')
+    @click.argument('lab_id', type=int)
+    def set_lab_command(username, lab_id):
+        """Move a user to another lab, e.g. to make a new lab's first admin."""
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.ClickException(f'No user named {username!r}')
+        if not db.session.get(Lab, lab_id):
+            raise click.ClickException(f'No lab with id {lab_id}')
+        user.lab_id = lab_id
+        db.session.commit()
+        print(f'{user.username} is now in lab {lab_id}')
+    
+    @app.cli.command('sweep-alerts')
+    def sweep_alerts_command():
+        """Reconcile dashboard alerts (run daily, e.g. from cron)."""
+        tenancy.each_database(alerts.sweep)
+    
+    @app.cli.command('run-job')
+    @click.argument('name', type=click.Choice(sorted(scheduler.jobs)))
+    def run_job_command(name):
+        """Run a scheduled job now and record it in the run history."""
+        run = scheduler.run_now(name)
+        print(f'{run.job}: {run.status} in {run.duration_ms:g} ms')
+        if run.error:
+            print(run.error)
+    
+    @app.cli.command('generate-data')
+    @click.option('--chemicals', default=10000, help='Chemicals to add.')
+    @click.option('--experiments', default=2000, help='Experiments to add.')
+    @click.option('--users', default=50, help='Users to add (password: synthetic-password).')
+    @click.option('--protocols', default=200, help='Safety protocols to add.')
+    @click.option('--labs', default=1, help='Labs to spread the data over (created as needed).')
+    @click.option('--seed', default=42, help='Random seed; the same seed gives the same data.')
+    def generate_data_command(chemicals, experiments, users, protocols, labs, seed):
+        """Add synthetic users, chemicals, experiments and protocols."""
+        import datagen
+        
+        # Every batch insert would otherwise be reported as a slow query
+        logging.getLogger('instrumentation.slow_queries').setLevel(logging.ERROR)
+        
+        def progress(table, done, total):
+            print(f'\r{table}: {done:,}/{total:,}', end='\n' if done == total else '', flush=True)
+        
+        datagen.generate(chemicals, experiments, users, protocols, labs=labs, seed=seed, progress=progress)
+    
+    # Attaches connection listeners; no connection is opened here
     with app.app_context():
-        db.create_all()
+        database.init_app(app, db)
+        tenancy.init_app(app)
+    
+    insecure = default_secrets(app.config)
+    if insecure and os.environ.get('FLASK_ENV') != 'development':
+        app.logger.warning('Using the default %s in production is insecure! Set them in the environment.',
+                           ' and '.join(insecure))
     
     return app
 
 if __name__ == '__main__':
-    import os
     app = create_app()
+    # The development server brings its database up to date itself
+    with app.app_context():
+        migrations.upgrade_all()
     # Only enable debug mode in development
     debug_mode = os.environ.get('FLASK_ENV') == 'development'
     app.run(debug=debug_mode, port=5000)
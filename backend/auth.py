@@ -0,0 +1,112 @@
+"""
+Per-request identity and role resolution.
+
+Access tokens carry the user's role and lab as ``role`` and ``lab`` claims, so
+role checks and lab scoping (see tenancy.py) are answered from the
+already-verified token without touching the ``users`` table. Endpoints that
+need the user record itself go through ``load_user``, which serves a
+snapshot from a bounded LRU cache keyed by identity. Any committed change to
+a user evicts that user's entry. Other worker processes only see the change
+once their own entry expires after ``USER_CACHE_TTL`` seconds.
+
+A claim stays valid for the lifetime of its token: a user whose role or lab
+is changed keeps the old one until they log in again. Admin and operator
+endpoints use ``role_required(..., fresh=True)`` instead, which checks the
+role of the user record, so a demoted or deleted user loses them without a
+new login.
+Self-registered users are always technicians; only an admin (or ``flask
+set-role``) changes roles.
+"""
+from functools import wraps
+
+from flask import jsonify
+from flask_jwt_extended import get_jwt, get_jwt_identity, jwt_required
+
+from models import db, User
+from cache import TTLCache
+from changes import on_commit, ids
+
+# Roles an admin can give the users of their lab
+ROLES = ('admin', 'technician', 'viewer')
+# Deployment-wide role for the scheduled jobs, which run over every lab;
+# only ``flask set-role`` grants it
+OPERATOR = 'operator'
+
+user_cache = TTLCache()
+
+
+def init_app(app):
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    user_cache.maxsize = app.config['USER_CACHE_SIZE']
+
+
+@on_commit
+def _invalidate_users(changes):
+    for user_id in ids(changes, 'users'):
+        user_cache.pop(user_id)
+
+
+def token_claims(user):
+    """Additional access-token claims for ``user``."""
+    return {'role': user.role, 'lab': user.lab_id}
+
+
+def cache_user(user):
+    snapshot = user.to_dict()
+    user_cache.set(user.id, snapshot)
+    return snapshot
+
+
+def load_user(identity):
+    """Return the ``to_dict()`` snapshot of the user ``identity``, or ``None``."""
+    snapshot = user_cache.get(identity)
+    if snapshot is None:
+        user = db.session.get(User, identity)
+        if user is None:
+            return None
+        snapshot = cache_user(user)
+    return snapshot
+
+
+def current_role():
+    """Role of the authenticated user, from the token when it has the claim."""
+    role = get_jwt().get('role')
+    if role is None:
+        # Tokens issued before role claims were added
+        user = load_user(get_jwt_identity())
+        role = user['role'] if user else None
+    return role
+
+
+def current_lab():
+    """Lab of the authenticated user, from the token when it has the claim."""
+    claims = get_jwt()
+    lab_id = claims.get('lab')
+    if lab_id is None and get_jwt_identity() is not None:
+        # Tokens issued before lab claims were added
+        user = load_user(get_jwt_identity())
+        # Lab ids start at 1, so a deleted user's token sees no lab's rows
+        lab_id = user['lab_id'] if user else 0
+    return lab_id
+
+
+def role_required(*roles, fresh=False):
+    """Like ``jwt_required()``, but also require one of ``roles``.
+
+    With ``fresh``, the role is read from the user record (through
+    ``load_user``) rather than the token's claim.
+    """
+    def decorator(view):
+        @wraps(view)
+        @jwt_required()
+        def wrapper(*args, **kwargs):
+            if fresh:
+                user = load_user(get_jwt_identity())
+                role = user['role'] if user else None
+            else:
+                role = current_role()
+            if role not in roles:
+                return jsonify({'error': 'Insufficient permissions'}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,200 @@
+"""
+Batch writes for experiments and safety protocols.
+
+A batch is a list of operations::
+
+    {"operations": [
+        {"op": "create", "data": {"title": "Titration 12", "chemicals_used": "[1, 2]"}},
+        {"op": "update", "id": 41, "data": {"status": "completed"}},
+        {"op": "delete", "id": 17}
+    ]}
+
+Operations are applied in one transaction: every targeted row is loaded
+with one SELECT, updates and deletes are flushed together, and new rows are
+added with one executemany INSERT (plus one for their chemical links). An operation that is invalid or
+targets a missing row is reported in the results and skipped; the others are
+still applied. With ``"atomic": true`` any failed operation rejects the whole
+batch instead.
+"""
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import selectinload
+
+import changes
+import links
+import tenancy
+from models import db, Experiment, SafetyProtocol
+
+OPERATIONS = ('create', 'update', 'delete')
+
+
+class BatchError(ValueError):
+    """The batch as a whole is malformed."""
+
+
+class OperationError(ValueError):
+    """A single operation is invalid."""
+
+
+class BatchSpec:
+    """What a batch may write to ``model``.
+
+    ``fields`` are the attributes operations may set (strings or null),
+    ``required`` those a create must provide, and ``load`` the relationships
+    to load with update/delete targets so the flush does not fetch them one
+    row at a time.
+    """
+
+    def __init__(self, model, fields, required, not_found, owner=None, load=()):
+        self.model = model
+        self.fields = fields
+        self.required = required
+        self.not_found = not_found
+        self.owner = owner
+        self.load = load
+
+    def values(self, data, creating):
+        if not isinstance(data, dict):
+            raise OperationError('data must be an object')
+        values = {field: data[field] for field in self.fields if field in data}
+        for field, value in values.items():
+            if value is not None and not isinstance(value, str):
+                raise OperationError(f'{field} must be a string')
+        if creating:
+            missing = [field for field in self.required if not values.get(field)]
+            if missing:
+                raise OperationError(f'Missing required fields: {", ".join(missing)}')
+        else:
+            emptied = [field for field in self.required if field in values and not values[field]]
+            if emptied:
+                raise OperationError(f'Required fields cannot be empty: {", ".join(emptied)}')
+        return values
+
+
+EXPERIMENT_BATCH = BatchSpec(
+    Experiment,
+    fields=('title', 'description', 'procedure', 'results', 'chemicals_used', 'status'),
+    required=('title',),
+    not_found='Experiment not found',
+    owner='user_id',
+    load=(Experiment.chemical_links, Experiment.usage),
+)
+
+PROTOCOL_BATCH = BatchSpec(
+    SafetyProtocol,
+    fields=('title', 'description', 'category', 'related_chemicals'),
+    required=('title', 'description'),
+    not_found='Safety protocol not found',
+    load=(SafetyProtocol.chemical_links,),
+)
+
+
+def parse(payload, max_operations):
+    """Validate the request body; return ``(operations, atomic)``."""
+    if not isinstance(payload, dict) or not isinstance(payload.get('operations'), list):
+        raise BatchError('Body must be an object with an operations list')
+    operations = payload['operations']
+    if not operations:
+        raise BatchError('operations must not be empty')
+    if len(operations) > max_operations:
+        raise BatchError(f'At most {max_operations} operations per batch')
+    return operations, bool(payload.get('atomic'))
+
+
+def _target_id(operation):
+    target = operation.get('id')
+    if not isinstance(target, int) or isinstance(target, bool):
+        raise OperationError('id must be an integer')
+    return target
+
+
+def apply(spec, operations, user_id):
+    """Apply ``operations`` to the session and flush; return the per-operation results.
+
+    Nothing is committed. Each result has ``index``, ``op``, ``status`` (an
+    HTTP status code) and ``id``, plus ``error`` for failed operations.
+    """
+    model = spec.model
+    wanted = {
+        operation['id'] for operation in operations
+        if isinstance(operation, dict) and operation.get('op') in ('update', 'delete')
+        and isinstance(operation.get('id'), int)
+    }
+    rows = {}
+    if wanted:
+        stmt = select(model).where(model.id.in_(wanted))
+        if spec.load:
+            stmt = stmt.options(*(selectinload(relationship) for relationship in spec.load))
+        rows = {row.id: row for row in db.session.scalars(stmt)}
+
+    results, created, deleted = [], [], set()
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        result = {'index': index, 'op': op, 'status': None, 'id': None}
+        results.append(result)
+        try:
+            if op not in OPERATIONS:
+                raise OperationError(f'op must be one of: {", ".join(OPERATIONS)}')
+            if op == 'create':
+                values = spec.values(operation.get('data'), creating=True)
+                if spec.owner:
+                    values[spec.owner] = user_id
+                created.append((result, values))
+                result['status'] = 201
+                continue
+
+            result['id'] = _target_id(operation)
+            row = rows.get(result['id'])
+            if row is None or result['id'] in deleted:
+                result['status'] = 404
+                result['error'] = spec.not_found
+                continue
+            if op == 'update':
+                for field, value in spec.values(operation.get('data', {}), creating=False).items():
+                    setattr(row, field, value)
+            else:
+                db.session.delete(row)
+                deleted.add(result['id'])
+            result['status'] = 200
+        except OperationError as e:
+            result['status'] = 400
+            result['error'] = str(e)
+
+    # Updates and deletes, with the chemical links they change
+    db.session.flush()
+    if created:
+        ids = _insert(model, [values for _, values in created])
+        for (result, _), row_id in zip(created, ids):
+            result['id'] = row_id
+    return results
+
+
+def _insert(model, rows):
+    """Insert ``rows`` with one executemany and link them to their chemicals; return their ids.
+
+    The ORM inserts rows one at a time when it needs their ids back from
+    SQLite. Here the ids follow from the table's new maximum instead: SQLite
+    gives each new row the next rowid after the largest one, and this
+    transaction holds the write lock from the INSERT until it commits.
+    """
+    # Rows setting the same columns share a statement; omitted columns keep their defaults
+    groups = {}
+    for position, row in enumerate(rows):
+        groups.setdefault(tuple(sorted(row)), []).append(position)
+    ids = [None] * len(rows)
+    lab_id = tenancy.assigned_lab()
+    for positions in groups.values():
+        db.session.execute(insert(model.__table__), [dict(rows[position], lab_id=lab_id) for position in positions])
+        # The table's column: a query on the model's would only see the lab's rows
+        last = db.session.scalar(select(func.max(model.__table__.c.id)))
+        for position, row_id in zip(positions, range(last - len(positions) + 1, last + 1)):
+            ids[position] = row_id
+    changes.record(db.session, model.__tablename__, ids, 'insert')
+
+    column, link_model, _ = links.LINKED[model]
+    link_rows = links.link_rows(db.session, model, {
+        row_id: row.get(column) for row_id, row in zip(ids, rows) if row.get(column)
+    })
+    if link_rows:
+        db.session.execute(insert(link_model.__table__), link_rows)
+        changes.record(db.session, link_model.__tablename__, ids, 'insert')
+    return ids
@@ -0,0 +1,78 @@
+"""
+Microbenchmark the per-request cost of authentication.
+
+Times, in microseconds per operation, the pieces every protected request pays
+for: verifying the JWT, resolving the user (a fresh-session query versus a
+``load_user`` cache hit) and answering a role check (from the token claim
+versus from the database). It also times a full ``GET /api/auth/me`` through
+the test client with the user cache cold and warm.
+
+    cd backend
+    python -m benchmarks.auth --iterations 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def timed(label, fn, iterations):
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    per_op = (time.perf_counter() - start) / iterations * 1e6
+    print(f'{label:45} {per_op:9.1f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    from flask_jwt_extended import verify_jwt_in_request
+    from app import create_app
+    from models import db, User
+    import auth
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade_all()
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'bench', 'email': 'b@example.com', 'password': 'bench'})
+    token = client.post('/api/auth/login', json={'username': 'bench', 'password': 'bench'}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    n = args.iterations
+
+    with app.test_request_context(headers=headers):
+        verify_jwt_in_request()
+
+        def query_user():
+            db.session.remove()
+            return db.session.get(User, 1).to_dict()
+
+        def role_from_db():
+            db.session.remove()
+            return db.session.get(User, 1).role
+
+        timed('verify JWT', verify_jwt_in_request, n)
+        timed('user lookup: query (fresh session)', query_user, n)
+        timed('user lookup: load_user cache hit', lambda: auth.load_user(1), n)
+        timed('role check: query (fresh session)', role_from_db, n)
+        timed('role check: token claim', auth.current_role, n)
+
+    def me_cold():
+        auth.user_cache.clear()
+        client.get('/api/auth/me', headers=headers)
+
+    timed('GET /api/auth/me, user cache cold', me_cold, n // 5)
+    timed('GET /api/auth/me, user cache warm', lambda: client.get('/api/auth/me', headers=headers), n // 5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Load-test concurrent readers against a stream of writes.
+
+Starts several reader processes that page through the inventory and one
+writer process that keeps updating chemicals (every tenth write is a bulk
+import, which holds the write lock for longer), the way gunicorn workers share
+one SQLite file, and reports reader throughput, reader latency and failed
+requests. It runs twice on fresh databases: once with SQLite's default
+rollback journal and once with the WAL profile from ``database.py``.
+
+    cd backend
+    python -m benchmarks.concurrency --readers 4 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROFILES = [
+    ('rollback journal', {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL'}),
+    ('WAL', {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL'}),
+]
+
+
+def _client(path, env):
+    os.environ.update(env, DATABASE_URL=f'sqlite:///{path}')
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        token = create_access_token(identity=1)
+    return app.test_client(), {'Authorization': f'Bearer {token}'}
+
+
+def _import(client, headers, start, count):
+    lines = '\n'.join(
+        f'{{"name": "Chemical {i}", "quantity": 100, "unit": "g", "location": "Shelf {i % 20}"}}'
+        for i in range(start, start + count)
+    )
+    return client.post('/api/inventory/import', data=lines,
+                       headers={**headers, 'Content-Type': 'application/x-ndjson'})
+
+
+def setup(path, env, chemicals):
+    client, headers = _client(path, env)
+    import migrations
+
+    with client.application.app_context():
+        migrations.upgrade_all()
+    client.post('/api/auth/register', json={'username': 'bench', 'email': 'b@example.com', 'password': 'bench'})
+    _import(client, headers, 0, chemicals)
+
+
+def _wait(start_at):
+    time.sleep(max(0, start_at - time.time()))
+
+
+def reader(path, env, start_at, deadline, results):
+    client, headers = _client(path, env)
+    timings, errors = [], 0
+    _wait(start_at)
+    while time.time() < deadline:
+        start = time.perf_counter()
+        response = client.get('/api/inventory/?limit=200', headers=headers)
+        if response.status_code == 200:
+            timings.append((time.perf_counter() - start) * 1000)
+        else:
+            errors += 1
+    results.put(('reader', timings, errors))
+
+
+def writer(path, env, start_at, deadline, chemicals, results):
+    client, headers = _client(path, env)
+    timings, errors, i = [], 0, 0
+    _wait(start_at)
+    while time.time() < deadline:
+        start = time.perf_counter()
+        if i % 10 == 9:
+            response = _import(client, headers, chemicals + i * 1000, 1000)
+        else:
+            response = client.put(f'/api/inventory/{i % chemicals + 1}', json={'quantity': i % 100}, headers=headers)
+        if response.status_code == 200:
+            timings.append((time.perf_counter() - start) * 1000)
+        else:
+            errors += 1
+        i += 1
+    results.put(('writer', timings, errors))
+
+
+def run(label, env, args):
+    # Config is read at import time, so every profile runs in fresh processes
+    context = multiprocessing.get_context('spawn')
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    process = context.Process(target=setup, args=(path, env, args.chemicals))
+    process.start()
+    process.join()
+
+    results = context.Queue()
+    # Leave the workers time to start before the measured window opens
+    start_at = time.time() + 5
+    deadline = start_at + args.seconds
+    processes = [context.Process(target=reader, args=(path, env, start_at, deadline, results))
+                 for _ in range(args.readers)]
+    processes.append(context.Process(target=writer, args=(path, env, start_at, deadline, args.chemicals, results)))
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    reads = [t for kind, timings, _ in collected if kind == 'reader' for t in timings]
+    writes = [t for kind, timings, _ in collected if kind == 'writer' for t in timings]
+    failed = sum(errors for _, _, errors in collected)
+    p99 = statistics.quantiles(reads, n=100)[-1] if len(reads) > 1 else float('nan')
+    print(f'{label}')
+    print(f'  reads   {len(reads) / args.seconds:8.1f}/s  p50 {statistics.median(reads or [0]):7.2f} ms'
+          f'  p99 {p99:7.2f} ms  max {max(reads or [0]):7.2f} ms')
+    print(f'  writes  {len(writes) / args.seconds:8.1f}/s  p50 {statistics.median(writes or [0]):7.2f} ms')
+    print(f'  failed requests {failed}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--chemicals', type=int, default=5000)
+    args = parser.parse_args()
+
+    for label, env in PROFILES:
+        run(label, env, args)
+
+
+if __name__ == '__main__':
+    main()
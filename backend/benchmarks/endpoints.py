@@ -0,0 +1,357 @@
+"""
+Drive every API endpoint against a synthetic dataset and write a JSON report.
+
+Builds a throwaway SQLite database with ``datagen`` (sizes are options), then
+sends ``--requests`` requests to each endpoint of ``routes.py`` and records
+status codes, throughput and p50/p95/p99 latency per scenario. By default the
+requests go through the Flask test client, one at a time, which measures the
+application without network noise; ``--server`` starts a threaded local WSGI
+server instead and sends them from ``--concurrency`` client threads.
+
+Reports are comparable: ``--compare`` prints the change in p50/p95 for each
+scenario against an earlier report and exits with status 1 when any p95
+regressed by more than ``--threshold`` percent, so it can gate a release::
+
+    cd backend
+    python -m benchmarks.endpoints --output baseline.json
+    # ... change the code ...
+    python -m benchmarks.endpoints --output candidate.json --compare baseline.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Registration and login derive a password hash by design; time fewer of them
+SLOW_SCENARIOS = {'auth.register': 10, 'auth.login': 10}
+
+
+class Scenario:
+    """One endpoint: ``request(i)`` returns ``(method, path, body, headers)`` for the i-th call."""
+
+    def __init__(self, name, request, expected=(200,), stream=False):
+        self.name = name
+        self.request = request
+        self.expected = expected
+        self.stream = stream
+
+
+def build_scenarios(ids, token, seed):
+    """Every endpoint of routes.py; reads first, then writes, deletes last."""
+    rng = random.Random(seed)
+    auth = {'Authorization': f'Bearer {token}'}
+    chemicals, experiments, protocols = ids['chemicals'], ids['experiments'], ids['safety_protocols']
+
+    # Reads and updates use the lower ids; deletes take distinct ids from the top
+    def lower(rows):
+        return rows[rng.randint(0, (len(rows) - 1) // 2)]
+
+    def chemical():
+        return lower(chemicals)
+
+    def experiment():
+        return lower(experiments)
+
+    def protocol():
+        return lower(protocols)
+
+    def get(path):
+        return lambda i: ('GET', path() if callable(path) else path, None, auth)
+
+    csv_rows = 'name,cas_number,quantity,unit,location,minimum_stock\n' + ''.join(
+        f'Imported {n},{1000 + n}-00-1,{n % 50 + 1},g,Import shelf,5\n' for n in range(100))
+    return [
+        Scenario('auth.me', get('/api/auth/me')),
+        Scenario('inventory.list', get('/api/inventory/')),
+        Scenario('inventory.list_filtered', get('/api/inventory/?unit=ml&limit=50')),
+        Scenario('inventory.list_revalidate', lambda i: (
+            'GET', '/api/inventory/', None, {**auth, 'If-None-Match': ids['inventory_etag']}), (304,)),
+        Scenario('inventory.get', get(lambda: f'/api/inventory/{chemical()}')),
+        Scenario('inventory.totals', get('/api/inventory/totals?by=location')),
+        Scenario('inventory.experiments', get(lambda: f'/api/inventory/{chemical()}/experiments')),
+        Scenario('inventory.protocols', get(lambda: f'/api/inventory/{chemical()}/protocols')),
+        Scenario('inventory.movements', get(lambda: f'/api/inventory/{chemical()}/movements')),
+        Scenario('inventory.export', get('/api/inventory/export'), stream=True),
+        Scenario('experiments.list', get('/api/experiments/')),
+        Scenario('experiments.get', get(lambda: f'/api/experiments/{experiment()}')),
+        Scenario('experiments.usage', get(lambda: f'/api/experiments/{experiment()}/usage')),
+        Scenario('experiments.export', get('/api/experiments/export'), stream=True),
+        Scenario('safety.list', get('/api/safety/')),
+        Scenario('safety.get', get(lambda: f'/api/safety/{protocol()}')),
+        Scenario('safety.export', get('/api/safety/export'), stream=True),
+        Scenario('dashboard.metrics', get('/api/dashboard/metrics')),
+        Scenario('dashboard.alerts', get('/api/dashboard/alerts')),
+        Scenario('dashboard.forecast', get('/api/dashboard/forecast')),
+        Scenario('dashboard.events', get('/api/dashboard/events'), stream=True),
+        Scenario('search', get(lambda: f'/api/search/?q={rng.choice(["eth", "acid", "titration", "sodium"])}')),
+        Scenario('auth.register', lambda i: ('POST', '/api/auth/register', {
+            'username': f'bench{seed}-{i}', 'email': f'bench{seed}-{i}@example.com', 'password': 'bench-password',
+        }, {}), (201,)),
+        Scenario('auth.login', lambda i: ('POST', '/api/auth/login', {
+            'username': ids['username'], 'password': ids['password']}, {})),
+        Scenario('inventory.create', lambda i: ('POST', '/api/inventory/', {
+            'name': f'Benchmark reagent {i}', 'quantity': 100, 'unit': 'g', 'location': 'Bench', 'minimum_stock': 10,
+        }, auth), (201,)),
+        Scenario('inventory.update', lambda i: ('PUT', f'/api/inventory/{chemical()}', {
+            'location': f'Cabinet {rng.choice("ABC")}{rng.randint(1, 20)}'}, auth)),
+        Scenario('inventory.import', lambda i: ('POST', '/api/inventory/import?format=csv', csv_rows, auth)),
+        Scenario('experiments.create', lambda i: ('POST', '/api/experiments/', {
+            'title': f'Benchmark experiment {i}', 'description': 'Created by the benchmark'}, auth), (201,)),
+        Scenario('experiments.update', lambda i: ('PUT', f'/api/experiments/{experiment()}', {
+            'results': f'Benchmark run {i}'}, auth)),
+        Scenario('experiments.consume', lambda i: ('POST', f'/api/experiments/{experiment()}/consume', {
+            'items': [{'chemical_id': chemical(), 'amount': 0.001}]}, auth), (201,)),
+        Scenario('experiments.batch', lambda i: ('POST', '/api/experiments/batch', {'operations': [
+            {'op': 'create', 'data': {'title': f'Benchmark batch {i}.{j}', 'chemicals_used': f'[{chemical()}]'}}
+            for j in range(100)
+        ]}, {**auth, 'Idempotency-Key': f'benchmark-{i}'})),
+        Scenario('safety.create', lambda i: ('POST', '/api/safety/', {
+            'title': f'Benchmark protocol {i}', 'description': 'Created by the benchmark', 'category': 'general',
+        }, auth), (201,)),
+        Scenario('safety.update', lambda i: ('PUT', f'/api/safety/{protocol()}', {
+            'description': f'Revised by benchmark run {i}'}, auth)),
+        Scenario('inventory.delete', lambda i: ('DELETE', f'/api/inventory/{chemicals[-1 - i]}', None, auth)),
+        Scenario('experiments.delete', lambda i: ('DELETE', f'/api/experiments/{experiments[-1 - i]}', None, auth)),
+        Scenario('safety.delete', lambda i: ('DELETE', f'/api/safety/{protocols[-1 - i]}', None, auth)),
+    ]
+
+
+def _encode(body):
+    if body is None or isinstance(body, str):
+        return body, 'text/csv'
+    return json.dumps(body), 'application/json'
+
+
+def client_sender(app):
+    client = app.test_client()
+
+    def send(scenario, method, path, body, headers):
+        data, content_type = _encode(body)
+        response = client.open(path, method=method, data=data, headers=headers,
+                               content_type=content_type, buffered=not scenario.stream)
+        if scenario.stream:
+            # Exports stream until done; the event stream never ends, so stop at its first event
+            for chunk in response.response:
+                if scenario.name == 'dashboard.events' and b'event:' in chunk:
+                    break
+        response.close()
+        return response.status_code
+    return send
+
+
+def server_sender(port):
+    def send(scenario, method, path, body, headers):
+        data, content_type = _encode(body)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        conn.request(method, path, data, {**headers, 'Content-Type': content_type})
+        response = conn.getresponse()
+        if scenario.name == 'dashboard.events':
+            while b'event:' not in response.fp.readline():
+                pass
+        else:
+            response.read()
+        conn.close()
+        return response.status
+    return send
+
+
+def serve(env, port, ready):
+    os.environ.update(env)
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    app = create_app()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('instrumentation.slow_queries').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def run(scenario, count, send, concurrency):
+    def timed(i):
+        method, path, body, headers = scenario.request(i)
+        start = time.perf_counter()
+        status = send(scenario, method, path, body, headers)
+        return status, (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, range(count)))
+    else:
+        results = [timed(i) for i in range(count)]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(ms for _, ms in results)
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    q = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': count,
+        'errors': sum(1 for status, _ in results if status not in scenario.expected),
+        'status': statuses,
+        'throughput_rps': round(count / elapsed, 1),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(q[94], 2),
+        'p99_ms': round(q[98], 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold):
+    """Print p50/p95 changes against ``baseline``; return the scenarios whose p95 regressed."""
+    print(f'\nagainst {baseline["meta"].get("git_commit") or "baseline"} '
+          f'({baseline["meta"]["created_at"]}), regression threshold {threshold:g}% on p95')
+    for key in ('mode', 'concurrency', 'dataset', 'cpu_count'):
+        if report['meta'][key] != baseline['meta'].get(key):
+            print(f'warning: {key} differs ({baseline["meta"].get(key)} -> {report["meta"][key]}); '
+                  f'latencies are not comparable')
+    print(f'{"scenario":28} {"p50 ms":>9} {"change":>8} {"p95 ms":>9} {"change":>8}')
+    regressions = []
+    for name, result in report['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            print(f'{name:28} {result["p50_ms"]:9.2f} {"new":>8} {result["p95_ms"]:9.2f} {"new":>8}')
+            continue
+        p50 = (result['p50_ms'] / before['p50_ms'] - 1) * 100 if before['p50_ms'] else 0
+        p95 = (result['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0
+        flag = '  REGRESSION' if p95 > threshold else ''
+        if flag:
+            regressions.append(name)
+        print(f'{name:28} {result["p50_ms"]:9.2f} {p50:+7.1f}% {result["p95_ms"]:9.2f} {p95:+7.1f}%{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--chemicals', type=int, default=100_000)
+    parser.add_argument('--experiments', type=int, default=20_000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--protocols', type=int, default=1_000)
+    parser.add_argument('--labs', type=int, default=1, help='labs the data is spread over')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--server', action='store_true', help='use a local threaded WSGI server')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads with --server')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', help='comma-separated scenario names')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='earlier JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed p95 regression in percent')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    env = {'DATABASE_URL': f'sqlite:///{path}', 'EVENTS_MAX_CLIENTS': str(max(200, args.concurrency))}
+    os.environ.update(env)
+    from app import create_app
+    import datagen
+    import migrations
+
+    logging.getLogger('instrumentation.slow_queries').setLevel(logging.ERROR)
+    app = create_app()
+    start = time.perf_counter()
+    with app.app_context():
+        migrations.upgrade_all()
+        datagen.generate(args.chemicals, args.experiments, args.users, args.protocols, labs=args.labs,
+                         seed=args.seed)
+    print(f'Generated {args.chemicals:,} chemicals, {args.experiments:,} experiments, {args.users:,} users, '
+          f'{args.protocols:,} protocols in {args.labs} lab(s) in {time.perf_counter() - start:.1f}s')
+
+    # The requests come from an admin and only reach rows of the admin's lab
+    conn = sqlite3.connect(path)
+    ids = {}
+    ids['username'], lab_id = conn.execute(
+        "SELECT username, lab_id FROM users WHERE role = 'admin' ORDER BY id").fetchone()
+    for table in ('chemicals', 'experiments', 'safety_protocols'):
+        ids[table] = [row_id for row_id, in conn.execute(f'SELECT id FROM {table} WHERE lab_id = ? ORDER BY id',
+                                                         (lab_id,))]
+    conn.close()
+    ids['password'] = datagen.DEFAULT_PASSWORD
+
+    if args.server:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        context = multiprocessing.get_context('spawn')
+        ready = context.Event()
+        server = context.Process(target=serve, args=(env, port, ready), daemon=True)
+        server.start()
+        ready.wait()
+        send = server_sender(port)
+    else:
+        send = client_sender(app)
+    concurrency = args.concurrency if args.server else 1
+
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={'username': ids['username'], 'password': ids['password']}).json['access_token']
+    ids['inventory_etag'] = client.get('/api/inventory/', headers={'Authorization': f'Bearer {token}'}).headers['ETag']
+
+    scenarios = build_scenarios(ids, token, args.seed)
+    if args.only:
+        wanted = set(args.only.split(','))
+        scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+
+    report = {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'mode': 'server' if args.server else 'test_client',
+            'concurrency': concurrency,
+            'dataset': {'chemicals': args.chemicals, 'experiments': args.experiments,
+                        'users': args.users, 'protocols': args.protocols, 'seed': args.seed},
+        },
+        'scenarios': {},
+    }
+    print(f'\n{"scenario":28} {"req":>5} {"err":>4} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for scenario in scenarios:
+        count = min(args.requests, SLOW_SCENARIOS.get(scenario.name, args.requests))
+        result = run(scenario, count, send, concurrency)
+        report['scenarios'][scenario.name] = result
+        print(f'{scenario.name:28} {count:5} {result["errors"]:4} {result["throughput_rps"]:8.1f} '
+              f'{result["p50_ms"]:9.2f} {result["p95_ms"]:9.2f} {result["p99_ms"]:9.2f}')
+    if args.server:
+        server.terminate()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nWrote {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} scenario(s) regressed: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
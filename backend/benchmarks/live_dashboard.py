@@ -0,0 +1,179 @@
+"""
+Compare polling dashboards with the server-pushed change feed.
+
+Starts the app on a threaded local HTTP server in a separate process with
+``--clients`` open dashboards while a writer changes one chemical every
+``--write-interval`` seconds. In ``poll`` mode each dashboard fetches
+``/api/dashboard/metrics`` and ``/alerts`` every ``--poll-interval`` seconds,
+as the page used to; in ``stream`` mode each holds one
+``/api/dashboard/events`` connection. Reports the SQL statements the server
+executed per second and how long after a write the dashboards saw it.
+
+    cd backend
+    python -m benchmarks.live_dashboard --clients 50 --seconds 20
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'correct horse battery staple'
+
+
+def serve(env, port, statements, ready):
+    os.environ.update(env)
+    from sqlalchemy import event
+    from werkzeug.serving import make_server
+    from app import create_app
+    from models import db, User, Chemical
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade_all()
+        user = User(username='bench', email='bench@example.com', role='admin')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.add_all(
+            Chemical(name=f'Chemical {i}', quantity=100, unit='g', minimum_stock=10, location='Shelf')
+            for i in range(100)
+        )
+        db.session.commit()
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count(*args):
+            with statements.get_lock():
+                statements.value += 1
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def request(port, method, path, token, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+    conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, data
+
+
+def poller(port, token, interval, stop, seen):
+    while not stop.is_set():
+        _, data = request(port, 'GET', '/api/dashboard/metrics', token)
+        request(port, 'GET', '/api/dashboard/alerts', token)
+        seen(json.loads(data)['low_stock_chemicals'])
+        stop.wait(interval)
+
+
+def streamer(port, token, stop, seen):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.request('GET', f'/api/dashboard/events?jwt={token}')
+    response = conn.getresponse()
+    name = None
+    while not stop.is_set():
+        line = response.fp.readline().decode().strip()
+        if line.startswith('event: '):
+            name = line[len('event: '):]
+        elif line.startswith('data: ') and name == 'metrics':
+            seen(json.loads(line[len('data: '):])['low_stock_chemicals'])
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--mode', choices=['poll', 'stream', 'both'], default='both')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--poll-interval', type=float, default=5)
+    parser.add_argument('--write-interval', type=float, default=1)
+    args = parser.parse_args()
+
+    modes = ['poll', 'stream'] if args.mode == 'both' else [args.mode]
+    print(f'{args.clients} dashboards, {args.seconds:g}s, one write every {args.write_interval:g}s, '
+          f'polling every {args.poll_interval:g}s\n')
+    print(f'{"mode":8} {"SQL/s":>8} {"writes":>7} {"seen p50 ms":>12} {"seen p95 ms":>12}')
+    for mode in modes:
+        env = {
+            'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'),
+            'EVENTS_MAX_CLIENTS': str(args.clients),
+        }
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        context = multiprocessing.get_context('spawn')
+        statements = context.Value('l', 0)
+        ready = context.Event()
+        server = context.Process(target=serve, args=(env, port, statements, ready), daemon=True)
+        server.start()
+        ready.wait()
+
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('POST', '/api/auth/login', json.dumps({'username': 'bench', 'password': PASSWORD}),
+                     {'Content-Type': 'application/json'})
+        token = json.loads(conn.getresponse().read())['access_token']
+        conn.close()
+
+        # Write n flips one more chemical to low stock; note when each client first sees a count >= n
+        written = {}
+        delays = []
+        lock = threading.Lock()
+
+        def make_seen():
+            first = set()
+
+            def seen(low_stock):
+                now = time.perf_counter()
+                with lock:
+                    for write, at in written.items():
+                        if write <= low_stock and write not in first:
+                            first.add(write)
+                            delays.append((now - at) * 1000)
+            return seen
+
+        stop = threading.Event()
+        target = streamer if mode == 'stream' else poller
+        extra = () if mode == 'stream' else (args.poll_interval,)
+        clients = [
+            threading.Thread(target=target, args=(port, token) + extra + (stop, make_seen()), daemon=True)
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        time.sleep(1)
+
+        start_statements = statements.value
+        start = time.perf_counter()
+        writes = 0
+        while time.perf_counter() - start < args.seconds:
+            writes += 1
+            with lock:
+                written[writes] = time.perf_counter()
+            request(port, 'PUT', f'/api/inventory/{writes}', token, {'quantity': 1})
+            time.sleep(args.write_interval)
+        elapsed = time.perf_counter() - start
+        executed = statements.value - start_statements
+        stop.set()
+        server.terminate()
+
+        delays.sort()
+        p50 = statistics.median(delays) if delays else float('nan')
+        p95 = statistics.quantiles(delays, n=100)[94] if len(delays) > 1 else float('nan')
+        print(f'{mode:8} {executed / elapsed:8.1f} {writes:7} {p50:12.1f} {p95:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Simulate a shift change: many technicians logging in at once.
+
+Starts the app on a threaded local HTTP server in a separate process, creates
+``--users`` accounts, then fires one ``POST /api/auth/login`` per user from
+``--concurrency`` client threads and reports throughput, p50/p95/p99 latency
+and the number of logins shed with 503. Compare settings by passing the
+password-hashing options, e.g.:
+
+    cd backend
+    python -m benchmarks.login_storm --users 300 --concurrency 300
+    python -m benchmarks.login_storm --method pbkdf2:sha256:100000 --hash-workers 2
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'correct horse battery staple'
+
+
+def serve(env, port, users, ready):
+    os.environ.update(env)
+    from werkzeug.security import generate_password_hash
+    from werkzeug.serving import make_server
+    from app import create_app
+    from models import db, User
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade_all()
+        password_hash = generate_password_hash(PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+        db.session.add_all(
+            User(username=f'tech{i}', email=f'tech{i}@example.com', password_hash=password_hash)
+            for i in range(users)
+        )
+        db.session.commit()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def login(port, i):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    body = json.dumps({'username': f'tech{i}', 'password': PASSWORD})
+    start = time.perf_counter()
+    conn.request('POST', '/api/auth/login', body, {'Content-Type': 'application/json'})
+    status = conn.getresponse().status
+    elapsed = (time.perf_counter() - start) * 1000
+    conn.close()
+    return status, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=300)
+    parser.add_argument('--method', default=None, help='PASSWORD_HASH_METHOD')
+    parser.add_argument('--hash-workers', type=int, default=None, help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--hash-queue', type=int, default=None, help='PASSWORD_HASH_QUEUE')
+    args = parser.parse_args()
+
+    env = {'DATABASE_URL': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')}
+    for name, value in (('PASSWORD_HASH_METHOD', args.method),
+                        ('PASSWORD_HASH_WORKERS', args.hash_workers),
+                        ('PASSWORD_HASH_QUEUE', args.hash_queue)):
+        if value is not None:
+            env[name] = str(value)
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    server = context.Process(target=serve, args=(env, port, args.users, ready), daemon=True)
+    server.start()
+    ready.wait()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda i: login(port, i), range(args.users)))
+    elapsed = time.perf_counter() - start
+    server.terminate()
+
+    ok = sorted(ms for status, ms in results if status == 200)
+    shed = sum(1 for status, _ in results if status == 503)
+    failed = len(results) - len(ok) - shed
+    print(f'{args.users} logins, {args.concurrency} concurrent, {", ".join(f"{k}={v}" for k, v in env.items() if k != "DATABASE_URL") or "default settings"}')
+    print(f'  throughput {len(ok) / elapsed:8.1f} logins/s')
+    if len(ok) > 1:
+        q = statistics.quantiles(ok, n=100)
+        print(f'  latency    p50 {statistics.median(ok):8.1f} ms  p95 {q[94]:8.1f} ms  p99 {q[98]:8.1f} ms')
+    print(f'  shed (503) {shed}   failed {failed}')
+
+
+if __name__ == '__main__':
+    main()
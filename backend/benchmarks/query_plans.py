@@ -0,0 +1,155 @@
+"""
+Show how the migrations change the query plans of the hot list/dashboard queries.
+
+Builds a throwaway SQLite database with a synthetic inventory (1M chemicals by
+default), strips the secondary indexes to mimic a database created before the
+migrations existed, then prints ``EXPLAIN QUERY PLAN`` and median latency for
+each query before and after ``migrations.upgrade()``. The queries are scoped
+to a lab as the application's are (see tenancy.py).
+
+    cd backend
+    python -m benchmarks.query_plans --chemicals 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TODAY = date.today()
+
+HOT_QUERIES = [
+    ('inventory: location filter, keyset page',
+     "SELECT id, name FROM chemicals WHERE lab_id = 1 AND location = 'Cabinet B7' AND id > 1000 ORDER BY id LIMIT 101"),
+    ('inventory: cas_number filter',
+     "SELECT id, name FROM chemicals WHERE lab_id = 1 AND cas_number = '64-17-5' ORDER BY id LIMIT 101"),
+    ('inventory: name prefix',
+     "SELECT id, name FROM chemicals WHERE lab_id = 1 AND name LIKE 'Sodium Chl%' ESCAPE '/' LIMIT 101"),
+    ('inventory: order=updated_at page',
+     "SELECT id, name FROM chemicals WHERE lab_id = 1 ORDER BY updated_at, id LIMIT 101"),
+    ('alerts: expiry window sweep',
+     f"SELECT id FROM chemicals WHERE expiry_date BETWEEN '{TODAY - timedelta(days=365)}' "
+     f"AND '{TODAY + timedelta(days=30)}'"),
+    ('alerts: low-stock sweep',
+     'SELECT id FROM chemicals WHERE (quantity <= minimum_stock) = 1'),
+    ('experiments: status count',
+     "SELECT COUNT(*) FROM experiments WHERE lab_id = 1 AND status = 'in_progress'"),
+    ('experiments: per-user status list',
+     "SELECT id, title FROM experiments WHERE lab_id = 1 AND user_id = 7 AND status = 'completed' ORDER BY id LIMIT 101"),
+    ('safety: category filter',
+     "SELECT id, title FROM safety_protocols WHERE lab_id = 1 AND category = 'emergency' ORDER BY id LIMIT 101"),
+]
+
+NAMES = ['Sodium Chloride', 'Ethanol', 'Acetone', 'Hydrochloric Acid', 'Sulfuric Acid',
+         'Sodium Hydroxide', 'Methanol', 'Toluene', 'Hexane', 'Potassium Nitrate']
+CAS = ['7647-14-5', '64-17-5', '67-64-1', '7647-01-0', '7664-93-9',
+       '1310-73-2', '67-56-1', '108-88-3', '110-54-3', '7757-79-1']
+UNITS = ['ml', 'l', 'g', 'kg', 'mg']
+STATUSES = ['in_progress', 'completed', 'completed', 'completed', 'cancelled']
+CATEGORIES = ['general', 'chemical_specific', 'emergency', 'ppe']
+
+
+def populate(conn, chemicals, experiments, protocols, users):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    def chemical_rows():
+        for i in range(chemicals):
+            k = rng.randrange(len(NAMES))
+            stamp = now - timedelta(seconds=rng.randrange(10 ** 8))
+            yield (
+                f'{NAMES[k]} {i}', CAS[k], rng.uniform(0, 1000), rng.choice(UNITS),
+                f'Cabinet {chr(65 + rng.randrange(26))}{rng.randrange(20)}',
+                TODAY + timedelta(days=rng.randrange(-1500, 1500)),
+                rng.choice([0, 10, 50, 100]), stamp, stamp,
+            )
+
+    conn.executemany(
+        'INSERT INTO users (username, email, password_hash, role, created_at) VALUES (?, ?, ?, ?, ?)',
+        ((f'user{i}', f'user{i}@example.com', '-', 'technician', now) for i in range(users))
+    )
+    conn.executemany(
+        'INSERT INTO chemicals (name, cas_number, quantity, unit, location, expiry_date, '
+        'minimum_stock, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        chemical_rows()
+    )
+    conn.executemany(
+        'INSERT INTO experiments (title, user_id, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+        ((f'Experiment {i}', rng.randrange(1, users + 1), rng.choice(STATUSES), now, now)
+         for i in range(experiments))
+    )
+    conn.executemany(
+        'INSERT INTO safety_protocols (title, description, category, created_at, updated_at) '
+        'VALUES (?, ?, ?, ?, ?)',
+        ((f'Protocol {i}', '-', rng.choice(CATEGORIES), now, now) for i in range(protocols))
+    )
+    conn.commit()
+
+
+def measure(conn, repeat):
+    results = {}
+    for label, sql in HOT_QUERIES:
+        plan = '; '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[label] = (plan, statistics.median(timings))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--chemicals', type=int, default=1_000_000)
+    parser.add_argument('--experiments', type=int, default=200_000)
+    parser.add_argument('--protocols', type=int, default=10_000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    from app import create_app
+    from models import db
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade_all()
+    conn = sqlite3.connect(path)
+    # Mimic a database created before the migrations: no secondary indexes
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'").fetchall():
+        conn.execute(f'DROP INDEX {name}')
+    conn.execute('DELETE FROM schema_migrations')
+    conn.commit()
+
+    print(f'Populating {args.chemicals:,} chemicals, {args.experiments:,} experiments ...')
+    populate(conn, args.chemicals, args.experiments, args.protocols, args.users)
+    before = measure(conn, args.repeat)
+
+    start = time.perf_counter()
+    with app.app_context():
+        migrations.upgrade(db.engine)
+    print(f'migrations.upgrade() took {time.perf_counter() - start:.1f}s\n')
+    # Reconnect: cached EXPLAIN statements would otherwise report the old plans
+    conn.close()
+    conn = sqlite3.connect(path)
+    after = measure(conn, args.repeat)
+
+    for label, _ in HOT_QUERIES:
+        (plan_before, ms_before), (plan_after, ms_after) = before[label], after[label]
+        print(label)
+        print(f'  before {ms_before:9.2f} ms  {plan_before}')
+        print(f'  after  {ms_after:9.2f} ms  {plan_after}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
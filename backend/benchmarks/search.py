@@ -0,0 +1,114 @@
+"""
+Measure full-text search latency over a large synthetic lab.
+
+Builds a throwaway SQLite database with 1M experiments by default (each with
+a few sentences of procedure and results text) plus a chemical inventory,
+then reports the median and worst latency of ``search.search()`` for typical
+queries, from rare terms to very common ones and type-ahead prefixes.
+
+    cd backend
+    python -m benchmarks.search --experiments 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.query_plans import CAS, NAMES
+
+QUERIES = [
+    ('chemicals', 'eth'),
+    ('chemicals', '64-17'),
+    ('chemicals', 'sodium chl'),
+    ('experiments', 'titration'),
+    ('experiments', 'distil'),
+    ('experiments', 'sodium hydroxide'),
+    ('experiments', 'solution'),
+    ('protocols', 'spill'),
+]
+
+VERBS = ['Add', 'Stir', 'Heat', 'Filter', 'Dilute', 'Titrate', 'Distil', 'Cool', 'Weigh', 'Dissolve']
+NOUNS = ['solution', 'precipitate', 'sample', 'residue', 'mixture', 'extract', 'filtrate', 'crystals']
+TITLES = ['Titration', 'Distillation', 'Recrystallization', 'Extraction', 'Calibration', 'Synthesis']
+
+
+def sentence(rng):
+    return (f'{rng.choice(VERBS)} {rng.randrange(1, 500)} ml of {rng.choice(NAMES).lower()} '
+            f'to the {rng.choice(NOUNS)} and {rng.choice(VERBS).lower()} the {rng.choice(NOUNS)}.')
+
+
+def populate(conn, chemicals, experiments, protocols):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    conn.execute("INSERT INTO users (username, email, password_hash, role, created_at) "
+                 "VALUES ('bench', 'bench@example.com', '-', 'technician', ?)", (now,))
+    conn.executemany(
+        'INSERT INTO chemicals (name, cas_number, quantity, unit, minimum_stock, created_at, updated_at) '
+        'VALUES (?, ?, 1, ?, 0, ?, ?)',
+        ((f'{NAMES[k]} {i}', CAS[k], 'g', now, now)
+         for i, k in ((i, rng.randrange(len(NAMES))) for i in range(chemicals)))
+    )
+    conn.executemany(
+        'INSERT INTO experiments (title, description, procedure, results, user_id, status, created_at, updated_at) '
+        "VALUES (?, ?, ?, ?, 1, 'completed', ?, ?)",
+        ((f'{rng.choice(TITLES)} {i}', sentence(rng),
+          ' '.join(sentence(rng) for _ in range(4)), sentence(rng), now, now)
+         for i in range(experiments))
+    )
+    conn.executemany(
+        'INSERT INTO safety_protocols (title, description, category, created_at, updated_at) '
+        "VALUES (?, ?, 'general', ?, ?)",
+        ((f'Protocol {i}', 'Contain any spill and ' + sentence(rng), now, now) for i in range(protocols))
+    )
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--chemicals', type=int, default=100_000)
+    parser.add_argument('--experiments', type=int, default=1_000_000)
+    parser.add_argument('--protocols', type=int, default=10_000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    from app import create_app
+    from models import DEFAULT_LAB_ID
+    import migrations
+    import search
+    import tenancy
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade_all()
+    print(f'Populating {args.experiments:,} experiments, {args.chemicals:,} chemicals ...')
+    start = time.perf_counter()
+    conn = sqlite3.connect(path)
+    populate(conn, args.chemicals, args.experiments, args.protocols)
+    conn.close()
+    print(f'Loaded and indexed in {time.perf_counter() - start:.1f}s\n')
+
+    # Scoped to a lab, as every request is
+    with app.app_context(), tenancy.scoped(DEFAULT_LAB_ID):
+        for kind, query in QUERIES:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                results = search.search(query, [kind], args.limit, 0)
+                timings.append((time.perf_counter() - start) * 1000)
+            hits = len(results[kind]['items'])
+            print(f'{kind:12} {query!r:20} median {statistics.median(timings):8.2f} ms  '
+                  f'max {max(timings):8.2f} ms  ({hits} results)')
+
+
+if __name__ == '__main__':
+    main()
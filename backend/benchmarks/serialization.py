@@ -0,0 +1,93 @@
+"""
+Compare the old and new list serialization paths for each model.
+
+For every model this loads all rows of a synthetic table and encodes them to
+JSON three ways, reporting the time spent loading rows and encoding them:
+
+* old: ORM objects, ``to_dict()`` per row, Flask's default JSON provider
+* new (stdlib): ``Row`` tuples from the list query, ``JSONProvider`` on the
+  standard library
+* new (orjson): the same with orjson, when it is installed
+
+    cd backend
+    python -m benchmarks.serialization --rows 100000
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.query_plans import populate
+
+
+def best_of(repeat, fn):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    from flask.json.provider import DefaultJSONProvider
+    from sqlalchemy.orm import joinedload
+    from app import create_app
+    from models import db, Chemical, Experiment, SafetyProtocol
+    from queries import CHEMICAL_LIST, EXPERIMENT_LIST, PROTOCOL_LIST
+    from serialization import JSONProvider, orjson, rows_to_dicts
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade_all()
+    conn = sqlite3.connect(path)
+    populate(conn, args.rows, args.rows, args.rows, users=100)
+    conn.close()
+
+    providers = [('old', DefaultJSONProvider(app))]
+    app.config['JSON_PROVIDER'] = 'stdlib'
+    providers.append(('new (stdlib)', JSONProvider(app)))
+    if orjson is not None:
+        app.config['JSON_PROVIDER'] = 'orjson'
+        providers.append(('new (orjson)', JSONProvider(app)))
+
+    models = [
+        ('chemicals', lambda: Chemical.query, CHEMICAL_LIST),
+        ('experiments', lambda: Experiment.query.options(joinedload(Experiment.user)), EXPERIMENT_LIST),
+        ('protocols', lambda: SafetyProtocol.query, PROTOCOL_LIST),
+    ]
+    print(f'{args.rows:,} rows per model, median of {args.repeat} runs\n')
+    print(f'{"model":12} {"path":14} {"load ms":>10} {"encode ms":>10} {"total ms":>10} {"MB":>7}')
+    with app.app_context():
+        for name, orm_query, spec in models:
+            for label, provider in providers:
+                if label == 'old':
+                    def load():
+                        # A fresh session per run, as in a request
+                        db.session.remove()
+                        return [obj.to_dict() for obj in orm_query().all()]
+                else:
+                    stmt, names, _, _ = spec.build({})
+                    load = lambda: rows_to_dicts(names, spec.attach(names, db.session.execute(stmt).all()))
+                load_ms, items = best_of(args.repeat, load)
+                encode_ms, body = best_of(args.repeat, lambda: provider.dumps(items))
+                print(f'{name:12} {label:14} {load_ms:10.1f} {encode_ms:10.1f} {load_ms + encode_ms:10.1f} '
+                      f'{len(body) / 1e6:7.1f}')
+
+
+if __name__ == '__main__':
+    main()
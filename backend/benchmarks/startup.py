@@ -0,0 +1,131 @@
+"""
+Measure application startup and check it against the checked-in budget.
+
+Each run boots the app in a fresh interpreter, the way a (non-preloaded)
+Gunicorn worker does, and records:
+
+* ``process_ms``: the whole child process, interpreter start to exit
+* ``import_ms``: ``import app``
+* ``create_app_ms``: ``create_app()``
+* ``first_request_ms`` / ``second_request_ms``: an authenticated
+  ``GET /api/inventory/`` through the test client; the first one pays for
+  opening the connection and compiling the statements
+* ``boot_connections``: database connections open after ``create_app()``,
+  which must stay 0: building the app does not touch the database
+
+The schema and a user are created once beforehand with ``db-upgrade``'s
+``migrations.upgrade_all()``, as a deploy does. The medians of ``--runs``
+runs are compared against ``startup_budget.json`` next to this file; with
+``--check`` the exit status is 1 when any of them is over budget, so it can
+gate a release::
+
+    cd backend
+    python -m benchmarks.startup --runs 5 --check
+
+The time budgets are about 1.4 times the medians measured when they were
+set, enough for run-to-run noise but not for a new eager import; raise them
+only together with the change that needs it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+
+# Runs in the child interpreter; argv[1] is the Authorization header
+BOOT = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+from models import db
+with application.app_context():
+    connections = sum(engine.pool.checkedin() + engine.pool.checkedout() for engine in db.engines.values())
+client = application.test_client()
+requests = []
+for _ in range(2):
+    before = time.perf_counter()
+    response = client.get('/api/inventory/', headers={'Authorization': sys.argv[1]})
+    requests.append((time.perf_counter() - before) * 1000)
+    if response.status_code != 200:
+        sys.exit(f'GET /api/inventory/ returned {response.status_code}')
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': requests[0],
+    'second_request_ms': requests[1],
+    'boot_connections': connections,
+}))
+'''
+
+METRICS = ('process_ms', 'import_ms', 'create_app_ms', 'first_request_ms', 'second_request_ms', 'boot_connections')
+
+
+def boot(env, authorization):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', BOOT, authorization], cwd=BACKEND, env=env,
+                            capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        sys.exit(f'App boot failed:\n{result.stderr}')
+    return {'process_ms': elapsed, **json.loads(result.stdout.splitlines()[-1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', default=BUDGET, help='JSON file of metric -> maximum median')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 when over budget')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    # Scheduled jobs would run in the background of the measured requests
+    env = {**os.environ, 'DATABASE_URL': f'sqlite:///{path}', 'SCHEDULER_ENABLED': '0'}
+    os.environ.update(env)
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    from models import db, User
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        authorization = f'Bearer {create_access_token(identity=user.id)}'
+
+    runs = [boot(env, authorization) for _ in range(args.runs)]
+    with open(args.budget) as f:
+        budget = json.load(f)
+
+    print(f'median of {args.runs} runs, budget from {os.path.relpath(args.budget)}\n')
+    print(f'{"metric":20} {"median":>9} {"max":>9} {"budget":>9}')
+    over = []
+    for metric in METRICS:
+        values = [run[metric] for run in runs]
+        median = statistics.median(values)
+        limit = budget.get(metric)
+        flag = ''
+        if limit is not None and median > limit:
+            flag = '  OVER BUDGET'
+            over.append(metric)
+        print(f'{metric:20} {median:9.1f} {max(values):9.1f} {"-" if limit is None else limit:>9}{flag}')
+    if over and args.check:
+        print(f'\n{len(over)} metric(s) over budget: {", ".join(over)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
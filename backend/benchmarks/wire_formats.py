@@ -0,0 +1,82 @@
+"""
+Bytes on the wire and encoding CPU for each list format and content coding.
+
+For every model and page size this loads one page of a synthetic table
+through its list query, encodes it in each format list endpoints offer
+(``serialization.list_formats()``: JSON objects, columnar JSON, and
+MessagePack when ``msgpack`` is installed) and compresses the body with each
+coding ``compression.py`` can produce (gzip, and brotli when ``brotli`` is
+installed). It reports the body size and the median time spent encoding and
+compressing, at the configured compression levels.
+
+    cd backend
+    python -m benchmarks.wire_formats --rows 20000 --page-sizes 100,1000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.query_plans import populate
+from benchmarks.serialization import best_of
+
+SHORT_NAMES = {
+    'application/json': 'json',
+    'application/vnd.chemlap.columns+json': 'columns+json',
+    'application/msgpack': 'msgpack',
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--page-sizes', default='100,1000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    page_sizes = [int(size) for size in args.page_sizes.split(',')]
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    from app import create_app
+    from compression import Encoder, encodings
+    from models import db
+    from queries import CHEMICAL_LIST, EXPERIMENT_LIST, PROTOCOL_LIST
+    from serialization import encode_list, list_formats
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade_all()
+    conn = sqlite3.connect(path)
+    populate(conn, args.rows, args.rows, args.rows, users=100)
+    conn.close()
+
+    models = [('chemicals', CHEMICAL_LIST), ('experiments', EXPERIMENT_LIST), ('protocols', PROTOCOL_LIST)]
+    print(f'median of {args.repeat} runs; gzip level {app.config["COMPRESS_GZIP_LEVEL"]}, '
+          f'brotli quality {app.config["COMPRESS_BROTLI_QUALITY"]}\n')
+    print(f'{"model":12} {"rows":>5} {"format":13} {"coding":9} {"bytes":>10} {"encode ms":>10} '
+          f'{"compress ms":>12} {"vs json":>8}')
+    with app.app_context():
+        for model, spec in models:
+            stmt, names, _, _ = spec.build({})
+            for size in page_sizes:
+                rows = spec.attach(names, db.session.execute(stmt.limit(size)).all())
+                baseline = None
+                for media_type in list_formats():
+                    encode_ms, body = best_of(args.repeat, lambda: encode_list(media_type, names, rows))
+                    for coding in ['identity'] + encodings():
+                        compress_ms, sent = 0.0, body
+                        if coding != 'identity':
+                            compress_ms, sent = best_of(
+                                args.repeat, lambda: Encoder(coding, app.config).compress(body))
+                        baseline = baseline or len(sent)
+                        print(f'{model:12} {len(rows):5} {SHORT_NAMES[media_type]:13} {coding:9} '
+                              f'{len(sent):10,} {encode_ms:10.2f} {compress_ms:12.2f} '
+                              f'{len(sent) / baseline:8.2f}')
+
+
+if __name__ == '__main__':
+    main()
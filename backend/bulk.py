@@ -0,0 +1,223 @@
+"""
+Bulk chemical import.
+
+Uploads (CSV or NDJSON) are read from the request stream one line at a time
+and processed in batches of ``IMPORT_BATCH_SIZE`` rows. Each batch is
+validated, matched against existing containers on (cas_number, location) with
+a single SELECT, and written with one executemany INSERT and version-checked
+executemany UPDATEs inside one transaction, together with the stock movements
+for every quantity they change. Rows are matched and added within the
+importing user's lab. Rows that fail validation are reported back
+individually and never abort the rest of their batch.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
+
+from models import db, Chemical
+import changes
+import ledger
+import tenancy
+import units
+
+CHEMICAL_FIELDS = (
+    'name', 'cas_number', 'quantity', 'unit', 'location',
+    'expiry_date', 'minimum_stock', 'safety_info',
+)
+
+IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+class RowError(ValueError):
+    """A single upload row is invalid."""
+
+
+def _number(value, field):
+    if isinstance(value, bool):
+        raise RowError(f'{field} must be a number')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} must be a number')
+
+
+def parse_chemical_row(record):
+    """Validate one upload row and return the column values it sets."""
+    if not isinstance(record, dict):
+        raise RowError('Row must be a JSON object')
+    row = {}
+    for field in CHEMICAL_FIELDS:
+        if field in record:
+            value = record[field]
+            if isinstance(value, str):
+                value = value.strip() or None
+            row[field] = value
+
+    if not row.get('name') or row.get('quantity') is None or not row.get('unit'):
+        raise RowError('Missing required fields')
+    row['quantity'] = _number(row['quantity'], 'quantity')
+    if 'minimum_stock' in row:
+        if row['minimum_stock'] is None:
+            row['minimum_stock'] = 0
+        row['minimum_stock'] = _number(row['minimum_stock'], 'minimum_stock')
+    if row.get('expiry_date'):
+        try:
+            row['expiry_date'] = datetime.strptime(row['expiry_date'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            raise RowError(f'Invalid date format. Use YYYY-MM-DD: {row["expiry_date"]}')
+    return row
+
+
+def read_csv(stream):
+    """Yield ``(row_number, record)`` from a CSV byte stream with a header row."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    try:
+        for number, record in enumerate(reader, start=1):
+            yield number, record
+    except (csv.Error, UnicodeDecodeError) as e:
+        yield reader.line_num, RowError(f'Malformed CSV: {e}')
+
+
+def read_ndjson(stream):
+    """Yield ``(line_number, record)`` from a newline-delimited JSON byte stream."""
+    lines = io.TextIOWrapper(stream, encoding='utf-8')
+    try:
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, RowError(f'Invalid JSON: {e}')
+    except UnicodeDecodeError as e:
+        yield None, RowError(f'Invalid UTF-8: {e}')
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def import_chemicals(records, batch_size):
+    """Upsert chemicals from ``(row_number, record)`` pairs; return a report."""
+    report = {'inserted': 0, 'updated': 0, 'failed': 0, 'errors': []}
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        _import_batch(batch, report)
+    report['failed'] = len(report['errors'])
+    return report
+
+
+def _import_batch(batch, report):
+    rows = []
+    for number, record in batch:
+        try:
+            if isinstance(record, RowError):
+                raise record
+            rows.append((number, parse_chemical_row(record)))
+        except RowError as e:
+            report['errors'].append({'row': number, 'error': str(e)})
+    if not rows:
+        return
+
+    # One indexed lookup per batch for the (cas_number, location) upsert key
+    cas_numbers = {row['cas_number'] for _, row in rows if row.get('cas_number')}
+    existing = {}
+    if cas_numbers:
+        matches = db.session.execute(
+            select(Chemical.id, Chemical.version, Chemical.cas_number, Chemical.location, Chemical.quantity)
+            .where(Chemical.cas_number.in_(cas_numbers))
+            .order_by(Chemical.id)
+        )
+        for chemical_id, version, cas_number, location, quantity in matches:
+            existing.setdefault((cas_number, location), (chemical_id, version, quantity))
+
+    now = datetime.utcnow()
+    inserts, updates, pending, previous = [], {}, {}, {}
+    for _, row in rows:
+        key = (row.get('cas_number'), row.get('location'))
+        if row.get('cas_number') and key in existing:
+            # A later row for the same container overrides earlier ones. The
+            # version makes the UPDATE fail rather than clobber a concurrent edit.
+            chemical_id, version, previous[chemical_id] = existing[key]
+            updates.setdefault(chemical_id, {'id': chemical_id, 'version': version}).update(row, updated_at=now)
+        elif row.get('cas_number') and key in pending:
+            pending[key].update(row)
+        else:
+            values = {field: row.get(field) for field in CHEMICAL_FIELDS}
+            if values['minimum_stock'] is None:
+                values['minimum_stock'] = 0
+            inserts.append(values)
+            if row.get('cas_number'):
+                pending[key] = values
+
+    lab_id = tenancy.assigned_lab()
+    for values in inserts:
+        values.update(units.base_values(values['quantity'], values['minimum_stock'], values['unit']), lab_id=lab_id)
+    # The version check guarantees each update replaces exactly the quantity read above
+    movements = [
+        {'chemical_id': chemical_id, 'delta': values['quantity'] - previous[chemical_id],
+         'quantity': values['quantity'], 'unit': values['unit'], 'reason': 'import', 'created_at': now}
+        for chemical_id, values in updates.items() if values['quantity'] != previous[chemical_id]
+    ]
+    try:
+        if inserts:
+            created = db.session.execute(
+                insert(Chemical).returning(Chemical.id, Chemical.quantity, Chemical.unit), inserts).all()
+            changes.record(db.session, 'chemicals', [row.id for row in created], 'insert')
+            movements += [
+                {'chemical_id': row.id, 'delta': row.quantity, 'quantity': row.quantity,
+                 'unit': row.unit, 'reason': 'import', 'created_at': now}
+                for row in created if row.quantity
+            ]
+        if updates:
+            _update_versioned(list(updates.values()))
+            # An update may leave the minimum stock as it was, so convert in SQL
+            units.refresh(db.session, updates.keys())
+            changes.record(db.session, 'chemicals', updates.keys(), 'update')
+        ledger.record(db.session, movements)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        for number, _ in rows:
+            report['errors'].append({'row': number, 'error': f'Failed to import batch: {e.__class__.__name__}'})
+        return
+
+    report['inserted'] += len(inserts)
+    report['updated'] += len(rows) - len(inserts)
+
+
+def _update_versioned(rows):
+    """executemany ``UPDATE ... WHERE id = ? AND version = ?`` that bumps the version.
+
+    Rows are grouped by the columns they set. A short total rowcount means a
+    concurrent edit won, and the whole batch is rolled back.
+    """
+    table = Chemical.__table__
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(k for k in row if k not in ('id', 'version'))), []).append(row)
+
+    for columns, group in groups.items():
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam('b_id'), table.c.version == bindparam('b_version'))
+            .values({
+                **{column: bindparam(f'b_{column}') for column in columns},
+                'version': table.c.version + 1,
+            })
+        )
+        params = [{f'b_{key}': value for key, value in row.items()} for row in group]
+        if db.session.execute(stmt, params).rowcount != len(group):
+            raise StaleDataError('Chemical was modified during import')
@@ -0,0 +1,84 @@
+"""
+Commit-time change notifications.
+
+Every flush records which rows were inserted, updated or deleted; once the
+transaction commits, listeners registered with ``on_commit`` are called with
+those changes. Caches and derived data can then be refreshed by the write
+handlers' own commits without each handler having to know about them.
+"""
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+Change = namedtuple('Change', ['table', 'id', 'op'])
+
+_listeners = []
+_pre_commit_listeners = []
+
+
+def on_commit(listener):
+    """Register ``listener(changes)``; ``changes`` is a list of ``Change`` tuples."""
+    _listeners.append(listener)
+    return listener
+
+
+def before_commit(listener):
+    """Register ``listener(session, changes)`` to run just before a commit."""
+    _pre_commit_listeners.append(listener)
+    return listener
+
+
+def record(session, table, row_ids, op):
+    """Record rows changed by bulk/Core statements, which bypass flush events."""
+    pending = session.info.setdefault('changes', [])
+    pending.extend(Change(table, row_id, op) for row_id in row_ids)
+
+
+def tables(changes):
+    return {change.table for change in changes}
+
+
+def ids(changes, table):
+    return {change.id for change in changes if change.table == table}
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    pending = session.info.setdefault('changes', [])
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            table = getattr(obj, '__tablename__', None)
+            if table is None or (op == 'update' and not session.is_modified(obj)):
+                continue
+            pending.append(Change(table, getattr(obj, 'id', None), op))
+
+
+@event.listens_for(Session, 'before_commit')
+def _prepare_changes(session):
+    if not _pre_commit_listeners:
+        return
+    session.flush()
+    changes = session.info.get('changes')
+    if changes:
+        for listener in _pre_commit_listeners:
+            listener(session, list(changes))
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_changes(session):
+    changes = session.info.pop('changes', None)
+    if not changes:
+        return
+    for listener in _listeners:
+        try:
+            listener(changes)
+        except Exception:
+            # A failing listener must never turn a committed write into an error
+            current_app.logger.exception('Commit listener %r failed', listener)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changes', None)
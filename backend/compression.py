@@ -0,0 +1,114 @@
+"""
+Negotiated response compression.
+
+Responses are compressed with brotli (when the ``brotli`` package is
+installed: ``pip install brotli``) or gzip, whichever the client's
+``Accept-Encoding`` prefers. Only JSON, NDJSON, MessagePack, CSV and plain
+text bodies are compressed, and buffered ones only from
+``COMPRESS_MIN_BYTES`` up: below that the saving does not pay for the CPU.
+Streamed responses (the exports) are compressed chunk by chunk and flushed
+after each one, so rows still reach the client as they are read and memory
+stays bounded by one batch. The dashboard's event stream is left alone, since
+proxies tend to buffer compressed event streams.
+
+A compressed body is another representation of the same resource, so its
+ETag is made weak. ``versions.conditional`` compares ETags weakly and still
+answers ``If-None-Match`` with ``304`` however the cached copy was encoded.
+"""
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = frozenset({
+    'application/json', 'application/x-ndjson', 'application/vnd.chemlap.columns+json',
+    'application/msgpack', 'text/csv', 'text/plain',
+})
+
+
+def encodings():
+    """The content codings this install can produce, preferred first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate(accept_encodings):
+    """The coding to use for a request's ``Accept-Encoding``, or ``None`` to send it as is."""
+    return accept_encodings.best_match(encodings())
+
+
+class Encoder:
+    """Compresses one response body, in one piece or as a stream of flushed chunks."""
+
+    def __init__(self, coding, config):
+        self.coding = coding
+        if coding == 'br':
+            compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+            self._process, self._flush, self._finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            # wbits 31: a gzip header and trailer around the deflate stream
+            compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+            self._process, self._finish = compressor.compress, compressor.flush
+            self._flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def compress(self, data):
+        """Compress a whole body."""
+        return self._process(data) + self._finish()
+
+    def chunk(self, data):
+        """Compress ``data`` and flush, so the client can decode everything sent so far."""
+        return self._process(data) + self._flush()
+
+    def finish(self):
+        return self._finish()
+
+
+def _compressed_stream(body, encoder):
+    try:
+        for chunk in body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if chunk:
+                yield encoder.chunk(chunk)
+        yield encoder.finish()
+    finally:
+        # Ends the export's server-side cursor even if the client went away
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def init_app(app):
+    """Compress eligible responses in an ``after_request`` hook."""
+    config = app.config
+    if not config['COMPRESS_RESPONSES']:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code != 200 or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+        coding = negotiate(request.accept_encodings)
+        if coding is None:
+            return response
+
+        encoder = Encoder(coding, config)
+        if response.is_streamed:
+            response.response = _compressed_stream(response.response, encoder)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < config['COMPRESS_MIN_BYTES']:
+                return response
+            response.set_data(encoder.compress(body))
+        response.headers['Content-Encoding'] = coding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
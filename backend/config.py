@@ -1,27 +1,160 @@
 import os
 from datetime import timedelta
-import warnings
+
+# Development defaults of the signing keys; create_app() logs a warning while
+# either is still in use outside development
+DEFAULT_SECRETS = {
+    'SECRET_KEY': 'dev-secret-key-change-in-production',
+    'JWT_SECRET_KEY': 'jwt-secret-key-change-in-production',
+}
+
 
 class Config:
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
+    SECRET_KEY = os.environ.get('SECRET_KEY') or DEFAULT_SECRETS['SECRET_KEY']
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///lab_management.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key-change-in-production'
+    
+    # Connection pool per worker process; pre-ping replaces connections that
+    # went stale while idle (in-memory SQLite ignores the pool sizing)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_pre_ping': True,
+    }
+    
+    # SQLite connection pragmas (see database.py)
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    
+    # Labs whose data lives in a SQLite database of its own (see tenancy.py),
+    # as 'lab_id=url' pairs separated by commas, e.g.
+    # LAB_DATABASES='2=sqlite:////data/lab-2.db,3=sqlite:////data/lab-3.db'.
+    # The main DATABASE_URL must then be a SQLite file too.
+    LAB_DATABASES = {
+        int(lab_id): url.strip()
+        for lab_id, _, url in (
+            pair.partition('=') for pair in os.environ.get('LAB_DATABASES', '').split(',') if pair.strip()
+        )
+    }
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or DEFAULT_SECRETS['JWT_SECRET_KEY']
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     
-    def __init__(self):
-        # Production warning
-        if self.SECRET_KEY == 'dev-secret-key-change-in-production':
-            warnings.warn(
-                'Using default SECRET_KEY in production is insecure! '
-                'Set the SECRET_KEY environment variable.',
-                stacklevel=2
-            )
+    # Password hashing: any werkzeug method string (e.g. 'scrypt:32768:8:1',
+    # 'pbkdf2:sha256:600000'); stored hashes are upgraded on the next login.
+    # Hashes run on a pool of PASSWORD_HASH_WORKERS threads per worker process,
+    # and logins beyond PASSWORD_HASH_QUEUE waiting ones get a 503.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 64))
+    
+    # Authenticated user lookups: entries cached per worker, and their lifetime
+    # in seconds (a change to a user evicts it at once in the writing worker)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    
+    # JSON encoder: 'auto' (orjson when installed), 'orjson' or 'stdlib'
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'auto')
+    
+    # API blueprints to register, as comma-separated names from app.BLUEPRINTS
+    # (unset: all). The routes of the others are not registered
+    API_BLUEPRINTS = [name.strip() for name in os.environ.get('API_BLUEPRINTS', '').split(',') if name.strip()]
+    
+    # Response compression (see compression.py): brotli when installed, else
+    # gzip, for bodies of at least COMPRESS_MIN_BYTES. Set COMPRESS_RESPONSES=0
+    # when a reverse proxy compresses instead
+    COMPRESS_RESPONSES = os.environ.get('COMPRESS_RESPONSES', '1') == '1'
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+    
+    # List endpoints (keyset pagination)
+    DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 100))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+    
+    # Full-text search results per type and page
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+    SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 100))
+    # Only the newest N matches of a query are ranked (0 ranks every match)
+    SEARCH_RANK_WINDOW = int(os.environ.get('SEARCH_RANK_WINDOW', 5000))
+    
+    # Streaming exports (rows fetched per server-side cursor batch)
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    
+    # Bulk chemical import: rows validated and written per transaction
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+    
+    # Batch writes: operations accepted per request, how long an Idempotency-Key's
+    # response is kept, and when expired keys are purged (local HH:MM)
+    BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', 1000))
+    IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    IDEMPOTENCY_CLEANUP_AT = os.environ.get('IDEMPOTENCY_CLEANUP_AT', '03:00')
+    
+    # Dashboard metrics cache lifetime in seconds (also invalidated on writes)
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 30))
+    
+    # Dashboard change feed (/api/dashboard/events): how often each worker checks
+    # for commits made by other processes, how long a burst of writes is
+    # coalesced, the keep-alive interval, the browser reconnect delay, and the
+    # per-client queue length and client limit per worker process
+    EVENTS_POLL_SECONDS = float(os.environ.get('EVENTS_POLL_SECONDS', 2))
+    EVENTS_COALESCE_MS = int(os.environ.get('EVENTS_COALESCE_MS', 200))
+    EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('EVENTS_HEARTBEAT_SECONDS', 15))
+    EVENTS_RETRY_MS = int(os.environ.get('EVENTS_RETRY_MS', 3000))
+    EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 32))
+    EVENTS_MAX_CLIENTS = int(os.environ.get('EVENTS_MAX_CLIENTS', 200))
+    
+    # Report the number of SQL statements per request in X-SQL-Queries
+    SQL_QUERY_COUNT_HEADER = os.environ.get('SQL_QUERY_COUNT_HEADER') == '1'
+    
+    # Log statements slower than this many milliseconds (0 disables), with their
+    # parameters unless SLOW_QUERY_LOG_PARAMS=0
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 200))
+    SLOW_QUERY_LOG_PARAMS = os.environ.get('SLOW_QUERY_LOG_PARAMS', '1') == '1'
+    
+    # Bearer token required by GET /metrics (unset: the endpoint is open, so
+    # keep it reachable only from the monitoring network)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Alerts: expiry look-ahead, cut-off for long-expired items, and how long
+    # resolved alerts are kept for since= delta clients (all in days)
+    ALERT_EXPIRY_WINDOW_DAYS = int(os.environ.get('ALERT_EXPIRY_WINDOW_DAYS', 30))
+    ALERT_EXPIRED_CUTOFF_DAYS = int(os.environ.get('ALERT_EXPIRED_CUTOFF_DAYS', 365))
+    ALERT_TOMBSTONE_DAYS = int(os.environ.get('ALERT_TOMBSTONE_DAYS', 30))
+    
+    # Background jobs (see scheduler.py). One worker at a time holds the lease
+    # and runs them; the others check every SCHEDULER_POLL_SECONDS and take over
+    # once a dead leader's lease expires. Failed runs are retried JOB_RETRIES
+    # times, JOB_RETRY_SECONDS apart and doubling; run history is kept
+    # JOB_HISTORY_DAYS days. Set SCHEDULER_ENABLED=0 to run jobs from cron with
+    # `flask run-job <name>` instead.
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '1') == '1'
+    SCHEDULER_POLL_SECONDS = int(os.environ.get('SCHEDULER_POLL_SECONDS', 30))
+    SCHEDULER_LEASE_SECONDS = int(os.environ.get('SCHEDULER_LEASE_SECONDS', 90))
+    JOB_RETRIES = int(os.environ.get('JOB_RETRIES', 3))
+    JOB_RETRY_SECONDS = int(os.environ.get('JOB_RETRY_SECONDS', 60))
+    JOB_HISTORY_DAYS = int(os.environ.get('JOB_HISTORY_DAYS', 30))
+    # Local time of day (HH:MM) each daily job runs at
+    EXPIRY_SWEEP_AT = os.environ.get('EXPIRY_SWEEP_AT', '00:05')
+    USAGE_ROLLUP_AT = os.environ.get('USAGE_ROLLUP_AT', '00:15')
+    REORDER_REPORT_AT = os.environ.get('REORDER_REPORT_AT', '00:30')
+    # Days of usage recomputed by each rollup run
+    USAGE_ROLLUP_DAYS = int(os.environ.get('USAGE_ROLLUP_DAYS', 7))
+    # Reorder reports: days of recent usage to cover, and reports kept
+    REORDER_COVER_DAYS = int(os.environ.get('REORDER_COVER_DAYS', 30))
+    REORDER_REPORTS_KEPT = int(os.environ.get('REORDER_REPORTS_KEPT', 30))
+    # Stock ledger: days of movements kept row by row before the daily
+    # compaction folds them into per-day totals, and when it runs
+    LEDGER_RETENTION_DAYS = int(os.environ.get('LEDGER_RETENTION_DAYS', 180))
+    LEDGER_COMPACTION_AT = os.environ.get('LEDGER_COMPACTION_AT', '01:00')
+    # Stock-out forecast: default days of history the burn rate is averaged
+    # over, and how far ahead a stock-out makes a chemical "at risk"
+    FORECAST_WINDOW_DAYS = int(os.environ.get('FORECAST_WINDOW_DAYS', 30))
+    FORECAST_HORIZON_DAYS = int(os.environ.get('FORECAST_HORIZON_DAYS', 30))
+
 
-# Trigger warning if using default keys
-if Config.SECRET_KEY == 'dev-secret-key-change-in-production' and os.environ.get('FLASK_ENV') != 'development':
-    warnings.warn(
-        'Using default SECRET_KEY in production is insecure! '
-        'Set the SECRET_KEY environment variable.',
-        stacklevel=2
-    )
+def default_secrets(config):
+    """Names of the signing keys in ``config`` that still have their development defaults."""
+    return [name for name, default in DEFAULT_SECRETS.items() if config.get(name) == default]
@@ -0,0 +1,87 @@
+"""
+Engine tuning for serving from several workers.
+
+SQLite's default rollback journal locks the whole database file for the
+length of every write transaction, so a single stock update stalls every
+dashboard and list reader in every worker. Each new connection is switched to
+write-ahead logging instead, where readers keep reading the last committed
+snapshot while one writer appends to the log:
+
+* ``journal_mode=WAL``: readers and the writer no longer block each other
+  (persistent, stored in the database file).
+* ``synchronous=NORMAL``: fsync on checkpoints rather than on every commit;
+  with WAL this is still corruption-safe, only the last commits before a power
+  loss can be lost.
+* ``busy_timeout``: a second writer waits for the lock instead of failing
+  immediately with "database is locked".
+* ``mmap_size``: reads are served from a memory map instead of ``read()``
+  calls into the page cache.
+
+The session class also lets modules route statements to other engines than
+the bind keys would (see ``router``).
+"""
+import flask_sqlalchemy.session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Pool arguments that SQLite's in-memory StaticPool does not accept
+_QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+_routers = []
+
+
+def router(route):
+    """Register ``route(mapper, clause)``, returning the engine to run a statement on or ``None``."""
+    _routers.append(route)
+    return route
+
+
+class Session(flask_sqlalchemy.session.Session):
+    """Flask-SQLAlchemy's session, asking the registered routers for an engine first."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            for route in _routers:
+                engine = route(mapper, clause)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _sqlite_pragmas(config):
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+
+
+def configure(app):
+    """Adjust engine options for the configured URL; call before ``db.init_app``."""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        for key in _QUEUE_POOL_OPTIONS:
+            options.pop(key, None)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def init_app(app, db):
+    """Apply the SQLite pragmas to every connection the app's engines open."""
+    pragmas = _sqlite_pragmas(app.config)
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    for engine in db.engines.values():
+        if engine.dialect.name != 'sqlite':
+            continue
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+        # Connections opened before the listener was attached (none, normally)
+        engine.dispose()
@@ -0,0 +1,328 @@
+"""
+Synthetic lab data for capacity planning and benchmarks.
+
+``generate()`` adds users, chemicals, experiments and safety protocols with
+realistic shapes rather than uniform noise:
+
+* roles: a few admins, mostly technicians, some read-only viewers
+* chemicals: a catalogue of common reagents in liquid or solid units;
+  containers are partly used, so roughly one in ten is at or below its
+  minimum stock; shelf life runs from the purchase date, so older stock has
+  expired or is about to, and stable salts have no expiry date
+* experiments: a few users own most of them; older experiments are mostly
+  completed, recent ones in progress; texts name the chemicals used
+* protocols: one of the four categories, linked to a few chemicals
+* stock movements: each container is received full when purchased and used
+  down to its quantity by a few withdrawals spread up to today
+* labs: with ``labs`` above one, users, chemicals and protocols are spread
+  over that many labs, a few large and many small; experiments are in their
+  owner's lab and only use its chemicals
+
+The chemical links of experiments and protocols are inserted with them.
+
+Rows are written with one executemany ``INSERT`` per batch and recorded
+with ``changes.record``, so the alerts, table versions and search indexes
+stay in step exactly as for a bulk import. Output is deterministic for a
+given ``seed`` and database. Ids are assigned from the current maximum, so
+run it while nothing else writes to the database. Every generated user can
+log in with ``password``::
+
+    cd backend
+    flask --app app generate-data --chemicals 1000000 --experiments 200000 --users 5000
+"""
+import json
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+
+import changes
+import passwords
+import units
+from models import (
+    db, Lab, User, Chemical, Experiment, SafetyProtocol, ExperimentChemicalLink, ProtocolChemicalLink, StockMovement
+)
+
+DEFAULT_PASSWORD = 'synthetic-password'
+
+# (name, CAS number, liquid, shelf life in years or None when it does not expire)
+REAGENTS = [
+    ('Sodium Chloride', '7647-14-5', False, None),
+    ('Potassium Chloride', '7447-40-7', False, None),
+    ('Ethanol', '64-17-5', True, 5),
+    ('Methanol', '67-56-1', True, 3),
+    ('Acetone', '67-64-1', True, 3),
+    ('Isopropanol', '67-63-0', True, 3),
+    ('Hydrochloric Acid', '7647-01-0', True, 2),
+    ('Sulfuric Acid', '7664-93-9', True, 5),
+    ('Nitric Acid', '7697-37-2', True, 2),
+    ('Acetic Acid', '64-19-7', True, 2),
+    ('Sodium Hydroxide', '1310-73-2', False, 3),
+    ('Potassium Hydroxide', '1310-58-3', False, 3),
+    ('Toluene', '108-88-3', True, 4),
+    ('Hexane', '110-54-3', True, 4),
+    ('Dichloromethane', '75-09-2', True, 3),
+    ('Ethyl Acetate', '141-78-6', True, 3),
+    ('Hydrogen Peroxide', '7722-84-1', True, 1),
+    ('Potassium Nitrate', '7757-79-1', False, None),
+    ('Sodium Bicarbonate', '144-55-8', False, 3),
+    ('Magnesium Sulfate', '7487-88-9', False, None),
+    ('Copper(II) Sulfate', '7758-98-7', False, None),
+    ('Silver Nitrate', '7761-88-8', False, 2),
+    ('Glucose', '50-99-7', False, 2),
+    ('Tris Base', '77-86-1', False, 4),
+    ('EDTA', '60-00-4', False, 4),
+    ('Phenolphthalein', '77-09-8', False, 5),
+]
+LIQUID_UNITS = [('ml', 500), ('ml', 1000), ('l', 2.5), ('l', 5)]
+SOLID_UNITS = [('g', 100), ('g', 500), ('kg', 1), ('mg', 5000)]
+HAZARDS = {
+    'Acid': 'Corrosive - wear gloves, goggles and a lab coat; dilute by adding acid to water',
+    'Hydroxide': 'Corrosive - avoid contact with skin and eyes',
+    'Peroxide': 'Oxidizer - keep away from organic material; store cool',
+    'Nitrate': 'Oxidizer - keep away from combustible material',
+}
+FLAMMABLE = 'Flammable - keep away from heat sources and store in the flammables cabinet'
+ROLES = ['admin'] * 2 + ['technician'] * 78 + ['viewer'] * 20
+CATEGORIES = ['general', 'chemical_specific', 'emergency', 'ppe']
+TECHNIQUES = ['Titration', 'Recrystallization', 'Distillation', 'Extraction', 'Buffer preparation',
+              'Calibration', 'Synthesis', 'Chromatography', 'Spectroscopy', 'Stability test']
+OUTCOMES = ['Yield was within the expected range.', 'Results were reproducible across three runs.',
+            'Endpoint was difficult to observe; repeat with fresh indicator.',
+            'Sample showed slight discoloration after drying.', 'Calibration curve was linear (R2 > 0.99).']
+
+
+def _batches(count, batch_size):
+    for start in range(0, count, batch_size):
+        yield start, min(batch_size, count - start)
+
+
+def _insert(model, rows, links=None):
+    """Insert ``rows`` with one executemany, record them and commit; return the new ids.
+
+    Ids are assigned here, after the current maximum: splicing ``RETURNING``
+    results back together costs more than the insert itself for large batches.
+    ``links`` is ``(link model, owner column, JSON column)``: the chemical ids
+    in each row's JSON column are inserted as link rows in the same commit.
+    """
+    first = (db.session.scalar(select(func.max(model.__table__.c.id))) or 0) + 1
+    ids = list(range(first, first + len(rows)))
+    for row_id, row in zip(ids, rows):
+        row['id'] = row_id
+    db.session.execute(model.__table__.insert(), rows)
+    changes.record(db.session, model.__tablename__, ids, 'insert')
+    if links:
+        link_model, owner_column, column = links
+        link_rows = [
+            {owner_column: row_id, 'chemical_id': chemical_id}
+            for row_id, row in zip(ids, rows) for chemical_id in sorted(set(json.loads(row[column])))
+        ]
+        if link_rows:
+            db.session.execute(link_model.__table__.insert(), link_rows)
+            changes.record(db.session, link_model.__tablename__, ids, 'insert')
+    db.session.commit()
+    return ids
+
+
+def _safety_info(name, liquid):
+    for word, info in HAZARDS.items():
+        if word in name:
+            return info
+    return FLAMMABLE if liquid else None
+
+
+def _chemical(rng, number, today):
+    """Return a chemical row and the size of its container."""
+    name, cas_number, liquid, shelf_years = rng.choice(REAGENTS)
+    unit, container = rng.choice(LIQUID_UNITS if liquid else SOLID_UNITS)
+    # Purchases are spread over five years, weighted towards recent ones
+    purchased = today - timedelta(days=int(rng.triangular(0, 5 * 365, 0)))
+    expiry_date = None
+    if shelf_years:
+        expiry_date = purchased + timedelta(days=int(shelf_years * 365 * rng.uniform(0.8, 1.2)))
+    minimum_stock = 0 if rng.random() < 0.3 else round(container * rng.choice([0.1, 0.2, 0.25]), 2)
+    # Containers are partly used, slightly more often full than empty
+    quantity = round(container * rng.betavariate(1.1, 1), 2)
+    stamp = datetime.combine(purchased, datetime.min.time()) + timedelta(seconds=rng.randrange(86400))
+    return {
+        'name': f'{name} #{number}',
+        'cas_number': cas_number,
+        'quantity': quantity,
+        'unit': unit,
+        'location': f'Cabinet {chr(65 + rng.randrange(26))}{rng.randrange(1, 21)}',
+        'expiry_date': expiry_date,
+        'minimum_stock': minimum_stock,
+        'safety_info': _safety_info(name, liquid),
+        **units.base_values(quantity, minimum_stock, unit),
+        'created_at': stamp,
+        'updated_at': stamp + timedelta(days=rng.randrange(0, max(1, (today - purchased).days + 1))),
+    }, container
+
+
+def _movements(rng, chemical_id, row, container, now):
+    """The ledger of one container: received full, then withdrawn down to its quantity."""
+    received = row['created_at']
+    movements = [{'chemical_id': chemical_id, 'delta': container, 'quantity': container, 'unit': row['unit'],
+                  'reason': 'create', 'created_at': received}]
+    used = round(container - row['quantity'], 2)
+    if used <= 0:
+        return movements
+    span = max((now - received).total_seconds(), 1)
+    stamps = sorted(received + timedelta(seconds=rng.uniform(0, span)) for _ in range(rng.randint(1, 6)))
+    weights = [rng.random() + 0.1 for _ in stamps]
+    remaining = container
+    for stamp, weight in zip(stamps, weights):
+        amount = round(used * weight / sum(weights), 4)
+        remaining -= amount
+        movements.append({'chemical_id': chemical_id, 'delta': -amount, 'quantity': round(remaining, 4),
+                          'unit': row['unit'], 'reason': 'consume', 'created_at': stamp})
+    # Rounding leftovers go to the last withdrawal so the ledger sums to the quantity
+    movements[-1]['delta'] += round(row['quantity'] - remaining, 4)
+    movements[-1]['quantity'] = row['quantity']
+    return movements
+
+
+def _experiment(rng, number, owner, linkable, today):
+    age = int(rng.expovariate(1 / 200))
+    created = datetime.combine(today - timedelta(days=age), datetime.min.time()) \
+        + timedelta(seconds=rng.randrange(86400))
+    if age < 30:
+        status = rng.choices(['in_progress', 'completed', 'cancelled'], [70, 25, 5])[0]
+    else:
+        status = rng.choices(['in_progress', 'completed', 'cancelled'], [5, 85, 10])[0]
+    technique = rng.choice(TECHNIQUES)
+    used = rng.sample(linkable, min(len(linkable), rng.randint(1, 4)))
+    reagents = ', '.join(name for _, name in used)
+    return {
+        'title': f'{technique} {number}',
+        'description': f'{technique} using {reagents or "standard reagents"}.',
+        'procedure': f'Prepare the sample, add {reagents or "the reagents"} and record observations every 10 minutes.',
+        'results': rng.choice(OUTCOMES) if status == 'completed' else None,
+        'chemicals_used': json.dumps([chemical_id for chemical_id, _ in used]),
+        'user_id': owner,
+        'status': status,
+        'created_at': created,
+        'updated_at': created + timedelta(hours=rng.randrange(0, 24 * 14)),
+    }
+
+
+def _protocol(rng, number, linkable, now):
+    category = rng.choice(CATEGORIES)
+    name, _, liquid, _ = rng.choice(REAGENTS)
+    related = [chemical_id for chemical_id, _ in rng.sample(linkable, min(len(linkable), rng.randint(0, 3)))]
+    stamp = now - timedelta(days=rng.randrange(0, 3 * 365))
+    return {
+        'title': f'{category.replace("_", " ").title()} protocol {number}: {name}',
+        'description': _safety_info(name, liquid) or f'Handle {name} with standard laboratory precautions.',
+        'category': category,
+        'related_chemicals': json.dumps(related),
+        'created_at': stamp,
+        'updated_at': stamp,
+    }
+
+
+def _labs(count):
+    """The ids of the first ``count`` labs, adding labs named 'Lab <n>' as needed."""
+    lab_ids = db.session.scalars(select(Lab.id).order_by(Lab.id).limit(count)).all()
+    for number in range(len(lab_ids) + 1, count + 1):
+        lab = Lab(name=f'Lab {number}')
+        db.session.add(lab)
+        db.session.flush()
+        lab_ids.append(lab.id)
+    db.session.commit()
+    return lab_ids
+
+
+def generate(chemicals=0, experiments=0, users=0, protocols=0, labs=1, seed=42, batch_size=5000,
+             password=DEFAULT_PASSWORD, progress=None):
+    """Add synthetic rows to the current app's database; return the counts added.
+
+    Experiments are spread over the generated users (or the existing ones when
+    ``users`` is 0) with a long-tailed ownership distribution. ``progress``, if
+    given, is called with ``(table, rows_done, rows_total)`` after each batch.
+    """
+    rng = random.Random(seed)
+    # Separate streams, so the ledger and the labs do not change the other rows a seed gives
+    ledger_rng = random.Random(seed + 1)
+    lab_rng = random.Random(seed + 2)
+    today = date.today()
+    now = datetime.utcnow()
+    offset = db.session.scalar(select(func.max(User.id))) or 0
+
+    # Lab sizes follow a Zipf-like curve too
+    lab_ids = _labs(labs)
+    lab_weights = [1 / (rank + 1) for rank in range(len(lab_ids))]
+
+    def pick_labs(k):
+        return lab_rng.choices(lab_ids, lab_weights, k=k)
+
+    user_labs = {}
+    if users:
+        password_hash = passwords.hash_password(password)
+        for start, size in _batches(users, batch_size):
+            rows = [
+                {'username': f'user{offset + start + i}', 'email': f'user{offset + start + i}@example.com',
+                 'password_hash': password_hash, 'role': rng.choice(ROLES), 'created_at': now, 'lab_id': lab_id}
+                for i, lab_id in zip(range(size), pick_labs(size))
+            ]
+            user_labs.update(zip(_insert(User, rows), (row['lab_id'] for row in rows)))
+            if progress:
+                progress('users', start + size, users)
+    else:
+        user_labs = dict(db.session.execute(select(User.id, User.lab_id).order_by(User.id)).all())
+    user_ids = list(user_labs)
+    if experiments and not user_ids:
+        raise ValueError('Experiments need at least one user')
+
+    # Experiments and protocols reference (id, name) pairs from the first 10,000 chemicals of their lab
+    linkable = {lab_id: [] for lab_id in lab_ids}
+    for start, size in _batches(chemicals, batch_size):
+        rows, containers = zip(*(_chemical(rng, start + i + 1, today) for i in range(size)))
+        for row, lab_id in zip(rows, pick_labs(size)):
+            row['lab_id'] = lab_id
+        ids = _insert(Chemical, list(rows))
+        _insert(StockMovement, [
+            movement for chemical_id, row, container in zip(ids, rows, containers)
+            for movement in _movements(ledger_rng, chemical_id, row, container, now)
+        ])
+        for chemical_id, row in zip(ids, rows):
+            lab_linkable = linkable.setdefault(row['lab_id'], [])
+            if len(lab_linkable) < 10000:
+                lab_linkable.append((chemical_id, row['name'].split(' #')[0]))
+        if progress:
+            progress('chemicals', start + size, chemicals)
+    if not chemicals:
+        ranked = select(
+            Chemical.id, Chemical.name, Chemical.lab_id,
+            func.row_number().over(partition_by=Chemical.lab_id, order_by=Chemical.id).label('number'),
+        ).subquery()
+        for chemical_id, name, lab_id in db.session.execute(
+            select(ranked.c.id, ranked.c.name, ranked.c.lab_id).where(ranked.c.number <= 10000)
+        ):
+            linkable.setdefault(lab_id, []).append((chemical_id, name))
+
+    if experiments:
+        # Ownership follows a Zipf-like curve: the busiest users run most experiments
+        weights = [1 / (rank + 1) for rank in range(len(user_ids))]
+        owners = rng.sample(user_ids, len(user_ids))
+        for start, size in _batches(experiments, batch_size):
+            batch_owners = rng.choices(owners, weights, k=size)
+            rows = [
+                _experiment(rng, start + i + 1, owner, linkable.get(user_labs[owner], []), today)
+                for i, owner in enumerate(batch_owners)
+            ]
+            for row in rows:
+                row['lab_id'] = user_labs[row['user_id']]
+            _insert(Experiment, rows, (ExperimentChemicalLink, 'experiment_id', 'chemicals_used'))
+            if progress:
+                progress('experiments', start + size, experiments)
+
+    for start, size in _batches(protocols, batch_size):
+        rows = []
+        for i, lab_id in zip(range(size), pick_labs(size)):
+            rows.append(dict(_protocol(rng, start + i + 1, linkable.get(lab_id, []), now), lab_id=lab_id))
+        _insert(SafetyProtocol, rows, (ProtocolChemicalLink, 'protocol_id', 'related_chemicals'))
+        if progress:
+            progress('safety_protocols', start + size, protocols)
+
+    return {'users': users, 'chemicals': chemicals, 'experiments': experiments, 'protocols': protocols}
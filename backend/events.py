@@ -0,0 +1,192 @@
+"""
+Server-pushed change feed for the dashboard.
+
+Instead of every open dashboard polling the metrics and alerts endpoints, one
+background thread per worker process watches for changes and fans them out
+to all connected clients. Each ``Topic`` (``metrics``, ``alerts``,
+``inventory``...) is recomputed and encoded once per change, however many
+clients are listening.
+
+The thread wakes immediately after any local commit (``on_commit``) and
+otherwise every ``EVENTS_POLL_SECONDS``, so commits made by other worker
+processes are picked up from ``table_versions`` with one primary-key lookup
+per tick. Bursts of writes are coalesced for ``EVENTS_COALESCE_MS``. Alerts
+changed by the scheduled expiry sweep reach clients the same way.
+
+Every event carries the full current state of its topic, so a client whose
+bounded queue (``EVENTS_QUEUE_SIZE``) fills up loses nothing by skipping
+ahead: its backlog is replaced by the latest event of each topic.
+
+Clients only receive their own lab's events: topics are computed once per
+lab with a connected client, scoped to that lab (see tenancy.py).
+"""
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+import tenancy
+import versions
+from changes import on_commit
+from models import db
+
+
+class TooManySubscribers(Exception):
+    """This worker already streams to ``EVENTS_MAX_CLIENTS`` clients."""
+
+
+class Topic:
+    """A named event computed by ``compute()`` whenever its inputs change.
+
+    Inputs are the ``table_versions`` counters of ``tables`` and, when given,
+    the value returned by ``version()``.
+    """
+
+    def __init__(self, name, compute, tables=(), version=None):
+        self.name = name
+        self.compute = compute
+        self.tables = tuple(tables)
+        self.version = version
+
+    def key(self, found):
+        key = tuple(found[table][0] if table in found else 0 for table in self.tables)
+        if self.version is not None:
+            key += (self.version(),)
+        return key
+
+
+class Subscription:
+    """One client's bounded queue of encoded messages, for the events of ``lab_id``."""
+
+    def __init__(self, maxsize, lab_id):
+        self.maxsize = maxsize
+        self.lab_id = lab_id
+        self._messages = deque()
+        self._ready = threading.Condition()
+
+    def put(self, message, latest):
+        with self._ready:
+            if len(self._messages) >= self.maxsize:
+                # A slow client skips straight to the current state of each topic
+                self._messages.clear()
+                self._messages.extend(latest)
+            else:
+                self._messages.append(message)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Return the next message, or None after ``timeout`` seconds without one."""
+        with self._ready:
+            if not self._messages:
+                self._ready.wait(timeout)
+            return self._messages.popleft() if self._messages else None
+
+
+class Feed:
+    def __init__(self):
+        self.topics = []
+        self._subscribers = set()
+        # Per lab: the last message and inputs of each topic
+        self._latest = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._sequence = 0
+
+    def topic(self, name, compute, tables=(), version=None):
+        self.topics.append(Topic(name, compute, tables, version))
+
+    def notify(self):
+        self._wake.set()
+
+    def subscribe(self):
+        config = current_app.config
+        with self._lock:
+            if len(self._subscribers) >= config['EVENTS_MAX_CLIENTS']:
+                raise TooManySubscribers('Too many event stream clients')
+            lab_id = tenancy.current_lab()
+            subscription = Subscription(config['EVENTS_QUEUE_SIZE'], lab_id)
+            if not any(other.lab_id == lab_id for other in self._subscribers):
+                # Nothing was computed for the lab while nobody listened; start from fresh state
+                self._latest.pop(lab_id, None)
+                self._keys.pop(lab_id, None)
+            for message in self._latest.get(lab_id, {}).values():
+                subscription.put(message, ())
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._start(current_app._get_current_object())
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, lab_id, name, payload):
+        """Send an event to the clients of ``lab_id``."""
+        with self._lock:
+            self._sequence += 1
+            data = current_app.json.dumps(payload)
+            message = f'id: {self._sequence}\nevent: {name}\ndata: {data}\n\n'
+            self._latest.setdefault(lab_id, {})[name] = message
+            latest = list(self._latest[lab_id].values())
+            for subscription in self._subscribers:
+                if subscription.lab_id == lab_id:
+                    subscription.put(message, latest)
+
+    def tick(self):
+        """Publish every topic whose inputs changed, for each lab with a client."""
+        with self._lock:
+            labs = {subscription.lab_id for subscription in self._subscribers}
+        tables = sorted({table for topic in self.topics for table in topic.tables})
+        for lab_id in labs:
+            with tenancy.scoped(lab_id):
+                try:
+                    found = versions.current(tables)
+                    keys = self._keys.setdefault(lab_id, {})
+                    for topic in self.topics:
+                        key = topic.key(found)
+                        if key != keys.get(topic.name):
+                            self.publish(lab_id, topic.name, topic.compute())
+                            keys[topic.name] = key
+                finally:
+                    # Ids repeat across lab databases, so no object may carry over
+                    db.session.remove()
+
+    def _start(self, app):
+        self._thread = threading.Thread(target=self._run, args=(app,), name='events-feed', daemon=True)
+        self._thread.start()
+
+    def _run(self, app):
+        while True:
+            if self._wake.wait(app.config['EVENTS_POLL_SECONDS']):
+                # Let a burst of commits settle into one update
+                time.sleep(app.config['EVENTS_COALESCE_MS'] / 1000)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    self.tick()
+            except Exception:
+                app.logger.exception('Event feed update failed')
+
+
+feed = Feed()
+
+
+@on_commit
+def _wake_feed(changes):
+    feed.notify()
+
+
+def stream(subscription, heartbeat, retry_ms):
+    """Yield the subscription's messages as ``text/event-stream`` chunks."""
+    try:
+        yield f'retry: {retry_ms}\n\n'
+        while True:
+            message = subscription.get(heartbeat)
+            # A comment line keeps proxies from closing an idle connection
+            yield message if message is not None else ': keepalive\n\n'
+    finally:
+        feed.unsubscribe(subscription)
@@ -0,0 +1,149 @@
+"""
+Stock-out forecasts from the stock movement ledger.
+
+Forecasts are computed for the whole inventory at once. One query loads
+every outflow in the window and another the chemicals' quantities, minimum
+stock and age. Both go straight from the database cursor into NumPy arrays,
+and the burn rates then come from one ``bincount`` over the outflows rather
+than a Python loop per chemical:
+
+* ``daily_usage`` is a chemical's outflow over the window divided by the days
+  of the window it existed for (at least one)
+* ``days_until_stockout`` is its quantity divided by that rate, and
+  ``days_until_minimum`` the same for the stock above its minimum
+
+Each outflow is converted from the unit it was recorded in to the chemical's
+current unit (``units.ratio``), so a chemical relabelled from ``g`` to ``kg``
+mid-window is not charged its old quantities as kilograms. Outflows in a unit
+of another dimension, or in an unknown unit other than the current one, are
+left out. Chemicals with no outflow in the window have no stock-out date.
+Outflows of deleted chemicals are ignored. The queries run on the session's connection,
+which the lab scoping of ORM statements does not reach, so they filter by the
+current lab themselves.
+"""
+from datetime import datetime, timedelta
+from itertools import chain
+
+import numpy as np
+from sqlalchemy import func, select
+
+import ledger
+import tenancy
+import units
+from models import db, Chemical
+
+# SQLite's julianday() of the Unix epoch
+UNIX_EPOCH_JULIAN = 2440587.5
+
+
+def _julian(moment):
+    return (moment - datetime(1970, 1, 1)).total_seconds() / 86400 + UNIX_EPOCH_JULIAN
+
+
+def _array(stmt):
+    """Run ``stmt`` and return its rows as a 2-D float array, one column per selected value.
+
+    The rows are read from the DBAPI cursor: every value is a plain number, so
+    building ``Row`` objects would only slow the load down.
+    """
+    result = db.session.connection().execute(stmt)
+    columns = len(result.keys())
+    values = np.fromiter(chain.from_iterable(result.cursor), dtype=float)
+    result.close()
+    return values.reshape(-1, columns)
+
+
+def compute(window_days, now=None, chemical_ids=None, used_only=False):
+    """Forecast every chemical, those in ``chemical_ids``, or (``used_only``) those with outflows.
+
+    Returns a dict of equally long arrays keyed ``chemical_id``, ``quantity``,
+    ``minimum_stock``, ``daily_usage``, ``days_until_stockout`` and
+    ``days_until_minimum`` (``inf`` where nothing was used), in id order.
+    """
+    now = now or datetime.utcnow()
+    start = now - timedelta(days=window_days)
+    flows = ledger.outflows_since(start).subquery()
+    # Each outflow in its chemical's current unit; ones that cannot be converted count as nothing
+    outflows = (
+        select(flows.c.chemical_id, func.coalesce(flows.c.amount * units.ratio(flows.c.unit, Chemical.unit), 0))
+        .select_from(flows.join(Chemical, Chemical.id == flows.c.chemical_id))
+    )
+
+    stmt = select(
+        Chemical.id, Chemical.quantity, func.coalesce(Chemical.minimum_stock, 0),
+        func.coalesce(func.julianday(Chemical.created_at), 0),
+    ).order_by(Chemical.id)
+    if chemical_ids is not None:
+        stmt = stmt.where(Chemical.id.in_(chemical_ids))
+        outflows = outflows.where(Chemical.id.in_(chemical_ids))
+    elif used_only:
+        stmt = stmt.where(Chemical.id.in_(select(flows.c.chemical_id)))
+    lab_id = tenancy.current_lab()
+    if lab_id is not None:
+        stmt = stmt.where(Chemical.lab_id == lab_id)
+        outflows = outflows.where(Chemical.lab_id == lab_id)
+    chemicals = _array(stmt)
+    ids = chemicals[:, 0].astype(np.int64)
+    quantity, minimum_stock, created = chemicals[:, 1], chemicals[:, 2], chemicals[:, 3]
+
+    consumed = np.zeros(len(ids))
+    outflows = _array(outflows)
+    if len(outflows) and len(ids):
+        movement_ids = outflows[:, 0].astype(np.int64)
+        # Each outflow's row in the id-ordered chemicals
+        rows = np.searchsorted(ids, movement_ids).clip(max=len(ids) - 1)
+        known = ids[rows] == movement_ids
+        consumed = np.bincount(rows[known], weights=outflows[known, 1], minlength=len(ids))
+
+    observed_days = np.clip(_julian(now) - np.maximum(created, _julian(start)), 1, window_days)
+    daily_usage = consumed / observed_days
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_until_stockout = np.where(daily_usage > 0, np.maximum(quantity, 0) / daily_usage, np.inf)
+        days_until_minimum = np.where(
+            daily_usage > 0, np.maximum(quantity - minimum_stock, 0) / daily_usage, np.inf)
+    return {
+        'chemical_id': ids,
+        'quantity': quantity,
+        'minimum_stock': minimum_stock,
+        'daily_usage': daily_usage,
+        'days_until_stockout': days_until_stockout,
+        'days_until_minimum': days_until_minimum,
+    }
+
+
+def at_risk(window_days, horizon_days, limit, now=None, chemical_ids=None):
+    """Chemicals projected to run out within ``horizon_days``, soonest first.
+
+    Returns ``(items, total)`` where ``total`` counts every chemical at risk
+    and ``items`` holds at most ``limit`` of them.
+    """
+    now = now or datetime.utcnow()
+    # Chemicals without outflows never run out, so only the others are loaded
+    forecast = compute(window_days, now, chemical_ids, used_only=True)
+    risky = np.flatnonzero(forecast['days_until_stockout'] <= horizon_days)
+    order = risky[np.argsort(forecast['days_until_stockout'][risky], kind='stable')][:limit]
+
+    labels = {}
+    if len(order):
+        labels = {row.id: row for row in db.session.execute(
+            select(Chemical.id, Chemical.name, Chemical.unit)
+            .where(Chemical.id.in_(forecast['chemical_id'][order].tolist()))
+        )}
+
+    items = []
+    for row in order.tolist():
+        chemical_id = int(forecast['chemical_id'][row])
+        label = labels.get(chemical_id)
+        days_left = float(forecast['days_until_stockout'][row])
+        items.append({
+            'chemical_id': chemical_id,
+            'name': label.name if label else None,
+            'unit': label.unit if label else None,
+            'quantity': float(forecast['quantity'][row]),
+            'minimum_stock': float(forecast['minimum_stock'][row]),
+            'daily_usage': round(float(forecast['daily_usage'][row]), 4),
+            'days_until_stockout': round(days_left, 1),
+            'days_until_minimum': round(float(forecast['days_until_minimum'][row]), 1),
+            'stockout_date': (now + timedelta(days=days_left)).date().isoformat(),
+        })
+    return items, len(risky)
@@ -0,0 +1,42 @@
+"""
+Gunicorn settings for the production serving profile.
+
+    cd backend
+    flask --app app db-upgrade
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every worker is a separate process with its own connection pool. Starting the
+server never touches the schema: run ``db-upgrade`` once per deploy first.
+The app is loaded once in the master and the workers are forked from it
+(``PRELOAD_APP=0`` loads it in every worker instead), so a recycled worker
+starts without importing or configuring anything. Building the app opens no
+database connection, so none is shared across the fork. With preloading,
+``kill -HUP`` restarts the workers on the code already loaded; restart the
+master to deploy new code.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Threads let a worker keep serving reads while one of its requests waits on I/O;
+# each open /api/dashboard/events stream holds one thread for its lifetime
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+# Streaming exports and imports can outlive a keep-alive; keep idle sockets short
+keepalive = 5
+accesslog = '-'
+preload_app = os.environ.get('PRELOAD_APP', '1') == '1'
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    from models import db
+
+    app = server.app.wsgi()
+    with app.app_context():
+        # Connections are never shared with the master, should one be open
+        for engine in db.engines.values():
+            engine.dispose(close=False)
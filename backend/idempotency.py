@@ -0,0 +1,80 @@
+"""
+Idempotency keys for retried write requests.
+
+A client that may retry a request (after a timeout, say) sends the same
+``Idempotency-Key`` header each time. The response of the first successful
+attempt is stored in the same transaction as the writes it describes, so it
+exists exactly when they do; a retry gets that response back with an
+``Idempotent-Replayed: true`` header instead of being run again. Keys are
+scoped per user and kept for ``IDEMPOTENCY_KEY_TTL_HOURS``.
+"""
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import delete
+
+from models import db, IdempotencyKey
+from scheduler import job
+
+MAX_KEY_LENGTH = 255
+
+
+class KeyReused(Exception):
+    """The key was already used for a different request."""
+
+
+def request_key():
+    """The request's ``Idempotency-Key`` header, or None; raises ``ValueError`` if malformed."""
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters')
+    return key
+
+
+def fingerprint():
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _cutoff():
+    """Keys created before this have expired."""
+    return datetime.utcnow() - timedelta(hours=current_app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+
+
+def replay(user_id, key, request_fingerprint):
+    """Return the stored ``(body, status)`` for ``key``, or None if it has not been used.
+
+    An expired key counts as unused: its row is deleted in the current
+    transaction, so ``remember()`` can store the key afresh. Raises
+    ``KeyReused`` when the key was first sent with a different request.
+    """
+    stored = db.session.get(IdempotencyKey, (user_id, key))
+    if stored is None:
+        return None
+    if stored.created_at < _cutoff():
+        # The daily purge has not reached it yet
+        db.session.delete(stored)
+        return None
+    if stored.fingerprint != request_fingerprint:
+        raise KeyReused('Idempotency-Key was already used for a different request')
+    return stored.body, stored.status_code
+
+
+def remember(user_id, key, request_fingerprint, body, status_code):
+    """Store the response for ``key`` in the current transaction."""
+    db.session.add(IdempotencyKey(
+        user_id=user_id, key=key, fingerprint=request_fingerprint,
+        status_code=status_code, body=body, created_at=datetime.utcnow(),
+    ))
+
+
+@job('idempotency-cleanup', daily='IDEMPOTENCY_CLEANUP_AT')
+def purge_expired():
+    purged = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < _cutoff())).rowcount
+    db.session.commit()
+    return {'purged': purged}
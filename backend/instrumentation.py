@@ -0,0 +1,227 @@
+"""
+Request and SQL instrumentation.
+
+Every statement executed while handling a request is counted and timed on
+``flask.g``. When a request finishes, its latency, statement count and SQL
+time are recorded in per-endpoint histograms, which ``GET /metrics`` serves
+in the Prometheus text format (set ``METRICS_TOKEN`` to require
+``Authorization: Bearer <token>``). Each worker process keeps its own
+metrics, so under Gunicorn every scrape describes one worker.
+
+Statements slower than ``SLOW_QUERY_MS`` are logged to the
+``instrumentation.slow_queries`` logger with their SQL and, unless
+``SLOW_QUERY_LOG_PARAMS`` is off, their parameters.
+
+When ``SQL_QUERY_COUNT_HEADER`` is enabled the statement count is also
+reported in the ``X-SQL-Queries`` response header. ``count_queries()`` counts
+the statements run inside a block, so tests can assert that an endpoint
+issues a fixed number of queries whatever the row count::
+
+    with count_queries() as queries:
+        client.get('/api/experiments/', headers=auth)
+    assert queries.count == 1
+"""
+import bisect
+import hmac
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_query_logger = logging.getLogger('instrumentation.slow_queries')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+_local = threading.local()
+_slow_query_seconds = None
+_log_parameters = True
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+@contextmanager
+def count_queries():
+    counters = _local.__dict__.setdefault('counters', [])
+    counter = QueryCounter()
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        # An unlabelled counter is reported from zero before its first increment
+        self._values = {} if labels else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value:g}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects it."""
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {total:g}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request, by endpoint.',
+    ('endpoint', 'method'))
+REQUESTS = Counter(
+    'http_requests_total', 'Requests handled, by endpoint and status code.',
+    ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram(
+    'http_request_sql_queries', 'SQL statements executed per request, by endpoint.',
+    ('endpoint', 'method'), QUERY_COUNT_BUCKETS)
+REQUEST_SQL_TIME = Histogram(
+    'http_request_sql_duration_seconds', 'Time spent executing SQL per request, by endpoint.',
+    ('endpoint', 'method'))
+SQL_QUERIES = Counter('sql_queries_total', 'SQL statements executed, including background work.')
+SQL_TIME = Counter('sql_query_duration_seconds_total', 'Time spent executing SQL statements.')
+SLOW_QUERIES = Counter('sql_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS.')
+
+METRICS = (REQUEST_LATENCY, REQUESTS, REQUEST_QUERIES, REQUEST_SQL_TIME, SQL_QUERIES, SQL_TIME, SLOW_QUERIES)
+
+
+def expose():
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def _format_parameters(parameters, executemany):
+    if executemany:
+        text = f'{len(parameters)} rows, first {parameters[0]!r}' if parameters else '[]'
+    else:
+        text = repr(parameters)
+    return text if len(text) <= 1000 else text[:1000] + '...'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+    if has_app_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+    for counter in getattr(_local, 'counters', ()):
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    SQL_QUERIES.inc()
+    SQL_TIME.inc(amount=elapsed)
+    if has_app_context():
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+    if _slow_query_seconds is not None and elapsed >= _slow_query_seconds:
+        SLOW_QUERIES.inc()
+        if _log_parameters:
+            slow_query_logger.warning('Slow query (%.1f ms): %s; parameters: %s',
+                                      elapsed * 1000, statement, _format_parameters(parameters, executemany))
+        else:
+            slow_query_logger.warning('Slow query (%.1f ms): %s', elapsed * 1000, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _discard_failed_statement(context):
+    # after_cursor_execute does not run for a failed statement
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def init_app(app):
+    global _slow_query_seconds, _log_parameters
+    slow_ms = app.config['SLOW_QUERY_MS']
+    _slow_query_seconds = slow_ms / 1000 if slow_ms > 0 else None
+    _log_parameters = app.config['SLOW_QUERY_LOG_PARAMS']
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        # Unmatched URLs share one label so 404 scans cannot create new series
+        endpoint = request.endpoint or 'unmatched'
+        method = request.method
+        if 'request_start' in g:
+            REQUEST_LATENCY.observe(time.perf_counter() - g.request_start, endpoint, method)
+        REQUESTS.inc(endpoint, method, str(response.status_code))
+        REQUEST_QUERIES.observe(g.get('sql_queries', 0), endpoint, method)
+        REQUEST_SQL_TIME.observe(g.get('sql_seconds', 0.0), endpoint, method)
+        if app.config['SQL_QUERY_COUNT_HEADER']:
+            response.headers['X-SQL-Queries'] = str(g.get('sql_queries', 0))
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': 'Invalid metrics token'}), 401
+        return app.response_class(expose(), mimetype='text/plain; version=0.0.4')
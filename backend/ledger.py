@@ -0,0 +1,157 @@
+"""
+Append-only stock movement ledger.
+
+Every change to a chemical's quantity appends a row to ``stock_movements``
+with the signed change, the quantity after it, the reason and, where known,
+the experiment and user behind it. Rows are never updated, so the ledger is
+the chemical's usage history: its deltas sum to the current quantity.
+
+ORM writes (creating, editing and deleting chemicals) are recorded by a flush
+hook in the same transaction. Writers that change quantities with Core
+statements, such as stock consumption and the bulk import, call ``record``
+with the rows they changed.
+
+The daily ``ledger-compaction`` job folds movements older than
+``LEDGER_RETENTION_DAYS`` into ``stock_movements_daily`` (one row per day,
+chemical, reason and unit) and deletes them, so scans of the ledger stay
+bounded by the retention while the totals are kept.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import case, delete, event, exists, func, insert, inspect, literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import changes
+from models import db, Chemical, StockMovement, StockMovementDaily
+from scheduler import job
+
+# Days of movements compacted per transaction, so a first run over a long
+# history does not hold the write lock for the whole of it
+COMPACTION_CHUNK_DAYS = 31
+
+
+def record(session, movements):
+    """Append ``movements`` (dicts of ``StockMovement`` columns) in the session's transaction."""
+    if not movements:
+        return
+    session.connection().execute(insert(StockMovement.__table__), movements)
+    changes.record(session, StockMovement.__tablename__, [None], 'insert')
+
+
+def _current_user():
+    if not has_request_context():
+        return None
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        # Not a JWT-protected request
+        return None
+
+
+def _movement(chemical, delta, quantity, reason, user_id, now):
+    return {
+        'chemical_id': chemical.id, 'delta': delta, 'quantity': quantity, 'unit': chemical.unit,
+        'reason': reason, 'user_id': user_id, 'created_at': now,
+    }
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_orm_changes(session, flush_context):
+    movements = []
+    now = datetime.utcnow()
+    user_id = None
+    for obj in session.new:
+        if isinstance(obj, Chemical) and obj.quantity:
+            user_id = user_id or _current_user()
+            movements.append(_movement(obj, float(obj.quantity), obj.quantity, 'create', user_id, now))
+    for obj in session.dirty:
+        if not isinstance(obj, Chemical):
+            continue
+        history = inspect(obj).attrs.quantity.history
+        if history.added and history.deleted and history.added[0] != history.deleted[0]:
+            user_id = user_id or _current_user()
+            delta = float(history.added[0]) - float(history.deleted[0] or 0)
+            movements.append(_movement(obj, delta, history.added[0], 'adjust', user_id, now))
+    for obj in session.deleted:
+        if isinstance(obj, Chemical) and obj.quantity:
+            user_id = user_id or _current_user()
+            movements.append(_movement(obj, -float(obj.quantity), 0, 'delete', user_id, now))
+    record(session, movements)
+
+
+def opening_balances(conn):
+    """Migration step giving every chemical without movements one for its current quantity."""
+    table = StockMovement.__table__
+    conn.execute(insert(table).from_select(
+        ['chemical_id', 'delta', 'quantity', 'unit', 'reason', 'created_at'],
+        select(Chemical.id, Chemical.quantity, Chemical.quantity, Chemical.unit, literal('opening'),
+               func.coalesce(Chemical.updated_at, Chemical.created_at, func.datetime('now')))
+        .where(~exists().where(table.c.chemical_id == Chemical.id))
+    ))
+
+
+def outflows_since(start):
+    """``SELECT chemical_id, amount, unit`` of every outflow since ``start``, as a positive amount.
+
+    Recent movements come from the ledger itself and older ones from the
+    compacted daily totals, so any window can be read. Each amount is in the
+    unit the chemical had when it moved.
+    """
+    raw = (
+        select(StockMovement.chemical_id, (-StockMovement.delta).label('amount'), StockMovement.unit)
+        .where(StockMovement.created_at >= start, StockMovement.delta < 0)
+    )
+    compacted = (
+        select(StockMovementDaily.chemical_id, StockMovementDaily.consumed.label('amount'),
+               StockMovementDaily.unit)
+        .where(StockMovementDaily.day >= start.date(), StockMovementDaily.consumed > 0)
+    )
+    return raw.union_all(compacted)
+
+
+@job('ledger-compaction', daily='LEDGER_COMPACTION_AT')
+def compact(today=None):
+    """Fold movements older than the retention into daily totals; return the rows compacted."""
+    today = today or datetime.utcnow().date()
+    cutoff = datetime.combine(today - timedelta(days=current_app.config['LEDGER_RETENTION_DAYS']),
+                              datetime.min.time())
+    first = db.session.scalar(select(func.min(StockMovement.created_at)))
+    if first is None or first >= cutoff:
+        return {'before': cutoff.date().isoformat(), 'rows': 0, 'days': 0}
+
+    movements = StockMovement.__table__
+    daily = StockMovementDaily.__table__
+    compacted = days = 0
+    start = datetime.combine(first.date(), datetime.min.time())
+    while start < cutoff:
+        end = min(start + timedelta(days=COMPACTION_CHUNK_DAYS), cutoff)
+        in_chunk = (movements.c.created_at >= start) & (movements.c.created_at < end)
+        day = func.date(movements.c.created_at)
+        totals = sqlite_insert(daily).from_select(
+            ['day', 'chemical_id', 'reason', 'unit', 'delta', 'consumed', 'movements'],
+            select(day, movements.c.chemical_id, movements.c.reason, movements.c.unit,
+                   func.sum(movements.c.delta),
+                   func.sum(case((movements.c.delta < 0, -movements.c.delta), else_=0)),
+                   func.count())
+            .where(in_chunk)
+            .group_by(day, movements.c.chemical_id, movements.c.reason, movements.c.unit)
+        )
+        # A day already compacted (e.g. movements backdated into it) is added to
+        totals = totals.on_conflict_do_update(
+            index_elements=['day', 'chemical_id', 'reason', 'unit'],
+            set_={
+                'delta': daily.c.delta + totals.excluded.delta,
+                'consumed': daily.c.consumed + totals.excluded.consumed,
+                'movements': daily.c.movements + totals.excluded.movements,
+            },
+        )
+        days += db.session.execute(totals).rowcount
+        compacted += db.session.execute(delete(movements).where(in_chunk)).rowcount
+        changes.record(db.session, StockMovementDaily.__tablename__, [None], 'update')
+        changes.record(db.session, StockMovement.__tablename__, [None], 'delete')
+        db.session.commit()
+        start = end
+    return {'before': cutoff.date().isoformat(), 'rows': compacted, 'days': days}
@@ -0,0 +1,156 @@
+"""
+Chemical references of experiments and safety protocols.
+
+``Experiment.chemicals_used`` and ``SafetyProtocol.related_chemicals`` stay
+free-form JSON written by the client, but every chemical they reference is
+also stored as a row of ``experiment_chemical_links`` /
+``protocol_chemical_links``. Those rows are indexed by chemical, so "the
+experiments that used X" is one indexed join instead of a scan that parses
+every string.
+
+The links are derived whenever one of those columns is written through the
+ORM, in the same flush. A reference may be a chemical id, an object with a
+``chemical_id``/``id``, ``cas_number`` or ``name``, or a plain string matched
+against CAS numbers and then names (case-insensitively). References that match
+no chemical are kept in the JSON but not linked.
+"""
+import json
+from itertools import chain
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from models import Chemical, Experiment, ExperimentChemicalLink, SafetyProtocol, ProtocolChemicalLink
+
+# model -> (JSON column, link model, link column pointing back at the model)
+LINKED = {
+    Experiment: ('chemicals_used', ExperimentChemicalLink, 'experiment_id'),
+    SafetyProtocol: ('related_chemicals', ProtocolChemicalLink, 'protocol_id'),
+}
+
+BATCH_SIZE = 500
+
+
+def parse_references(value):
+    """Return the chemical ids (ints) and names/CAS numbers (strs) referenced by ``value``."""
+    if not value:
+        return []
+    try:
+        items = json.loads(value)
+    except ValueError:
+        items = value.split(',')
+    if not isinstance(items, list):
+        items = [items]
+
+    references = []
+    for item in items:
+        if isinstance(item, dict):
+            item = next((item[key] for key in ('chemical_id', 'id', 'cas_number', 'cas', 'name')
+                         if isinstance(item.get(key), (int, str)) and not isinstance(item.get(key), bool)), None)
+        if isinstance(item, bool):
+            continue
+        if isinstance(item, str):
+            item = item.strip()
+            if item.isdigit():
+                item = int(item)
+        if isinstance(item, int) or (isinstance(item, str) and item):
+            references.append(item)
+    return references
+
+
+def resolve(connection, references):
+    """Map every reference in ``references`` that names an existing chemical to its id.
+
+    ``connection`` may be a session or a Core connection. Strings match a CAS
+    number first, then a name; the lowest id wins when several chemicals match.
+    """
+    ids = sorted({ref for ref in references if isinstance(ref, int)})
+    keys = sorted({ref for ref in references if isinstance(ref, str)})
+    resolved = {}
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        resolved.update((i, i) for i in connection.scalars(select(Chemical.id).where(Chemical.id.in_(batch))))
+
+    for start in range(0, len(keys), BATCH_SIZE):
+        batch = keys[start:start + BATCH_SIZE]
+        rows = connection.execute(
+            select(Chemical.id, Chemical.cas_number).where(Chemical.cas_number.in_(batch))
+            .order_by(Chemical.id.desc())
+        )
+        resolved.update((cas_number, chemical_id) for chemical_id, cas_number in rows)
+        by_name = {key.lower(): key for key in batch if key not in resolved}
+        if by_name:
+            rows = connection.execute(
+                select(Chemical.id, Chemical.name)
+                .where(Chemical.name.collate('NOCASE').in_(list(by_name)))
+                .order_by(Chemical.id.desc())
+            )
+            for chemical_id, name in rows:
+                if name.lower() in by_name:
+                    resolved[by_name[name.lower()]] = chemical_id
+    return resolved
+
+
+def _references_changed(obj):
+    return inspect(obj).attrs[LINKED[type(obj)][0]].history.has_changes()
+
+
+@event.listens_for(Session, 'before_flush')
+def _sync_links(session, flush_context, instances):
+    pending = [
+        obj for obj in chain(session.new, session.dirty)
+        if type(obj) in LINKED and (obj in session.new or _references_changed(obj))
+    ]
+    if not pending:
+        return
+    with session.no_autoflush:
+        references = {obj: parse_references(getattr(obj, LINKED[type(obj)][0])) for obj in pending}
+        resolved = resolve(session, list(chain.from_iterable(references.values())))
+        for obj, refs in references.items():
+            _, link_model, _ = LINKED[type(obj)]
+            wanted = {resolved[ref] for ref in refs if ref in resolved}
+            current = {link.chemical_id: link for link in obj.chemical_links}
+            for chemical_id, link in current.items():
+                if chemical_id not in wanted:
+                    obj.chemical_links.remove(link)
+            for chemical_id in sorted(wanted - current.keys()):
+                obj.chemical_links.append(link_model(chemical_id=chemical_id))
+
+
+def link_rows(connection, model, values):
+    """Return the link rows for ``{row id: JSON column value}`` of ``model`` rows.
+
+    For writers that insert rows with Core statements, which the flush hook
+    does not see.
+    """
+    _, _, owner_column = LINKED[model]
+    references = {row_id: parse_references(value) for row_id, value in values.items()}
+    resolved = resolve(connection, list(chain.from_iterable(references.values())))
+    links = {
+        (row_id, resolved[ref])
+        for row_id, refs in references.items() for ref in refs if ref in resolved
+    }
+    return [{owner_column: row_id, 'chemical_id': chemical_id} for row_id, chemical_id in sorted(links)]
+
+
+def backfill(model):
+    """Migration step linking every existing row of ``model`` to the chemicals it references."""
+    column_name, link_model, _ = LINKED[model]
+    table = model.__table__
+    column = table.c[column_name]
+
+    def step(conn):
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(table.c.id, column)
+                .where(table.c.id > last_id, column.is_not(None), column != '')
+                .order_by(table.c.id).limit(BATCH_SIZE * 10)
+            ).all()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            links = link_rows(conn, model, dict(rows))
+            if links:
+                conn.execute(link_model.__table__.insert().prefix_with('OR IGNORE'), links)
+    return step
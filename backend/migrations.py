@@ -0,0 +1,297 @@
+"""
+Versioned schema migrations.
+
+``db.create_all()`` only creates missing tables, so databases created by an
+older release never gain new indexes or columns. Each entry in ``MIGRATIONS``
+is applied once, in order, in its own transaction, and recorded in the
+``schema_migrations`` table. Steps are SQL strings or callables taking a
+connection; SQL steps use ``IF NOT EXISTS`` so they are no-ops on databases
+that ``create_all()`` has just built from the current models. Lab databases
+(see tenancy.py) run the same migrations; steps on shared tables are wrapped
+in ``if_table`` so they skip them.
+
+Nothing here runs when the app starts: ``flask --app app db-upgrade``
+(``upgrade_all()``) creates missing tables and applies pending migrations,
+once per deploy, before the server starts.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import alerts
+import ledger
+import links
+import tenancy
+import units
+from models import db, Experiment, SafetyProtocol
+
+logger = logging.getLogger(__name__)
+
+
+def add_column(table, column, ddl):
+    """Step adding ``column`` unless ``create_all()`` already created it."""
+    def step(conn):
+        existing = {row[1] for row in conn.execute(text(f'PRAGMA table_info({table})'))}
+        if column not in existing:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+    return step
+
+
+def if_table(table, *steps):
+    """Step running ``steps`` only where ``table`` exists, as shared tables do not in lab databases."""
+    def step(conn):
+        if conn.scalar(text("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = :table"),
+                       {'table': table}):
+            for inner in steps:
+                if callable(inner):
+                    inner(conn)
+                else:
+                    conn.execute(text(inner))
+    return step
+
+
+def fts_index(table, columns, prefix=None):
+    """Step creating an external-content FTS5 index ``<table>_fts`` kept in sync by triggers.
+
+    The triggers fire for every write, ORM or bulk, and the UPDATE trigger only
+    for the indexed columns, so stock changes never touch the index. Existing
+    rows are indexed with the FTS5 'rebuild' command.
+    """
+    fts = f'{table}_fts'
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    options = f", prefix='{prefix}'" if prefix else ''
+
+    def step(conn):
+        try:
+            conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                              f"{cols}, content='{table}', content_rowid='id'{options})"))
+        except OperationalError:
+            logger.warning('SQLite was built without FTS5; %s will not be searchable', table)
+            return
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new}); END'
+        ))
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+            f"INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+        ))
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN '
+            f"INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+            f'INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new}); END'
+        ))
+        conn.execute(text(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')"))
+    return step
+
+
+MIGRATIONS = [
+    (1, 'Indexes for hot filter columns and list/dashboard queries', [
+        # Equality filters: SQLite appends the rowid (our integer id) to every
+        # index, so these also serve ``WHERE col = ? AND id > ? ORDER BY id``.
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_expiry_date ON chemicals (expiry_date)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_location ON chemicals (location)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_cas_number ON chemicals (cas_number)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_unit ON chemicals (unit)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_status ON experiments (status)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_user_id ON experiments (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_safety_protocols_category ON safety_protocols (category)',
+        # Name/title prefix filters (LIKE is case-insensitive in SQLite)
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_name_nocase ON chemicals (name COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_title_nocase ON experiments (title COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS ix_safety_protocols_title_nocase ON safety_protocols (title COLLATE NOCASE)',
+        # Low-stock alerts and dashboard counts
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_low_stock ON chemicals ((quantity <= minimum_stock))',
+        # Per-user experiment lists filtered by status
+        'CREATE INDEX IF NOT EXISTS ix_experiments_user_status ON experiments (user_id, status)',
+        # Keyset pagination with order=updated_at
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_updated_at_id ON chemicals (updated_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_updated_at_id ON experiments (updated_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_safety_protocols_updated_at_id ON safety_protocols (updated_at, id)',
+    ]),
+    (2, 'Optimistic version column on chemicals', [
+        add_column('chemicals', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ]),
+    (3, 'Full-text search indexes', [
+        # Prefix indexes make 'etha*' / '64-17*' lookups on names and CAS numbers cheap
+        fts_index('chemicals', ['name', 'cas_number', 'safety_info'], prefix='2 3'),
+        fts_index('experiments', ['title', 'description', 'procedure', 'results']),
+        fts_index('safety_protocols', ['title', 'description', 'category']),
+    ]),
+    (4, 'Chemical links for experiments and safety protocols', [
+        'CREATE TABLE IF NOT EXISTS experiment_chemical_links ('
+        'experiment_id INTEGER NOT NULL REFERENCES experiments (id), '
+        'chemical_id INTEGER NOT NULL REFERENCES chemicals (id), '
+        'PRIMARY KEY (experiment_id, chemical_id))',
+        'CREATE INDEX IF NOT EXISTS ix_experiment_chemical_links_chemical '
+        'ON experiment_chemical_links (chemical_id, experiment_id)',
+        'CREATE TABLE IF NOT EXISTS protocol_chemical_links ('
+        'protocol_id INTEGER NOT NULL REFERENCES safety_protocols (id), '
+        'chemical_id INTEGER NOT NULL REFERENCES chemicals (id), '
+        'PRIMARY KEY (protocol_id, chemical_id))',
+        'CREATE INDEX IF NOT EXISTS ix_protocol_chemical_links_chemical '
+        'ON protocol_chemical_links (chemical_id, protocol_id)',
+        # Parse the existing chemicals_used / related_chemicals strings
+        links.backfill(Experiment),
+        links.backfill(SafetyProtocol),
+    ]),
+    (5, 'Index usage rows by time for the daily rollup', [
+        'CREATE INDEX IF NOT EXISTS ix_experiment_chemicals_created_at ON experiment_chemicals (created_at)',
+    ]),
+    (6, 'Stock movement ledger', [
+        'CREATE TABLE IF NOT EXISTS stock_movements ('
+        'id INTEGER NOT NULL PRIMARY KEY, '
+        'chemical_id INTEGER NOT NULL, '
+        'delta FLOAT NOT NULL, '
+        'quantity FLOAT NOT NULL, '
+        'unit VARCHAR(20) NOT NULL, '
+        'reason VARCHAR(20) NOT NULL, '
+        'experiment_id INTEGER, '
+        'user_id INTEGER, '
+        'created_at DATETIME NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS ix_stock_movements_chemical_id ON stock_movements (chemical_id)',
+        'CREATE INDEX IF NOT EXISTS ix_stock_movements_created_at '
+        'ON stock_movements (created_at, chemical_id, delta)',
+        'CREATE TABLE IF NOT EXISTS stock_movements_daily ('
+        'day DATE NOT NULL, '
+        'chemical_id INTEGER NOT NULL, '
+        'reason VARCHAR(20) NOT NULL, '
+        'unit VARCHAR(20) NOT NULL, '
+        'delta FLOAT NOT NULL, '
+        'consumed FLOAT NOT NULL, '
+        'movements INTEGER NOT NULL, '
+        'PRIMARY KEY (day, chemical_id, reason, unit))',
+        'CREATE INDEX IF NOT EXISTS ix_stock_movements_daily_chemical_day '
+        'ON stock_movements_daily (chemical_id, day)',
+        # Existing stock enters the ledger as one opening movement per chemical
+        ledger.opening_balances,
+    ]),
+    (7, 'Base-unit quantities on chemicals', [
+        add_column('chemicals', 'base_unit', 'VARCHAR(10)'),
+        add_column('chemicals', 'base_quantity', 'FLOAT'),
+        add_column('chemicals', 'base_minimum_stock', 'FLOAT'),
+        units.refresh,
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_cas_number_base '
+        'ON chemicals (cas_number, base_unit, base_quantity, base_minimum_stock)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_location_base '
+        'ON chemicals (location, base_unit, base_quantity, base_minimum_stock)',
+    ]),
+    (8, 'Labs', [
+        if_table('labs', "INSERT OR IGNORE INTO labs (id, name, created_at) "
+                         "VALUES (1, 'Default lab', datetime('now'))"),
+        # Every existing row belongs to the default lab
+        if_table('users', add_column('users', 'lab_id', 'INTEGER NOT NULL DEFAULT 1'),
+                 'CREATE INDEX IF NOT EXISTS ix_users_lab_id ON users (lab_id)'),
+        *(add_column(table, 'lab_id', 'INTEGER NOT NULL DEFAULT 1')
+          for table in ('chemicals', 'alerts', 'experiments', 'safety_protocols', 'usage_daily', 'reorder_items')),
+        # Queries are scoped to a lab, so the indexes they use now lead with lab_id
+        *(f'DROP INDEX IF EXISTS {index}' for index in (
+            'ix_chemicals_location', 'ix_chemicals_cas_number', 'ix_chemicals_unit', 'ix_chemicals_name_nocase',
+            'ix_chemicals_updated_at_id', 'ix_chemicals_cas_number_base', 'ix_chemicals_location_base',
+            'ix_experiments_status', 'ix_experiments_user_status', 'ix_experiments_title_nocase', 'ix_experiments_updated_at_id',
+            'ix_safety_protocols_category', 'ix_safety_protocols_title_nocase', 'ix_safety_protocols_updated_at_id',
+            'ix_alerts_active', 'ix_alerts_updated_at',
+        )),
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_lab_id ON chemicals (lab_id)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_lab_cas_number ON chemicals (lab_id, cas_number)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_lab_location ON chemicals (lab_id, location)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_lab_unit ON chemicals (lab_id, unit)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_lab_name_nocase ON chemicals (lab_id, name COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_lab_updated_at_id ON chemicals (lab_id, updated_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_lab_cas_number_base '
+        'ON chemicals (lab_id, cas_number, base_unit, base_quantity, base_minimum_stock)',
+        'CREATE INDEX IF NOT EXISTS ix_chemicals_lab_location_base '
+        'ON chemicals (lab_id, location, base_unit, base_quantity, base_minimum_stock)',
+        'CREATE INDEX IF NOT EXISTS ix_alerts_lab_active ON alerts (lab_id, active)',
+        'CREATE INDEX IF NOT EXISTS ix_alerts_lab_updated_at ON alerts (lab_id, updated_at)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_lab_id ON experiments (lab_id)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_lab_status ON experiments (lab_id, status)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_lab_user_status ON experiments (lab_id, user_id, status)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_lab_title_nocase ON experiments (lab_id, title COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS ix_experiments_lab_updated_at_id ON experiments (lab_id, updated_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_safety_protocols_lab_id ON safety_protocols (lab_id)',
+        'CREATE INDEX IF NOT EXISTS ix_safety_protocols_lab_category ON safety_protocols (lab_id, category)',
+        'CREATE INDEX IF NOT EXISTS ix_safety_protocols_lab_title_nocase '
+        'ON safety_protocols (lab_id, title COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS ix_safety_protocols_lab_updated_at_id '
+        'ON safety_protocols (lab_id, updated_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_usage_daily_lab_day ON usage_daily (lab_id, day)',
+    ]),
+    (9, 'Cover the unit of recent outflows for the forecast', [
+        'DROP INDEX IF EXISTS ix_stock_movements_created_at',
+        'CREATE INDEX IF NOT EXISTS ix_stock_movements_created_at_unit '
+        'ON stock_movements (created_at, chemical_id, delta, unit)',
+    ]),
+    (10, 'Alerts for existing chemicals', [
+        # Databases from before materialized alerts would stay empty until the first sweep
+        alerts.backfill,
+    ]),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, '
+        'name VARCHAR(200) NOT NULL, '
+        'applied_at DATETIME NOT NULL)'
+    ))
+
+
+def current_version(engine=None):
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return conn.scalar(text('SELECT MAX(version) FROM schema_migrations')) or 0
+
+
+def upgrade(engine=None):
+    """Apply every pending migration; return the versions applied."""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        applied = set(conn.scalars(text('SELECT version FROM schema_migrations')))
+
+    newly_applied = []
+    for version, name, steps in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with engine.begin() as conn:
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(text(step))
+                conn.execute(
+                    text('INSERT INTO schema_migrations (version, name, applied_at) '
+                         'VALUES (:version, :name, :applied_at)'),
+                    {'version': version, 'name': name, 'applied_at': datetime.utcnow()}
+                )
+        except IntegrityError:
+            # Another worker applied this version first
+            continue
+        newly_applied.append(version)
+    return newly_applied
+
+
+def upgrade_lab_databases():
+    """Create and migrate the database of every lab that has one; return ``{lab_id: versions applied}``."""
+    applied = {}
+    for lab_id, engine in tenancy.lab_engines():
+        db.metadata.create_all(engine, tables=tenancy.lab_tables())
+        applied[lab_id] = upgrade(engine)
+    return applied
+
+
+def upgrade_all():
+    """Create missing tables, then migrate the main database and every lab database.
+
+    Returns ``(versions applied to the main database, {lab_id: versions applied})``.
+    """
+    db.create_all(bind_key=None)
+    return upgrade(), upgrade_lab_databases()
@@ -1,24 +1,54 @@
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import collate
+import database
+import passwords
 from datetime import datetime
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': database.Session})
 
-class User(db.Model):
+# Lab of rows created without one (and of every row that predates labs)
+DEFAULT_LAB_ID = 1
+
+class Lab(db.Model):
+    __tablename__ = 'labs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'created_at': self.created_at.isoformat()
+        }
+
+class LabScoped:
+    """Rows belonging to one lab; statements run for a lab only see its rows (see tenancy.py)."""
+    # Not a foreign key: a lab's rows may live in a database of its own
+    lab_id = db.Column(db.Integer, nullable=False, default=DEFAULT_LAB_ID, server_default=str(DEFAULT_LAB_ID))
+
+class User(LabScoped, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_lab_id', 'lab_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
-    role = db.Column(db.String(20), nullable=False, default='technician')  # admin, technician, viewer
+    role = db.Column(db.String(20), nullable=False, default='technician')  # admin, technician, viewer, operator
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return passwords.needs_rehash(self.password_hash)
     
     def to_dict(self):
         return {
@@ -26,24 +56,52 @@ class User(db.Model):
             'username': self.username,
             'email': self.email,
             'role': self.role,
+            'lab_id': self.lab_id,
             'created_at': self.created_at.isoformat()
         }
 
-class Chemical(db.Model):
+class Chemical(LabScoped, db.Model):
     __tablename__ = 'chemicals'
+    __table_args__ = (
+        # Every list query is scoped to a lab, so the indexes lead with lab_id
+        db.Index('ix_chemicals_lab_id', 'lab_id'),
+        db.Index('ix_chemicals_lab_cas_number', 'lab_id', 'cas_number'),
+        db.Index('ix_chemicals_lab_location', 'lab_id', 'location'),
+        db.Index('ix_chemicals_lab_unit', 'lab_id', 'unit'),
+        db.Index('ix_chemicals_lab_updated_at_id', 'lab_id', 'updated_at', 'id'),
+        # Cover the per-CAS-number and per-location stock totals
+        db.Index('ix_chemicals_lab_cas_number_base',
+                 'lab_id', 'cas_number', 'base_unit', 'base_quantity', 'base_minimum_stock'),
+        db.Index('ix_chemicals_lab_location_base',
+                 'lab_id', 'location', 'base_unit', 'base_quantity', 'base_minimum_stock'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     cas_number = db.Column(db.String(50))
-    quantity = db.Column(db.Float, nullable=False)
+    # Loaded before it is overwritten, so the stock ledger can record the change
+    quantity = db.column_property(db.Column(db.Float, nullable=False), active_history=True)
     unit = db.Column(db.String(20), nullable=False)
     location = db.Column(db.String(100))
-    expiry_date = db.Column(db.Date)
+    expiry_date = db.Column(db.Date, index=True)
     minimum_stock = db.Column(db.Float, default=0)
     safety_info = db.Column(db.Text)
+    # Quantity and minimum stock in the base unit of the unit's dimension, kept
+    # in step on every write (see units.py); NULL for unknown units
+    base_unit = db.Column(db.String(10))
+    base_quantity = db.Column(db.Float)
+    base_minimum_stock = db.Column(db.Float)
+    # Optimistic concurrency: every UPDATE checks and bumps the version
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __mapper_args__ = {'version_id_col': version}
+    
+    # Deleting a chemical removes it from experiments and protocols that reference it
+    experiment_links = db.relationship('ExperimentChemicalLink', cascade='save-update, merge, delete')
+    protocol_links = db.relationship('ProtocolChemicalLink', cascade='save-update, merge, delete')
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -55,12 +113,58 @@ class Chemical(db.Model):
             'expiry_date': self.expiry_date.isoformat() if self.expiry_date else None,
             'minimum_stock': self.minimum_stock,
             'safety_info': self.safety_info,
+            'base_unit': self.base_unit,
+            'base_quantity': self.base_quantity,
+            'base_minimum_stock': self.base_minimum_stock,
+            'version': self.version,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
 
-class Experiment(db.Model):
+# Computed low-stock flag. SQLite only uses the expression index when a query
+# compares the same expression, so filter with ``LOW_STOCK_FLAG == 1``.
+LOW_STOCK_FLAG = (Chemical.quantity <= Chemical.minimum_stock).self_group()
+db.Index('ix_chemicals_low_stock', LOW_STOCK_FLAG)
+# Case-insensitive indexes serve the LIKE 'prefix%' name filters
+db.Index('ix_chemicals_lab_name_nocase', Chemical.lab_id, collate(Chemical.name, 'NOCASE'))
+
+class Alert(LabScoped, db.Model):
+    __tablename__ = 'alerts'
+    __table_args__ = (
+        db.UniqueConstraint('chemical_id', 'type', name='uq_alerts_chemical_type'),
+        db.Index('ix_alerts_lab_active', 'lab_id', 'active'),
+        db.Index('ix_alerts_lab_updated_at', 'lab_id', 'updated_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # Not a foreign key: resolved alerts outlive deleted chemicals so delta
+    # clients can learn about the removal
+    chemical_id = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.String(20), nullable=False)  # low_stock, expiring
+    severity = db.Column(db.String(20), nullable=False)  # warning, error
+    message = db.Column(db.String(255), nullable=False)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'severity': self.severity,
+            'message': self.message,
+            'chemical_id': self.chemical_id,
+            'active': self.active,
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class Experiment(LabScoped, db.Model):
     __tablename__ = 'experiments'
+    __table_args__ = (
+        db.Index('ix_experiments_lab_id', 'lab_id'),
+        db.Index('ix_experiments_lab_user_status', 'lab_id', 'user_id', 'status'),
+        db.Index('ix_experiments_lab_status', 'lab_id', 'status'),
+        db.Index('ix_experiments_lab_updated_at_id', 'lab_id', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -68,12 +172,15 @@ class Experiment(db.Model):
     procedure = db.Column(db.Text)
     results = db.Column(db.Text)
     chemicals_used = db.Column(db.Text)  # JSON string
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     status = db.Column(db.String(20), default='in_progress')  # in_progress, completed, cancelled
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     user = db.relationship('User', backref='experiments')
+    usage = db.relationship('ExperimentChemical', backref='experiment', cascade='all, delete-orphan')
+    # Derived from chemicals_used on every flush (see links.py)
+    chemical_links = db.relationship('ExperimentChemicalLink', cascade='all, delete-orphan')
     
     def to_dict(self):
         return {
@@ -83,6 +190,7 @@ class Experiment(db.Model):
             'procedure': self.procedure,
             'results': self.results,
             'chemicals_used': self.chemicals_used,
+            'chemical_ids': sorted(link.chemical_id for link in self.chemical_links),
             'user_id': self.user_id,
             'username': self.user.username if self.user else None,
             'status': self.status,
@@ -90,8 +198,47 @@ class Experiment(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
-class SafetyProtocol(db.Model):
+class ExperimentChemical(db.Model):
+    __tablename__ = 'experiment_chemicals'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    experiment_id = db.Column(db.Integer, db.ForeignKey('experiments.id'), nullable=False, index=True)
+    chemical_id = db.Column(db.Integer, db.ForeignKey('chemicals.id'), nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    unit = db.Column(db.String(20), nullable=False)  # the chemical's unit at the time of use
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # Usage rollups recompute a trailing window of days
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'experiment_id': self.experiment_id,
+            'chemical_id': self.chemical_id,
+            'amount': self.amount,
+            'unit': self.unit,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat()
+        }
+
+class ExperimentChemicalLink(db.Model):
+    """A chemical referenced by an experiment's ``chemicals_used``."""
+    __tablename__ = 'experiment_chemical_links'
+    __table_args__ = (
+        # Reverse lookup: the experiments that use a chemical, in id order
+        db.Index('ix_experiment_chemical_links_chemical', 'chemical_id', 'experiment_id'),
+    )
+    
+    experiment_id = db.Column(db.Integer, db.ForeignKey('experiments.id'), primary_key=True)
+    chemical_id = db.Column(db.Integer, db.ForeignKey('chemicals.id'), primary_key=True)
+
+class SafetyProtocol(LabScoped, db.Model):
     __tablename__ = 'safety_protocols'
+    __table_args__ = (
+        db.Index('ix_safety_protocols_lab_id', 'lab_id'),
+        db.Index('ix_safety_protocols_lab_category', 'lab_id', 'category'),
+        db.Index('ix_safety_protocols_lab_updated_at_id', 'lab_id', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -101,6 +248,9 @@ class SafetyProtocol(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Derived from related_chemicals on every flush (see links.py)
+    chemical_links = db.relationship('ProtocolChemicalLink', cascade='all, delete-orphan')
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -108,6 +258,185 @@ class SafetyProtocol(db.Model):
             'description': self.description,
             'category': self.category,
             'related_chemicals': self.related_chemicals,
+            'chemical_ids': sorted(link.chemical_id for link in self.chemical_links),
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
+
+class ProtocolChemicalLink(db.Model):
+    """A chemical referenced by a safety protocol's ``related_chemicals``."""
+    __tablename__ = 'protocol_chemical_links'
+    __table_args__ = (
+        # Reverse lookup: the protocols that cover a chemical, in id order
+        db.Index('ix_protocol_chemical_links_chemical', 'chemical_id', 'protocol_id'),
+    )
+    
+    protocol_id = db.Column(db.Integer, db.ForeignKey('safety_protocols.id'), primary_key=True)
+    chemical_id = db.Column(db.Integer, db.ForeignKey('chemicals.id'), primary_key=True)
+
+db.Index('ix_experiments_lab_title_nocase', Experiment.lab_id, collate(Experiment.title, 'NOCASE'))
+db.Index('ix_safety_protocols_lab_title_nocase', SafetyProtocol.lab_id, collate(SafetyProtocol.title, 'NOCASE'))
+
+class TableVersion(db.Model):
+    """Per-table change counter, bumped in the same transaction as every write."""
+    __tablename__ = 'table_versions'
+    
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class SchedulerLease(db.Model):
+    """Leadership lease: only the worker holding it runs scheduled jobs."""
+    __tablename__ = 'scheduler_leases'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class JobRun(db.Model):
+    """One attempt at running a scheduled job, or a queued manual run."""
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        # Latest runs per job, and the scheduler's "is this slot done?" check
+        db.Index('ix_job_runs_job_scheduled', 'job', 'scheduled_for', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job = db.Column(db.String(64), nullable=False)
+    scheduled_for = db.Column(db.DateTime, nullable=False)
+    attempt = db.Column(db.Integer, nullable=False, default=1)
+    status = db.Column(db.String(20), nullable=False, index=True)  # queued, running, succeeded, failed
+    worker = db.Column(db.String(100))
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Float)
+    result = db.Column(db.Text)  # JSON summary returned by the job
+    error = db.Column(db.Text)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job': self.job,
+            'scheduled_for': self.scheduled_for.isoformat(),
+            'attempt': self.attempt,
+            'status': self.status,
+            'worker': self.worker,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_ms': self.duration_ms,
+            'result': self.result,
+            'error': self.error
+        }
+
+class UsageDaily(LabScoped, db.Model):
+    """Chemical usage per day, rolled up from ``experiment_chemicals``."""
+    __tablename__ = 'usage_daily'
+    __table_args__ = (
+        # Per-chemical history and the reorder report's recent-usage lookup
+        db.Index('ix_usage_daily_chemical_day', 'chemical_id', 'day'),
+        # A lab's daily totals
+        db.Index('ix_usage_daily_lab_day', 'lab_id', 'day'),
+    )
+    
+    day = db.Column(db.Date, primary_key=True)
+    chemical_id = db.Column(db.Integer, primary_key=True)
+    unit = db.Column(db.String(20), primary_key=True)
+    amount = db.Column(db.Float, nullable=False)
+    uses = db.Column(db.Integer, nullable=False)
+
+class ReorderReport(db.Model):
+    __tablename__ = 'reorder_reports'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    generated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    items = db.relationship('ReorderItem', cascade='all, delete-orphan', order_by='ReorderItem.chemical_id')
+
+class ReorderItem(LabScoped, db.Model):
+    """A low-stock chemical and how much to order, as of its report."""
+    __tablename__ = 'reorder_items'
+    
+    report_id = db.Column(db.Integer, db.ForeignKey('reorder_reports.id'), primary_key=True)
+    # Not a foreign key: a report describes the inventory as it was
+    chemical_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    cas_number = db.Column(db.String(50))
+    location = db.Column(db.String(100))
+    unit = db.Column(db.String(20), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    minimum_stock = db.Column(db.Float, nullable=False)
+    daily_usage = db.Column(db.Float, nullable=False)
+    order_quantity = db.Column(db.Float, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'chemical_id': self.chemical_id,
+            'name': self.name,
+            'cas_number': self.cas_number,
+            'location': self.location,
+            'unit': self.unit,
+            'quantity': self.quantity,
+            'minimum_stock': self.minimum_stock,
+            'daily_usage': self.daily_usage,
+            'order_quantity': self.order_quantity
+        }
+
+class IdempotencyKey(db.Model):
+    """The stored response of a request sent with an ``Idempotency-Key`` header."""
+    __tablename__ = 'idempotency_keys'
+    
+    user_id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    # Hash of the method, path and body the key was first used with
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class StockMovement(db.Model):
+    """One change to a chemical's quantity. Rows are appended, never updated."""
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        # Covers the forecast's scan of recent outflows; compaction's range deletes use it too
+        db.Index('ix_stock_movements_created_at_unit', 'created_at', 'chemical_id', 'delta', 'unit'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # Not a foreign key: the ledger outlives deleted chemicals
+    chemical_id = db.Column(db.Integer, nullable=False, index=True)
+    delta = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Float, nullable=False)  # the chemical's quantity after the change
+    unit = db.Column(db.String(20), nullable=False)
+    reason = db.Column(db.String(20), nullable=False)  # opening, create, adjust, consume, import, delete
+    experiment_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'chemical_id': self.chemical_id,
+            'delta': self.delta,
+            'quantity': self.quantity,
+            'unit': self.unit,
+            'reason': self.reason,
+            'experiment_id': self.experiment_id,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat()
+        }
+
+class StockMovementDaily(db.Model):
+    """Compacted stock movements: their totals per day, chemical, reason and unit."""
+    __tablename__ = 'stock_movements_daily'
+    __table_args__ = (
+        db.Index('ix_stock_movements_daily_chemical_day', 'chemical_id', 'day'),
+    )
+    
+    day = db.Column(db.Date, primary_key=True)
+    chemical_id = db.Column(db.Integer, primary_key=True)
+    reason = db.Column(db.String(20), primary_key=True)
+    unit = db.Column(db.String(20), primary_key=True)
+    delta = db.Column(db.Float, nullable=False)
+    # Sum of the negative deltas, as a positive amount
+    consumed = db.Column(db.Float, nullable=False)
+    movements = db.Column(db.Integer, nullable=False)
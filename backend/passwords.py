@@ -0,0 +1,80 @@
+"""
+Password hashing off the request threads.
+
+Key derivation is deliberately slow (tens of milliseconds and, for scrypt,
+32 MB of memory per hash), so a burst of logins can starve a worker of CPU
+and memory. Hashes are computed on a bounded thread pool of
+``PASSWORD_HASH_WORKERS`` threads: hashlib releases the GIL while deriving
+keys, so request threads keep serving other endpoints meanwhile, and at most
+that many derivations run at once. When more than ``PASSWORD_HASH_QUEUE``
+requests are already waiting, ``Overloaded`` is raised so callers can shed
+load with a 503 instead of queueing indefinitely.
+
+The method and cost come from ``PASSWORD_HASH_METHOD`` (any
+``werkzeug.security`` method string). Hashes made with other parameters still
+verify and are upgraded on the user's next successful login.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class Overloaded(Exception):
+    """Too many password hashes are already queued."""
+
+
+class _HashPool:
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def configure(self, workers, queue):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded('Too many concurrent password checks')
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+
+_pool = _HashPool()
+_method = 'scrypt'
+
+
+def init_app(app):
+    global _method
+    _method = app.config['PASSWORD_HASH_METHOD']
+    _pool.configure(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE'])
+
+
+@lru_cache(maxsize=8)
+def _canonical(method):
+    # werkzeug fills in default parameters ('scrypt' -> 'scrypt:32768:8:1')
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def hash_password(password):
+    """Hash ``password`` with the configured method on the hashing pool."""
+    return _pool.run(generate_password_hash, password, _method)
+
+
+def verify_password(password_hash, password):
+    """Check ``password`` against ``password_hash`` on the hashing pool."""
+    return _pool.run(check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True if ``password_hash`` was made with other than the configured parameters."""
+    return password_hash.split('$', 1)[0] != _canonical(_method)
@@ -0,0 +1,383 @@
+"""
+Shared list-query layer for the inventory, experiment and safety endpoints.
+
+Keyset (cursor) pagination, field projection and filters are all pushed down
+into SQL, so list requests select only the requested columns of one page of
+rows instead of hydrating and serializing the whole table.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from urllib.parse import urlencode
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy import select, tuple_
+
+from models import (
+    db, User, Chemical, Experiment, ExperimentChemicalLink, SafetyProtocol, ProtocolChemicalLink, StockMovement
+)
+from serialization import JSON, encode_list, list_formats, rows_to_dicts
+
+
+class QueryError(ValueError):
+    """Raised for malformed list query parameters (reported as HTTP 400)."""
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise QueryError(f'Invalid date format. Use YYYY-MM-DD: {value}')
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError(f'Invalid integer: {value}')
+
+
+def _to_json(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_to_json(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, parsers):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(parsers):
+            raise ValueError
+        return [parse(value) for parse, value in zip(parsers, values)]
+    except (ValueError, TypeError, QueryError, binascii.Error):
+        raise QueryError('Invalid cursor')
+
+
+class Related:
+    """A list field holding, for each row, the sorted ``value`` of the rows whose ``parent`` is its id.
+
+    It is not a column of the list query: ``ListSpec.attach`` loads it for a
+    whole page (or export batch) with one more query.
+    """
+
+    # Ids per SELECT ... WHERE parent IN (...): one query for any page up to MAX_PAGE_SIZE
+    BATCH_SIZE = 1000
+
+    def __init__(self, parent, value):
+        self.parent = parent
+        self.value = value
+
+    def load(self, ids):
+        """Return ``{id: [value, ...]}`` for the ``ids`` that have any."""
+        values = {}
+        for start in range(0, len(ids), self.BATCH_SIZE):
+            for parent_id, value in db.session.execute(
+                select(self.parent, self.value)
+                .where(self.parent.in_(ids[start:start + self.BATCH_SIZE]))
+                .order_by(self.parent, self.value)
+            ):
+                values.setdefault(parent_id, []).append(value)
+        return values
+
+
+class ListSpec:
+    """Describes how a model's list endpoint can be projected, filtered and paged.
+
+    ``fields`` maps output names to column expressions, or ``Related`` fields
+    loaded per page, in response order.
+    ``joins`` maps an output name to the ``(target, onclause)`` outer join it
+    needs. ``filters`` maps a query-string parameter to a function building a
+    SQL predicate from its value, and ``filter_joins`` a parameter to the
+    ``(target, onclause, id_column)`` inner join its predicate needs, where
+    ``id_column`` is the target's copy of the model's id. ``orders`` maps an
+    ``order=`` value to the keyset columns and the parsers used to decode them
+    from a cursor.
+    """
+
+    def __init__(self, model, fields, filters, orders, joins=None, filter_joins=None):
+        self.model = model
+        self.fields = fields
+        self.filters = filters
+        self.orders = orders
+        self.joins = joins or {}
+        self.filter_joins = filter_joins or {}
+
+    def selected_fields(self, args):
+        requested = args.get('fields')
+        if not requested:
+            return list(self.fields)
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise QueryError(f'Unknown fields: {", ".join(unknown)}')
+        return names
+
+    def build(self, args, scope=None):
+        """Build the filtered, ordered SELECT for ``args`` without any paging.
+
+        ``scope`` holds filter values fixed by the endpoint (e.g. from the URL
+        path); they override the query string. Returns ``(statement,
+        field_names, keyset_columns, parsers)``. The keyset columns are
+        appended after the projected fields so a cursor can always be derived
+        from the last row of a page.
+        """
+        scope = scope or {}
+        names = self.selected_fields(args)
+        order = args.get('order', 'id')
+        if order not in self.orders:
+            raise QueryError(f'Unknown order: {order}')
+        keyset, parsers = self.orders[order]
+
+        joins = [
+            self.filter_joins[param] for param in self.filters
+            if param in self.filter_joins and (scope[param] if param in scope else args.get(param))
+        ]
+        if joins and len(keyset) == 1 and keyset[0] is self.model.id:
+            # Page on the joined copy of the id so the join's index yields rows
+            # already in order instead of every match being sorted
+            keyset = (joins[0][2],)
+
+        columns = [self.fields[name].label(name) for name in names if not self._related(name)]
+        if any(self._related(name) for name in names):
+            # attach() finds the related values by id
+            columns.append(self.model.id.label('_id'))
+        columns += [col.label(f'_cursor{i}') for i, col in enumerate(keyset)]
+        stmt = select(*columns).select_from(self.model)
+        for name in names:
+            if name in self.joins:
+                target, onclause = self.joins[name]
+                stmt = stmt.outerjoin(target, onclause)
+
+        for target, onclause, _ in joins:
+            stmt = stmt.join(target, onclause)
+        for param, predicate in self.filters.items():
+            value = scope[param] if param in scope else args.get(param)
+            if value:
+                stmt = stmt.where(predicate(str(value)))
+
+        return stmt.order_by(*keyset), names, keyset, parsers
+
+    def _related(self, name):
+        return isinstance(self.fields[name], Related)
+
+    def attach(self, names, rows):
+        """Turn rows of a ``build()`` statement into tuples of ``names`` plus the keyset columns.
+
+        Each ``Related`` field among ``names`` costs one query for all of
+        ``rows``; without any, the rows are returned as they are.
+        """
+        related = [name for name in names if self._related(name)]
+        if not related:
+            return rows
+        columns = [name for name in names if name not in related]
+        id_index = len(columns)
+        ids = [row[id_index] for row in rows]
+        loaded = {name: self.fields[name].load(ids) for name in related} if ids else {}
+        attached = []
+        for row in rows:
+            values = dict(zip(columns, row))
+            for name in related:
+                values[name] = loaded[name].get(row[id_index], [])
+            attached.append(tuple(values[name] for name in names) + tuple(row[id_index + 1:]))
+        return attached
+
+    def page(self, args, scope=None):
+        """Return ``(names, rows, next_cursor)`` for one page of results.
+
+        Rows carry the keyset columns after the first ``len(names)`` fields.
+        """
+        stmt, names, keyset, parsers = self.build(args, scope)
+
+        max_size = current_app.config['MAX_PAGE_SIZE']
+        limit = args.get('limit')
+        limit = _parse_int(limit) if limit else current_app.config['DEFAULT_PAGE_SIZE']
+        if limit < 1 or limit > max_size:
+            raise QueryError(f'limit must be between 1 and {max_size}')
+
+        cursor = args.get('cursor')
+        if cursor:
+            stmt = stmt.where(tuple_(*keyset) > tuple_(*decode_cursor(cursor, parsers)))
+
+        # Fetch one extra row to learn whether another page exists
+        rows = db.session.execute(stmt.limit(limit + 1)).all()
+        more = len(rows) > limit
+        rows = self.attach(names, rows[:limit])
+        next_cursor = encode_cursor(rows[-1][len(names):]) if more else None
+
+        return names, rows, next_cursor
+
+
+def paginated_response(spec, scope=None):
+    """Serialize one page of ``spec`` for the current request (see ``list_response``)."""
+    try:
+        names, rows, next_cursor = spec.page(request.args, scope)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return list_response(names, rows, next_cursor)
+
+
+def list_response(names, rows, next_cursor):
+    """Serialize a page of rows in the representation the request's ``Accept`` prefers.
+
+    The body is a plain JSON array of objects unless the client asks for one
+    of the columnar formats (``serialization.list_formats()``); the cursor for
+    the following page is returned in the ``X-Next-Cursor`` and ``Link``
+    headers.
+    """
+    media_type = request.accept_mimetypes.best_match(list_formats(), default=JSON)
+    response = current_app.response_class(encode_list(media_type, names, rows), mimetype=media_type)
+    response.vary.add('Accept')
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response, 200
+
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+def streaming_response(spec, filename):
+    """Stream every row matching the current request's filters.
+
+    Rows are read through a server-side cursor in batches of
+    ``EXPORT_BATCH_SIZE`` and written to the response as they arrive, either as
+    newline-delimited JSON (``format=ndjson``, the default) or as chunks of a
+    single JSON array (``format=json``), so memory stays bounded by one batch.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unknown format: {fmt}. Use ndjson or json'}), 400
+    try:
+        stmt, names, _, _ = spec.build(request.args)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    dumps = current_app.json.dumps
+
+    def batches():
+        result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+        for partition in result.partitions():
+            yield [dumps(item) for item in rows_to_dicts(names, spec.attach(names, partition))]
+
+    def ndjson():
+        for lines in batches():
+            yield '\n'.join(lines) + '\n'
+
+    def json_array():
+        yield '['
+        separator = ''
+        for lines in batches():
+            yield separator + ','.join(lines)
+            separator = ','
+        yield ']'
+
+    body = ndjson() if fmt == 'ndjson' else json_array()
+    response = Response(stream_with_context(body), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.{fmt}'
+    return response
+
+
+def _model_fields(model, names):
+    return {name: getattr(model, name) for name in names}
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value)
+
+
+def _orders(model):
+    return {
+        'id': ((model.id,), [_parse_int]),
+        'updated_at': ((model.updated_at, model.id), [_parse_datetime, _parse_int]),
+    }
+
+
+CHEMICAL_LIST = ListSpec(
+    Chemical,
+    fields=_model_fields(Chemical, [
+        'id', 'name', 'cas_number', 'quantity', 'unit', 'location',
+        'expiry_date', 'minimum_stock', 'safety_info', 'base_unit', 'base_quantity', 'base_minimum_stock',
+        'version', 'created_at', 'updated_at',
+    ]),
+    filters={
+        'name': lambda v: Chemical.name.startswith(v, autoescape=True),
+        'location': lambda v: Chemical.location == v,
+        'cas_number': lambda v: Chemical.cas_number == v,
+        'unit': lambda v: Chemical.unit == v,
+        'base_unit': lambda v: Chemical.base_unit == v,
+        'expires_after': lambda v: Chemical.expiry_date >= _parse_date(v),
+        'expires_before': lambda v: Chemical.expiry_date <= _parse_date(v),
+    },
+    orders=_orders(Chemical),
+)
+
+EXPERIMENT_LIST = ListSpec(
+    Experiment,
+    fields={
+        **_model_fields(Experiment, [
+            'id', 'title', 'description', 'procedure', 'results',
+            'chemicals_used',
+        ]),
+        'chemical_ids': Related(ExperimentChemicalLink.experiment_id, ExperimentChemicalLink.chemical_id),
+        'user_id': Experiment.user_id,
+        'username': User.username,
+        **_model_fields(Experiment, ['status', 'created_at', 'updated_at']),
+    },
+    joins={'username': (User, Experiment.user_id == User.id)},
+    filters={
+        'title': lambda v: Experiment.title.startswith(v, autoescape=True),
+        'status': lambda v: Experiment.status == v,
+        'user_id': lambda v: Experiment.user_id == _parse_int(v),
+        'chemical_id': lambda v: ExperimentChemicalLink.chemical_id == _parse_int(v),
+    },
+    filter_joins={
+        'chemical_id': (ExperimentChemicalLink, ExperimentChemicalLink.experiment_id == Experiment.id,
+                        ExperimentChemicalLink.experiment_id),
+    },
+    orders=_orders(Experiment),
+)
+
+PROTOCOL_LIST = ListSpec(
+    SafetyProtocol,
+    fields={
+        **_model_fields(SafetyProtocol, ['id', 'title', 'description', 'category', 'related_chemicals']),
+        'chemical_ids': Related(ProtocolChemicalLink.protocol_id, ProtocolChemicalLink.chemical_id),
+        **_model_fields(SafetyProtocol, ['created_at', 'updated_at']),
+    },
+    filters={
+        'title': lambda v: SafetyProtocol.title.startswith(v, autoescape=True),
+        'category': lambda v: SafetyProtocol.category == v,
+        'chemical_id': lambda v: ProtocolChemicalLink.chemical_id == _parse_int(v),
+    },
+    filter_joins={
+        'chemical_id': (ProtocolChemicalLink, ProtocolChemicalLink.protocol_id == SafetyProtocol.id,
+                        ProtocolChemicalLink.protocol_id),
+    },
+    orders=_orders(SafetyProtocol),
+)
+
+MOVEMENT_LIST = ListSpec(
+    StockMovement,
+    fields=_model_fields(StockMovement, [
+        'id', 'chemical_id', 'delta', 'quantity', 'unit', 'reason',
+        'experiment_id', 'user_id', 'created_at',
+    ]),
+    filters={
+        'chemical_id': lambda v: StockMovement.chemical_id == _parse_int(v),
+        'reason': lambda v: StockMovement.reason == v,
+        'since': lambda v: StockMovement.created_at >= _parse_date(v),
+    },
+    orders={'id': ((StockMovement.id,), [_parse_int])},
+)
@@ -0,0 +1,109 @@
+"""
+Precomputed usage rollups and reorder reports, refreshed by scheduled jobs.
+
+``usage_daily`` holds the chemical usage recorded by experiments, summed per
+UTC day, chemical and unit. Each run recomputes the last ``USAGE_ROLLUP_DAYS``
+days (and the whole history on the first run) with one ``INSERT ... SELECT``,
+so late or corrected usage rows are picked up and reruns are harmless.
+
+A reorder report lists every chemical at or below its minimum stock with
+the amount to order: enough for ``REORDER_COVER_DAYS`` of its recent daily
+usage on top of the minimum, and at least the minimum again. The newest
+``REORDER_REPORTS_KEPT`` reports are kept. Each lab sees its own rows of both
+(see tenancy.py).
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, insert, literal, select
+
+import changes
+from models import db, Chemical, Experiment, ExperimentChemical, ReorderItem, ReorderReport, UsageDaily, LOW_STOCK_FLAG
+from scheduler import job
+
+
+@job('usage-rollup', daily='USAGE_ROLLUP_AT')
+def roll_up_usage(today=None):
+    """Recompute ``usage_daily`` from the start of the rollup window; return the rows written."""
+    today = today or datetime.utcnow().date()
+    start = today - timedelta(days=current_app.config['USAGE_ROLLUP_DAYS'])
+    if db.session.scalar(select(UsageDaily.day).limit(1)) is None:
+        first = db.session.scalar(select(func.min(ExperimentChemical.created_at)))
+        if first is not None:
+            start = min(start, first.date())
+
+    day = func.date(ExperimentChemical.created_at)
+    db.session.execute(delete(UsageDaily).where(UsageDaily.day >= start))
+    # Usage belongs to the lab of the experiment that recorded it
+    written = db.session.execute(insert(UsageDaily).from_select(
+        ['day', 'lab_id', 'chemical_id', 'unit', 'amount', 'uses'],
+        select(day, Experiment.lab_id, ExperimentChemical.chemical_id, ExperimentChemical.unit,
+               func.sum(ExperimentChemical.amount), func.count())
+        .join(Experiment, Experiment.id == ExperimentChemical.experiment_id)
+        .where(ExperimentChemical.created_at >= datetime.combine(start, datetime.min.time()))
+        .group_by(day, Experiment.lab_id, ExperimentChemical.chemical_id, ExperimentChemical.unit)
+    )).rowcount
+    changes.record(db.session, UsageDaily.__tablename__, [None], 'update')
+    db.session.commit()
+    return {'from': start.isoformat(), 'rows': written}
+
+
+@job('reorder-report', daily='REORDER_REPORT_AT')
+def generate_reorder_report(today=None):
+    """Write a new reorder report for the current low-stock chemicals; return its size."""
+    config = current_app.config
+    today = today or datetime.utcnow().date()
+    cover_days = config['REORDER_COVER_DAYS']
+
+    usage = (
+        select(UsageDaily.chemical_id, UsageDaily.unit, func.sum(UsageDaily.amount).label('amount'))
+        .where(UsageDaily.day >= today - timedelta(days=cover_days))
+        .group_by(UsageDaily.chemical_id, UsageDaily.unit)
+        .subquery()
+    )
+    daily_usage = func.coalesce(usage.c.amount, 0) / cover_days
+    # Scalar max(): top up to the minimum plus the cover, and at least double the minimum
+    target = func.max(2 * Chemical.minimum_stock, Chemical.minimum_stock + daily_usage * cover_days)
+
+    report = ReorderReport(generated_at=datetime.utcnow())
+    db.session.add(report)
+    db.session.flush()
+    report.item_count = db.session.execute(insert(ReorderItem).from_select(
+        ['report_id', 'lab_id', 'chemical_id', 'name', 'cas_number', 'location', 'unit',
+         'quantity', 'minimum_stock', 'daily_usage', 'order_quantity'],
+        select(literal(report.id), Chemical.lab_id, Chemical.id, Chemical.name, Chemical.cas_number, Chemical.location,
+               Chemical.unit, Chemical.quantity, Chemical.minimum_stock, func.round(daily_usage, 4),
+               func.round(func.max(target - Chemical.quantity, 0), 2))
+        .outerjoin(usage, and_(usage.c.chemical_id == Chemical.id, usage.c.unit == Chemical.unit))
+        .where(LOW_STOCK_FLAG == 1)
+    )).rowcount
+
+    stale = select(ReorderReport.id).order_by(ReorderReport.id.desc()).offset(config['REORDER_REPORTS_KEPT'])
+    stale_ids = db.session.scalars(stale).all()
+    if stale_ids:
+        db.session.execute(delete(ReorderItem).where(ReorderItem.report_id.in_(stale_ids)))
+        db.session.execute(delete(ReorderReport).where(ReorderReport.id.in_(stale_ids)))
+    db.session.commit()
+    return {'report_id': report.id, 'items': report.item_count}
+
+
+def latest_reorder_report():
+    return db.session.scalars(select(ReorderReport).order_by(ReorderReport.id.desc()).limit(1)).first()
+
+
+def daily_usage(days, chemical_id=None):
+    """Usage per day and unit over the last ``days`` days, for one chemical or all of them."""
+    start = datetime.utcnow().date() - timedelta(days=days - 1)
+    stmt = (
+        select(UsageDaily.day, UsageDaily.unit, func.sum(UsageDaily.amount).label('amount'),
+               func.sum(UsageDaily.uses).label('uses'))
+        .where(UsageDaily.day >= start)
+        .group_by(UsageDaily.day, UsageDaily.unit)
+        .order_by(UsageDaily.day, UsageDaily.unit)
+    )
+    if chemical_id is not None:
+        stmt = stmt.where(UsageDaily.chemical_id == chemical_id)
+    return [
+        {'day': row.day.isoformat(), 'unit': row.unit, 'amount': row.amount, 'uses': row.uses}
+        for row in db.session.execute(stmt)
+    ]
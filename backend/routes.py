@@ -1,6 +1,32 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from models import db, User, Chemical, Experiment, SafetyProtocol
+from sqlalchemy import case, func, select, true
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
+from models import db, User, Chemical, Experiment, ExperimentChemical, JobRun, SafetyProtocol, DEFAULT_LAB_ID
+from cache import TTLCache
+from changes import on_commit, tables
+import alerts
+import auth
+import batch
+import bulk
+import events
+import forecast
+import idempotency
+import passwords
+import rollups
+import scheduler
+import search
+import stock
+import tenancy
+import units
+import versions
+from versions import conditional
+from queries import (
+    CHEMICAL_LIST, EXPERIMENT_LIST, MOVEMENT_LIST, PROTOCOL_LIST, QueryError, list_response,
+    paginated_response, streaming_response
+)
 from datetime import datetime, date, timedelta
 import json
 
@@ -10,12 +36,16 @@ inventory_bp = Blueprint('inventory', __name__)
 experiments_bp = Blueprint('experiments', __name__)
 safety_bp = Blueprint('safety', __name__)
 dashboard_bp = Blueprint('dashboard', __name__)
+search_bp = Blueprint('search', __name__)
+jobs_bp = Blueprint('jobs', __name__)
 
 # Authentication Routes
-@auth_bp.route('/register', methods=['POST'])
-def register():
-    data = request.get_json()
-    
+def _overloaded():
+    response = jsonify({'error': 'Too many concurrent logins, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def _create_user(data, role, lab_id):
     if not data or not data.get('username') or not data.get('password') or not data.get('email'):
         return jsonify({'error': 'Missing required fields'}), 400
     
@@ -28,15 +58,41 @@ def register():
     user = User(
         username=data['username'],
         email=data['email'],
-        role=data.get('role', 'technician')
+        role=role,
+        lab_id=lab_id
     )
-    user.set_password(data['password'])
+    try:
+        user.set_password(data['password'])
+    except passwords.Overloaded:
+        return _overloaded()
     
     db.session.add(user)
     db.session.commit()
     
     return jsonify({'message': 'User created successfully', 'user': user.to_dict()}), 201
 
+@auth_bp.route('/register', methods=['POST'])
+def register():
+    data = request.get_json()
+    
+    # Anyone can register, so only into the default lab; other labs' admins add their users
+    if data and 'lab_id' in data:
+        return jsonify({'error': 'lab_id cannot be chosen at registration'}), 400
+    
+    # Roles are granted by an admin, never chosen at registration
+    return _create_user(data, 'technician', DEFAULT_LAB_ID)
+
+@auth_bp.route('/users', methods=['POST'])
+@auth.role_required('admin', fresh=True)
+def create_user():
+    data = request.get_json() or {}
+    role = data.get('role', 'technician')
+    if role not in auth.ROLES:
+        return jsonify({'error': f'role must be one of {", ".join(auth.ROLES)}'}), 400
+    
+    # Admins add users to their own lab only
+    return _create_user(data, role, tenancy.current_lab())
+
 @auth_bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -46,10 +102,19 @@ def login():
     
     user = User.query.filter_by(username=data['username']).first()
     
-    if not user or not user.check_password(data['password']):
-        return jsonify({'error': 'Invalid username or password'}), 401
+    try:
+        if not user or not user.check_password(data['password']):
+            return jsonify({'error': 'Invalid username or password'}), 401
+        
+        # Upgrade hashes made with older method/cost settings
+        if user.password_needs_rehash():
+            user.set_password(data['password'])
+            db.session.commit()
+    except passwords.Overloaded:
+        return _overloaded()
     
-    access_token = create_access_token(identity=user.id)
+    access_token = create_access_token(identity=user.id, additional_claims=auth.token_claims(user))
+    auth.cache_user(user)
     
     return jsonify({
         'access_token': access_token,
@@ -59,29 +124,116 @@ def login():
 @auth_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = auth.load_user(get_jwt_identity())
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
+    return jsonify(user), 200
+
+@auth_bp.route('/users/<int:id>/role', methods=['PUT'])
+@auth.role_required('admin', fresh=True)
+def set_user_role(id):
+    data = request.get_json() or {}
+    if data.get('role') not in auth.ROLES:
+        return jsonify({'error': f'role must be one of {", ".join(auth.ROLES)}'}), 400
+    
+    user = db.session.get(User, id)
+    # Users are not lab-scoped rows, so admins are limited to their own lab here
+    if not user or user.lab_id != tenancy.current_lab():
+        return jsonify({'error': 'User not found'}), 404
+    
+    user.role = data['role']
+    db.session.commit()
     return jsonify(user.to_dict()), 200
 
 # Inventory Routes
 @inventory_bp.route('/', methods=['GET'])
 @jwt_required()
+@conditional('chemicals')
 def get_chemicals():
-    chemicals = Chemical.query.all()
-    return jsonify([chemical.to_dict() for chemical in chemicals]), 200
+    return paginated_response(CHEMICAL_LIST)
+
+@inventory_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_chemicals():
+    return streaming_response(CHEMICAL_LIST, 'chemicals')
+
+@inventory_bp.route('/import', methods=['POST'])
+@jwt_required()
+def import_chemicals():
+    upload = request.files.get('file')
+    if upload:
+        stream, mimetype = upload.stream, upload.mimetype
+        if upload.filename and upload.filename.endswith('.csv'):
+            mimetype = 'text/csv'
+        elif upload.filename and upload.filename.endswith(('.ndjson', '.jsonl')):
+            mimetype = 'application/x-ndjson'
+    else:
+        stream, mimetype = request.stream, request.mimetype
+    
+    fmt = request.args.get('format') or bulk.IMPORT_FORMATS.get(mimetype)
+    if fmt not in bulk.READERS:
+        return jsonify({'error': 'Unsupported upload format. Send text/csv or application/x-ndjson'}), 400
+    
+    report = bulk.import_chemicals(bulk.READERS[fmt](stream), current_app.config['IMPORT_BATCH_SIZE'])
+    return jsonify(report), 200
 
 @inventory_bp.route('/<int:id>', methods=['GET'])
 @jwt_required()
+@conditional('chemicals')
 def get_chemical(id):
     chemical = Chemical.query.get(id)
     if not chemical:
         return jsonify({'error': 'Chemical not found'}), 404
     return jsonify(chemical.to_dict()), 200
 
+def _chemical_references(id, spec):
+    try:
+        names, rows, next_cursor = spec.page(request.args, scope={'chemical_id': id})
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    # Only an empty first page needs to tell an unknown chemical from an unreferenced one
+    if not rows and not request.args.get('cursor') and not db.session.get(Chemical, id):
+        return jsonify({'error': 'Chemical not found'}), 404
+    return list_response(names, rows, next_cursor)
+
+@inventory_bp.route('/<int:id>/experiments', methods=['GET'])
+@jwt_required()
+@conditional('experiments', 'users', 'experiment_chemical_links')
+def get_chemical_experiments(id):
+    return _chemical_references(id, EXPERIMENT_LIST)
+
+@inventory_bp.route('/<int:id>/protocols', methods=['GET'])
+@jwt_required()
+@conditional('safety_protocols', 'protocol_chemical_links')
+def get_chemical_protocols(id):
+    return _chemical_references(id, PROTOCOL_LIST)
+
+@inventory_bp.route('/<int:id>/movements', methods=['GET'])
+@jwt_required()
+@conditional('stock_movements')
+def get_chemical_movements(id):
+    # Movements have no lab of their own; the chemical's lab scopes them
+    if not db.session.get(Chemical, id):
+        return jsonify({'error': 'Chemical not found'}), 404
+    return _chemical_references(id, MOVEMENT_LIST)
+
+@inventory_bp.route('/totals', methods=['GET'])
+@jwt_required()
+@conditional('chemicals')
+def get_stock_totals():
+    by = request.args.get('by', 'cas_number')
+    if by not in units.TOTAL_KEYS:
+        return jsonify({'error': f'by must be one of: {", ".join(units.TOTAL_KEYS)}'}), 400
+    
+    filters = {key: request.args[key] for key in units.TOTAL_KEYS if request.args.get(key)}
+    try:
+        totals = units.stock_totals(by, request.args.get('unit'), filters)
+    except units.UnitError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(totals), 200
+
 @inventory_bp.route('/', methods=['POST'])
 @jwt_required()
 def add_chemical():
@@ -125,6 +277,9 @@ def update_chemical(id):
     
     data = request.get_json()
     
+    if data.get('version') is not None and data['version'] != chemical.version:
+        return jsonify({'error': 'Chemical was modified by someone else', 'version': chemical.version}), 409
+    
     try:
         if 'name' in data:
             chemical.name = data['name']
@@ -151,6 +306,9 @@ def update_chemical(id):
         return jsonify(chemical.to_dict()), 200
     except ValueError as e:
         return jsonify({'error': f'Invalid date format. Use YYYY-MM-DD: {str(e)}'}), 400
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Chemical was modified by someone else, reload and retry'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Failed to update chemical: {str(e)}'}), 500
@@ -167,17 +325,88 @@ def delete_chemical(id):
     
     return jsonify({'message': 'Chemical deleted successfully'}), 200
 
+# Batch Routes
+def _batch_response(body, status, replayed=False):
+    response = current_app.response_class(body, status=status, mimetype='application/json')
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _batch(spec):
+    """Apply a batch of operations in one transaction, honouring an Idempotency-Key header."""
+    user_id = get_jwt_identity()
+    try:
+        key = idempotency.request_key()
+        fingerprint = idempotency.fingerprint()
+        stored = idempotency.replay(user_id, key, fingerprint) if key else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except idempotency.KeyReused as e:
+        return jsonify({'error': str(e)}), 422
+    if stored:
+        return _batch_response(*stored, replayed=True)
+    
+    try:
+        operations, atomic = batch.parse(request.get_json(silent=True), current_app.config['BATCH_MAX_OPERATIONS'])
+        results = batch.apply(spec, operations, user_id)
+    except batch.BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({'error': f'Batch could not be applied: {e.__class__.__name__}'}), 409
+    
+    failed = [result for result in results if 'error' in result]
+    if failed and atomic:
+        db.session.rollback()
+        return jsonify({
+            'error': 'Batch rejected; nothing was applied',
+            'succeeded': 0, 'failed': len(failed), 'results': failed
+        }), 422
+    
+    status = 207 if failed else 200
+    body = current_app.json.dumps({
+        'succeeded': len(results) - len(failed), 'failed': len(failed), 'results': results
+    })
+    if key:
+        # Committed with the writes, so the key is recorded exactly when they are
+        idempotency.remember(user_id, key, fingerprint, body, status)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if not key:
+            raise
+        # A concurrent retry with the same key committed first
+        stored = idempotency.replay(user_id, key, fingerprint)
+        return _batch_response(*stored, replayed=True)
+    return _batch_response(body, status)
+
 # Experiment Routes
+def _load_experiment(id):
+    # Eager-load the owner so to_dict() does not issue a second SELECT for username
+    return Experiment.query.options(joinedload(Experiment.user)).populate_existing().get(id)
+
 @experiments_bp.route('/', methods=['GET'])
 @jwt_required()
+@conditional('experiments', 'users', 'experiment_chemical_links')
 def get_experiments():
-    experiments = Experiment.query.all()
-    return jsonify([experiment.to_dict() for experiment in experiments]), 200
+    return paginated_response(EXPERIMENT_LIST)
+
+@experiments_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_experiments():
+    return streaming_response(EXPERIMENT_LIST, 'experiments')
+
+@experiments_bp.route('/batch', methods=['POST'])
+@jwt_required()
+def batch_experiments():
+    return _batch(batch.EXPERIMENT_BATCH)
 
 @experiments_bp.route('/<int:id>', methods=['GET'])
 @jwt_required()
+@conditional('experiments', 'users', 'experiment_chemical_links')
 def get_experiment(id):
-    experiment = Experiment.query.get(id)
+    experiment = _load_experiment(id)
     if not experiment:
         return jsonify({'error': 'Experiment not found'}), 404
     return jsonify(experiment.to_dict()), 200
@@ -202,14 +431,16 @@ def create_experiment():
     )
     
     db.session.add(experiment)
+    db.session.flush()
+    experiment_id = experiment.id
     db.session.commit()
     
-    return jsonify(experiment.to_dict()), 201
+    return jsonify(_load_experiment(experiment_id).to_dict()), 201
 
 @experiments_bp.route('/<int:id>', methods=['PUT'])
 @jwt_required()
 def update_experiment(id):
-    experiment = Experiment.query.get(id)
+    experiment = _load_experiment(id)
     if not experiment:
         return jsonify({'error': 'Experiment not found'}), 404
     
@@ -230,7 +461,7 @@ def update_experiment(id):
     
     db.session.commit()
     
-    return jsonify(experiment.to_dict()), 200
+    return jsonify(_load_experiment(id).to_dict()), 200
 
 @experiments_bp.route('/<int:id>', methods=['DELETE'])
 @jwt_required()
@@ -244,15 +475,53 @@ def delete_experiment(id):
     
     return jsonify({'message': 'Experiment deleted successfully'}), 200
 
+@experiments_bp.route('/<int:id>/consume', methods=['POST'])
+@jwt_required()
+def consume_chemicals(id):
+    experiment = Experiment.query.get(id)
+    if not experiment:
+        return jsonify({'error': 'Experiment not found'}), 404
+    
+    data = request.get_json()
+    
+    try:
+        result = stock.consume(experiment.id, data.get('items') if data else None, get_jwt_identity())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except stock.ConsumptionError as e:
+        return jsonify({'error': str(e), 'items': e.problems}), 409
+    
+    return jsonify(result), 201
+
+@experiments_bp.route('/<int:id>/usage', methods=['GET'])
+@jwt_required()
+def get_experiment_usage(id):
+    if not Experiment.query.get(id):
+        return jsonify({'error': 'Experiment not found'}), 404
+    
+    usage = ExperimentChemical.query.filter_by(experiment_id=id).order_by(ExperimentChemical.id).all()
+    return jsonify([row.to_dict() for row in usage]), 200
+
 # Safety Protocol Routes
 @safety_bp.route('/', methods=['GET'])
 @jwt_required()
+@conditional('safety_protocols', 'protocol_chemical_links')
 def get_protocols():
-    protocols = SafetyProtocol.query.all()
-    return jsonify([protocol.to_dict() for protocol in protocols]), 200
+    return paginated_response(PROTOCOL_LIST)
+
+@safety_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_protocols():
+    return streaming_response(PROTOCOL_LIST, 'protocols')
+
+@safety_bp.route('/batch', methods=['POST'])
+@jwt_required()
+def batch_protocols():
+    return _batch(batch.PROTOCOL_BATCH)
 
 @safety_bp.route('/<int:id>', methods=['GET'])
 @jwt_required()
+@conditional('safety_protocols', 'protocol_chemical_links')
 def get_protocol(id):
     protocol = SafetyProtocol.query.get(id)
     if not protocol:
@@ -314,62 +583,222 @@ def delete_protocol(id):
     return jsonify({'message': 'Safety protocol deleted successfully'}), 200
 
 # Dashboard Routes
+metrics_cache = TTLCache()
+
+@on_commit
+def _invalidate_metrics(changes):
+    if tables(changes) & {'chemicals', 'experiments', 'users'}:
+        metrics_cache.clear()
+
+def compute_metrics():
+    """Compute every dashboard metric in a single round trip.
+
+    Each table is aggregated once with conditional sums, and the three
+    single-row aggregates are cross-joined into one result row. Expiring
+    chemicals are counted over the same window as expiry alerts.
+    """
+    earliest, latest = alerts.expiry_bounds(date.today())
+    chemicals = select(
+        func.count().label('total_chemicals'),
+        func.coalesce(func.sum(case((Chemical.quantity <= Chemical.minimum_stock, 1), else_=0)), 0)
+            .label('low_stock_chemicals'),
+        func.coalesce(func.sum(case((Chemical.expiry_date.between(earliest, latest), 1), else_=0)), 0)
+            .label('expiring_chemicals'),
+    ).subquery()
+    experiments = select(
+        func.coalesce(func.sum(case((Experiment.status == 'in_progress', 1), else_=0)), 0)
+            .label('active_experiments'),
+        func.count().label('total_experiments'),
+    ).subquery()
+    users = select(func.count().label('total_users')).select_from(User).subquery()
+    
+    # Each side is a single row, so the explicit cross join is intended
+    stmt = select(chemicals, experiments, users).select_from(
+        chemicals.join(experiments, true()).join(users, true()))
+    row = db.session.execute(stmt).one()
+    return dict(row._mapping)
+
+def cached_metrics():
+    key = ('metrics', tenancy.current_lab())
+    metrics = metrics_cache.get(key)
+    if metrics is None:
+        metrics = compute_metrics()
+        metrics_cache.set(key, metrics, current_app.config['DASHBOARD_CACHE_TTL'])
+    return metrics
+
 @dashboard_bp.route('/metrics', methods=['GET'])
 @jwt_required()
 def get_metrics():
-    total_chemicals = Chemical.query.count()
-    low_stock_chemicals = Chemical.query.filter(Chemical.quantity <= Chemical.minimum_stock).count()
-    
-    # Check for expiring chemicals (within 30 days)
-    today = date.today()
-    thirty_days_from_now = today + timedelta(days=30)
-    expiring_chemicals = Chemical.query.filter(
-        Chemical.expiry_date.isnot(None),
-        Chemical.expiry_date <= thirty_days_from_now
-    ).count()
-    
-    active_experiments = Experiment.query.filter_by(status='in_progress').count()
-    total_experiments = Experiment.query.count()
-    total_users = User.query.count()
+    return jsonify(cached_metrics()), 200
+
+@dashboard_bp.route('/alerts', methods=['GET'])
+@jwt_required()
+def get_alerts():
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify({'error': 'Invalid since timestamp. Use ISO 8601'}), 400
+    
+    version = alerts.version()
+    etag = f'alerts-{tenancy.current_lab()}-{version}'
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        rows = alerts.alerts_since(since) if since else alerts.active_alerts()
+        response = jsonify([alert.to_dict() for alert in rows])
+    
+    response.set_etag(etag)
+    response.headers['X-Alerts-Version'] = version
+    return response
+
+@dashboard_bp.route('/reorder-report', methods=['GET'])
+@jwt_required()
+@conditional('reorder_reports')
+def get_reorder_report():
+    report = rollups.latest_reorder_report()
+    if not report:
+        return jsonify({'error': 'No reorder report has been generated yet'}), 404
     
     return jsonify({
-        'total_chemicals': total_chemicals,
-        'low_stock_chemicals': low_stock_chemicals,
-        'expiring_chemicals': expiring_chemicals,
-        'active_experiments': active_experiments,
-        'total_experiments': total_experiments,
-        'total_users': total_users
+        'id': report.id,
+        'generated_at': report.generated_at.isoformat(),
+        'items': [item.to_dict() for item in report.items]
     }), 200
 
-@dashboard_bp.route('/alerts', methods=['GET'])
+@dashboard_bp.route('/usage', methods=['GET'])
 @jwt_required()
-def get_alerts():
-    alerts = []
-    
-    # Low stock alerts
-    low_stock = Chemical.query.filter(Chemical.quantity <= Chemical.minimum_stock).all()
-    for chemical in low_stock:
-        alerts.append({
-            'type': 'low_stock',
-            'severity': 'warning',
-            'message': f'{chemical.name} is low on stock ({chemical.quantity} {chemical.unit} remaining)',
-            'chemical_id': chemical.id
-        })
-    
-    # Expiring soon alerts (within 30 days)
-    today = date.today()
-    thirty_days_from_now = today + timedelta(days=30)
-    expiring = Chemical.query.filter(
-        Chemical.expiry_date.isnot(None),
-        Chemical.expiry_date <= thirty_days_from_now
-    ).all()
-    
-    for chemical in expiring:
-        alerts.append({
-            'type': 'expiring',
-            'severity': 'error',
-            'message': f'{chemical.name} expires on {chemical.expiry_date}',
-            'chemical_id': chemical.id
-        })
-    
-    return jsonify(alerts), 200
+@conditional('usage_daily', daily=True)
+def get_usage():
+    try:
+        days = int(request.args.get('days', 30))
+        chemical_id = int(request.args['chemical_id']) if request.args.get('chemical_id') else None
+    except ValueError:
+        return jsonify({'error': 'days and chemical_id must be integers'}), 400
+    if not 1 <= days <= 366:
+        return jsonify({'error': 'days must be between 1 and 366'}), 400
+    
+    return jsonify(rollups.daily_usage(days, chemical_id)), 200
+
+@dashboard_bp.route('/forecast', methods=['GET'])
+@jwt_required()
+@conditional('chemicals', 'stock_movements', 'stock_movements_daily', daily=True)
+def get_forecast():
+    config = current_app.config
+    try:
+        days = int(request.args.get('days', config['FORECAST_WINDOW_DAYS']))
+        within = int(request.args.get('within', config['FORECAST_HORIZON_DAYS']))
+        limit = int(request.args.get('limit', config['DEFAULT_PAGE_SIZE']))
+        chemical_id = int(request.args['chemical_id']) if request.args.get('chemical_id') else None
+    except ValueError:
+        return jsonify({'error': 'days, within, limit and chemical_id must be integers'}), 400
+    if not 1 <= days <= 366:
+        return jsonify({'error': 'days must be between 1 and 366'}), 400
+    if within < 0:
+        return jsonify({'error': 'within must not be negative'}), 400
+    if not 1 <= limit <= config['MAX_PAGE_SIZE']:
+        return jsonify({'error': f'limit must be between 1 and {config["MAX_PAGE_SIZE"]}'}), 400
+    
+    items, total = forecast.at_risk(days, within, limit,
+                                    chemical_ids=[chemical_id] if chemical_id is not None else None)
+    return jsonify({'window_days': days, 'within_days': within, 'total': total, 'items': items}), 200
+
+def _table_version(table):
+    found = versions.current([table])
+    return {'version': found[table][0] if table in found else 0}
+
+# Change feed topics: each is computed once per change and pushed to every client
+events.feed.topic('metrics', cached_metrics, tables=('chemicals', 'experiments', 'users'), version=date.today)
+events.feed.topic('alerts', lambda: {
+    'version': alerts.version(),
+    'alerts': [alert.to_dict() for alert in alerts.active_alerts()],
+}, version=alerts.version)
+events.feed.topic('inventory', lambda: _table_version('chemicals'), tables=('chemicals',))
+events.feed.topic('experiments', lambda: _table_version('experiments'), tables=('experiments',))
+events.feed.topic('protocols', lambda: _table_version('safety_protocols'), tables=('safety_protocols',))
+events.feed.topic('reorder', lambda: _table_version('reorder_reports'), tables=('reorder_reports',))
+
+@dashboard_bp.route('/events', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_events():
+    # EventSource cannot set headers, so browsers pass the token as ?jwt=
+    try:
+        subscription = events.feed.subscribe()
+    except events.TooManySubscribers:
+        response = jsonify({'error': 'Too many live dashboard connections, try again later'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    config = current_app.config
+    body = events.stream(subscription, config['EVENTS_HEARTBEAT_SECONDS'], config['EVENTS_RETRY_MS'])
+    response = Response(body, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Search Routes
+@search_bp.route('/', methods=['GET'])
+@jwt_required()
+def search_all():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing search query (q)'}), 400
+    
+    types = request.args.get('type')
+    types = [t.strip() for t in types.split(',') if t.strip()] if types else list(search.SEARCH_TYPES)
+    unknown = [t for t in types if t not in search.SEARCH_TYPES]
+    if unknown:
+        return jsonify({'error': f'Unknown type: {", ".join(unknown)}'}), 400
+    
+    max_size = current_app.config['SEARCH_MAX_PAGE_SIZE']
+    try:
+        limit = int(request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE']))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if limit < 1 or limit > max_size or offset < 0:
+        return jsonify({'error': f'limit must be between 1 and {max_size} and offset non-negative'}), 400
+    
+    try:
+        results = search.search(query, types, limit, offset)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except search.SearchUnavailable:
+        return jsonify({'error': 'Search is not available on this database'}), 503
+    
+    return jsonify(results), 200
+
+# Scheduled Job Routes
+# Jobs and their runs span every lab, so they are for operators, not lab admins
+@jobs_bp.route('/', methods=['GET'])
+@auth.role_required(auth.OPERATOR, fresh=True)
+def get_jobs():
+    return jsonify(scheduler.status()), 200
+
+@jobs_bp.route('/<name>/runs', methods=['GET'])
+@auth.role_required(auth.OPERATOR, fresh=True)
+def get_job_runs(name):
+    if name not in scheduler.jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if not 1 <= limit <= 500:
+        return jsonify({'error': 'limit must be between 1 and 500'}), 400
+    
+    runs = db.session.scalars(
+        select(JobRun).where(JobRun.job == name).order_by(JobRun.id.desc()).limit(limit)
+    )
+    return jsonify([run.to_dict() for run in runs]), 200
+
+@jobs_bp.route('/<name>/run', methods=['POST'])
+@auth.role_required(auth.OPERATOR, fresh=True)
+def run_job(name):
+    if name not in scheduler.jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    run = scheduler.enqueue(name)
+    return jsonify(run.to_dict()), 202
@@ -0,0 +1,307 @@
+"""
+In-process job scheduler.
+
+Jobs are plain functions registered with ``@job(name, daily=...)`` or
+``@job(name, every=...)``. Every worker process runs a scheduler thread
+(started by its first request), but only the one holding the lease row in
+``scheduler_leases`` runs jobs; the others keep trying to take the lease over
+and do so within ``SCHEDULER_LEASE_SECONDS`` of the leader dying.
+
+Each attempt is recorded in ``job_runs`` with its status, timings, summary
+and error. A slot missed while no worker was running is run as soon as one
+is. A failed attempt is retried up to ``JOB_RETRIES`` times with exponential
+backoff from ``JOB_RETRY_SECONDS``. Runs queued with ``enqueue()`` (the
+``POST /api/jobs/<name>/run`` endpoint) are picked up on the leader's next
+tick. Everything the scheduler decides is derived from ``job_runs``, so a new
+leader carries on where the previous one stopped. Jobs are not scoped to a
+lab; with ``LAB_DATABASES`` a run covers the main database and then each lab
+database in turn (see tenancy.py).
+"""
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import tenancy
+from models import db, JobRun, SchedulerLease
+
+LEASE_NAME = 'scheduler'
+
+jobs = {}
+
+
+class Job:
+    def __init__(self, name, func, daily=None, every=None):
+        self.name = name
+        self.func = func
+        # Config key holding the local time of day ('HH:MM') the job runs at
+        self.daily = daily
+        # Or the interval between runs, in seconds
+        self.every = every
+
+    def schedule(self):
+        if self.daily:
+            return f'daily at {current_app.config[self.daily]}'
+        return f'every {self.every:g}s'
+
+    def slot(self, now):
+        """The latest time (UTC) the job was due at or before ``now`` (UTC)."""
+        if self.every:
+            epoch = now.replace(tzinfo=timezone.utc).timestamp()
+            return datetime.utcfromtimestamp(epoch - epoch % self.every)
+        hour, minute = (int(part) for part in current_app.config[self.daily].split(':'))
+        local_now = now.replace(tzinfo=timezone.utc).astimezone()
+        local_slot = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if local_slot > local_now:
+            local_slot -= timedelta(days=1)
+        return local_slot.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def next_slot(self, now):
+        if self.every:
+            return self.slot(now) + timedelta(seconds=self.every)
+        return self.slot(now) + timedelta(days=1)
+
+
+def job(name, daily=None, every=None):
+    """Register the decorated function as a scheduled job; it is called without arguments.
+
+    Its return value, if any, is stored as the run's JSON summary.
+    """
+    def decorator(func):
+        jobs[name] = Job(name, func, daily, every)
+        return func
+    return decorator
+
+
+def retry_delay(attempt):
+    """Seconds to wait after failed attempt number ``attempt`` before the next one."""
+    return current_app.config['JOB_RETRY_SECONDS'] * 2 ** (attempt - 1)
+
+
+def latest_runs():
+    """Return ``{job: JobRun}`` with the most recent run of each job."""
+    newest = select(JobRun.job, db.func.max(JobRun.id).label('id')).group_by(JobRun.job).subquery()
+    runs = db.session.scalars(select(JobRun).join(newest, JobRun.id == newest.c.id))
+    return {run.job: run for run in runs}
+
+
+def status(now=None):
+    """Describe every registered job: its schedule, latest run and next attempt."""
+    now = now or datetime.utcnow()
+    latest = latest_runs()
+    succeeded = dict(db.session.execute(
+        select(JobRun.job, db.func.max(JobRun.finished_at))
+        .where(JobRun.status == 'succeeded').group_by(JobRun.job)
+    ).all())
+    described = []
+    for name, registered in sorted(jobs.items()):
+        run = latest.get(name)
+        next_run = registered.next_slot(now)
+        if run is not None and run.status == 'failed' and run.attempt <= current_app.config['JOB_RETRIES']:
+            next_run = run.finished_at + timedelta(seconds=retry_delay(run.attempt))
+        elif run is None or run.scheduled_for < registered.slot(now) or run.status == 'queued':
+            next_run = now
+        described.append({
+            'name': name,
+            'schedule': registered.schedule(),
+            'last_run': run.to_dict() if run else None,
+            'last_success_at': succeeded[name].isoformat() if succeeded.get(name) else None,
+            'next_run_at': next_run.isoformat(),
+        })
+    return described
+
+
+def enqueue(name):
+    """Queue a run of ``name`` for the leader's next tick; return the queued run."""
+    now = datetime.utcnow()
+    run = JobRun(job=name, scheduled_for=now, attempt=1, status='queued')
+    db.session.add(run)
+    db.session.commit()
+    scheduler.wake()
+    return run
+
+
+class Scheduler:
+    def __init__(self):
+        self.worker = None
+        self.leader = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def start(self, app):
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Set after any fork, so every worker has its own identity
+            self.worker = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            self._thread = threading.Thread(target=self._run, args=(app,), name='scheduler', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def renew(self):
+        """Take or extend the lease; return whether this worker is the leader."""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=current_app.config['SCHEDULER_LEASE_SECONDS'])
+        lease = SchedulerLease.__table__
+        with db.engine.begin() as conn:
+            previous = conn.scalar(select(lease.c.owner).where(lease.c.name == LEASE_NAME))
+            taken = conn.execute(
+                update(lease)
+                .where(lease.c.name == LEASE_NAME,
+                       (lease.c.owner == self.worker) | (lease.c.expires_at < now))
+                .values(owner=self.worker, expires_at=expires_at)
+            ).rowcount
+        if not taken and previous is None:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(insert(lease).values(name=LEASE_NAME, owner=self.worker, expires_at=expires_at))
+                taken = 1
+            except IntegrityError:
+                pass
+
+        if taken and previous not in (None, self.worker):
+            # The previous leader's unfinished runs died with it; fail them so they are retried
+            with db.engine.begin() as conn:
+                conn.execute(
+                    update(JobRun.__table__)
+                    .where(JobRun.status == 'running', JobRun.worker == previous)
+                    .values(status='failed', finished_at=now, error='Worker stopped before the run finished')
+                )
+        self.leader = bool(taken)
+        return self.leader
+
+    def due(self, now):
+        """Return ``[(job, scheduled_for, attempt, queued run id or None)]`` to run now."""
+        config = current_app.config
+        latest = latest_runs()
+        pending = []
+        for name, registered in sorted(jobs.items()):
+            run = latest.get(name)
+            if run is not None and run.status == 'failed':
+                if run.attempt <= config['JOB_RETRIES']:
+                    if now >= run.finished_at + timedelta(seconds=retry_delay(run.attempt)):
+                        pending.append((registered, run.scheduled_for, run.attempt + 1, None))
+                    continue
+            slot = registered.slot(now)
+            done = db.session.scalar(
+                select(JobRun.id).where(JobRun.job == name, JobRun.scheduled_for == slot).limit(1))
+            if done is None:
+                pending.append((registered, slot, 1, None))
+
+        queued = db.session.execute(
+            select(JobRun.id, JobRun.job, JobRun.scheduled_for)
+            .where(JobRun.status == 'queued').order_by(JobRun.id)
+        ).all()
+        for run_id, name, scheduled_for in queued:
+            if name in jobs:
+                pending.append((jobs[name], scheduled_for, 1, run_id))
+        # Catching up runs missed slots in the order they fell due, so e.g. the
+        # usage rollup precedes the reorder report that reads it
+        return sorted(pending, key=lambda item: item[1])
+
+    def execute(self, registered, scheduled_for, attempt=1, run_id=None):
+        """Run one attempt of ``registered`` now, recording it in ``job_runs``; return the run id."""
+        app = current_app._get_current_object()
+        started_at = datetime.utcnow()
+        runs = JobRun.__table__
+        with db.engine.begin() as conn:
+            if run_id is None:
+                run_id = conn.execute(insert(runs).values(
+                    job=registered.name, scheduled_for=scheduled_for, attempt=attempt,
+                    status='running', worker=self.worker, started_at=started_at,
+                )).inserted_primary_key[0]
+            elif not conn.execute(
+                update(runs).where(runs.c.id == run_id, runs.c.status == 'queued')
+                .values(status='running', worker=self.worker, started_at=started_at)
+            ).rowcount:
+                return run_id
+
+        outcome = {}
+        worker = threading.Thread(target=self._call, args=(app, registered, outcome),
+                                  name=f'job-{registered.name}', daemon=True)
+        start = time.perf_counter()
+        worker.start()
+        # Keep the lease alive however long the job takes
+        while True:
+            worker.join(app.config['SCHEDULER_LEASE_SECONDS'] / 3)
+            if not worker.is_alive():
+                break
+            if self.leader and not self.renew():
+                app.logger.warning('Scheduler lease lost while %s was running', registered.name)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        with db.engine.begin() as conn:
+            conn.execute(update(runs).where(runs.c.id == run_id).values(
+                status='failed' if 'error' in outcome else 'succeeded',
+                finished_at=datetime.utcnow(), duration_ms=round(duration_ms, 1),
+                result=outcome.get('result'), error=outcome.get('error'),
+            ))
+            cutoff = started_at - timedelta(days=app.config['JOB_HISTORY_DAYS'])
+            conn.execute(delete(runs).where(runs.c.job == registered.name, runs.c.scheduled_for < cutoff,
+                                            runs.c.status.in_(['succeeded', 'failed'])))
+        return run_id
+
+    @staticmethod
+    def _call(app, registered, outcome):
+        with app.app_context():
+            try:
+                result = tenancy.each_database(registered.func)
+                if result is not None:
+                    outcome['result'] = json.dumps(result, default=str)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Job %s failed', registered.name)
+                outcome['error'] = traceback.format_exc(limit=5)
+
+    def tick(self):
+        """Renew the lease and, as the leader, run every due job in turn."""
+        if not self.renew():
+            return
+        for registered, scheduled_for, attempt, run_id in self.due(datetime.utcnow()):
+            self.execute(registered, scheduled_for, attempt, run_id)
+            # A long job may have outlived the lease
+            if not self.renew():
+                return
+
+    def _run(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    self.tick()
+            except Exception:
+                app.logger.exception('Scheduler tick failed')
+            self._wake.wait(app.config['SCHEDULER_POLL_SECONDS'])
+            self._wake.clear()
+
+
+scheduler = Scheduler()
+
+
+def run_now(name):
+    """Run ``name`` in this process right away, outside the leader (``flask run-job``)."""
+    runner = Scheduler()
+    runner.worker = f'cli:{socket.gethostname()}:{os.getpid()}'
+    run_id = runner.execute(jobs[name], datetime.utcnow())
+    return db.session.get(JobRun, run_id)
+
+
+def init_app(app):
+    if not app.config['SCHEDULER_ENABLED']:
+        return
+
+    @app.before_request
+    def start_scheduler():
+        # Started lazily so CLI commands and the Gunicorn master never run jobs
+        if scheduler._thread is None:
+            scheduler.start(app)
@@ -0,0 +1,156 @@
+"""
+Full-text search over chemicals, experiments and safety protocols.
+
+Each table has an external-content FTS5 index (see migration 3) that triggers
+keep in sync with every insert, update and delete. User input is never passed
+to FTS5 as query syntax: each term is quoted as a phrase, so punctuation such
+as the hyphens in CAS numbers is matched literally. Chemical terms are all
+prefix matches ("eth" finds Ethanol, "64-17" finds 64-17-5); for the free-text
+tables only the last term is, so results narrow as the user types.
+
+Matches are ranked with bm25, weighting names and titles above body text.
+Scoring every match of a common word ("solution") grows with the size of the
+lab's history, so only the newest ``SEARCH_RANK_WINDOW`` matches of a query
+are ranked; queries with fewer matches are ranked exhaustively. Only the rows
+of the requested page are joined back to their base table, and snippets are
+cut from those rows in Python rather than by FTS5's ``snippet()``, which would
+be evaluated for every match before the sort. Matches are restricted to the
+user's lab by a primary-key join inside the ranking subquery.
+"""
+import re
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import tenancy
+from models import db
+from queries import QueryError
+
+
+class SearchUnavailable(Exception):
+    """The FTS5 indexes are missing (SQLite without FTS5, or not migrated)."""
+
+
+class SearchType:
+    """One searchable table: its FTS index, bm25 column weights and result columns.
+
+    ``snippet_columns`` are read for the page's rows to build the ``snippet``
+    excerpt and are not returned themselves.
+    """
+
+    def __init__(self, table, weights, columns, prefix_all, snippet_columns=()):
+        self.table = table
+        self.fts = f'{table}_fts'
+        self.weights = weights
+        self.columns = columns
+        self.prefix_all = prefix_all
+        self.snippet_columns = snippet_columns
+
+    def statement(self, window, scoped=False):
+        score = f'bm25({self.fts}, {", ".join(str(w) for w in self.weights)})'
+        columns = ', '.join(f't.{c}' for c in self.columns + self.snippet_columns)
+        newest = f'ORDER BY {self.fts}.rowid DESC LIMIT {int(window)}' if window else ''
+        # Other labs' matches are dropped before the window, so they never crowd out the lab's own
+        lab = f'JOIN {self.table} AS s ON s.id = {self.fts}.rowid AND s.lab_id = :lab_id ' if scoped else ''
+        return text(
+            f'SELECT {columns}, m.score AS rank '
+            f'FROM (SELECT {self.fts}.rowid AS rowid, {score} AS score FROM {self.fts} {lab}'
+            f'WHERE {self.fts} MATCH :query {newest}) AS m '
+            f'JOIN {self.table} AS t ON t.id = m.rowid '
+            f'ORDER BY m.score, t.id LIMIT :limit OFFSET :offset'
+        )
+
+
+SEARCH_TYPES = {
+    'chemicals': SearchType(
+        'chemicals', (10.0, 10.0, 1.0),
+        ('id', 'name', 'cas_number', 'quantity', 'unit', 'location', 'expiry_date'),
+        prefix_all=True,
+    ),
+    'experiments': SearchType(
+        'experiments', (10.0, 2.0, 1.0, 1.0),
+        ('id', 'title', 'status', 'user_id', 'created_at', 'updated_at'),
+        prefix_all=False, snippet_columns=('description', 'procedure', 'results'),
+    ),
+    'protocols': SearchType(
+        'safety_protocols', (10.0, 1.0, 5.0),
+        ('id', 'title', 'category', 'updated_at'),
+        prefix_all=False, snippet_columns=('description',),
+    ),
+}
+
+_WORD = re.compile(r'\w')
+
+
+def parse_terms(query):
+    terms = [term.replace('"', '') for term in query.split()]
+    terms = [term for term in terms if _WORD.search(term)]
+    if not terms:
+        raise QueryError('Search query must contain at least one letter or digit')
+    return terms
+
+
+def build_match(terms, prefix_all):
+    """Turn search terms into an FTS5 MATCH expression of quoted (prefix) phrases."""
+    phrases = []
+    for i, term in enumerate(terms):
+        prefix = prefix_all or i == len(terms) - 1
+        phrases.append(f'"{term}"' + ('*' if prefix else ''))
+    return ' '.join(phrases)
+
+
+def excerpt(texts, terms, width=120):
+    """Return about ``width`` characters of ``texts`` around the first term found."""
+    pattern = re.compile('|'.join(r'\b' + re.escape(term) for term in terms), re.IGNORECASE)
+    texts = [t for t in texts if t]
+    for body in texts:
+        found = pattern.search(body)
+        if found:
+            start = max(0, found.start() - width // 3)
+            end = min(len(body), start + width)
+            return ('...' if start else '') + body[start:end].strip() + ('...' if end < len(body) else '')
+    if texts:
+        return texts[0][:width] + ('...' if len(texts[0]) > width else '')
+    return None
+
+
+def search(query, types, limit, offset):
+    """Return ``{type: {'items': [...], 'next_offset': n or None}}`` for each type.
+
+    Items are ordered best match first and carry their bm25 ``rank`` (lower
+    is better); experiments and protocols also carry a plain-text ``snippet``.
+    """
+    terms = parse_terms(query)
+    window = current_app.config['SEARCH_RANK_WINDOW']
+    # Raw SQL is not scoped to the lab by the session
+    lab_id = tenancy.current_lab()
+    results = {}
+    for name in types:
+        spec = SEARCH_TYPES[name]
+        params = {
+            'query': build_match(terms, spec.prefix_all),
+            'limit': limit + 1,
+            'offset': offset,
+            'lab_id': lab_id,
+        }
+        try:
+            rows = db.session.execute(spec.statement(window, scoped=lab_id is not None), params).all()
+        except OperationalError as e:
+            if 'no such table' in str(e.orig):
+                raise SearchUnavailable(f'{spec.fts} is missing')
+            raise
+        next_offset = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_offset = offset + limit
+
+        items = []
+        for row in rows:
+            values = row._mapping
+            item = {key: values[key] for key in spec.columns + ('rank',)}
+            if spec.snippet_columns:
+                item['snippet'] = excerpt([values[c] for c in spec.snippet_columns], terms)
+            items.append(item)
+        results[name] = {'items': items, 'next_offset': next_offset}
+    return results
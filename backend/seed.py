@@ -2,12 +2,15 @@
 Seed the database with initial data for testing and demonstration
 """
 from app import create_app
+import migrations
 from models import db, User, Chemical, SafetyProtocol, Experiment
 from datetime import date, timedelta
 
 def seed_data():
     app = create_app()
     with app.app_context():
+        migrations.upgrade_all()
+        
         # Create admin user
         admin = User.query.filter_by(username='admin').first()
         if not admin:
@@ -75,7 +78,7 @@ def seed_data():
                     title='Handling Corrosive Chemicals',
                     description='Wear acid-resistant gloves and face shield when handling corrosive substances. Work in fume hood when possible. Have neutralizing agents readily available.',
                     category='chemical_specific',
-                    related_chemicals='["HCl", "NaOH", "H2SO4"]'
+                    related_chemicals='["7647-01-0", "1310-73-2", "7664-93-9"]'
                 ),
                 SafetyProtocol(
                     title='Emergency Procedures',
@@ -0,0 +1,115 @@
+"""
+JSON encoding for API responses.
+
+``JSONProvider`` is installed as the app's JSON provider, so ``jsonify`` and
+the streaming exports both encode through it. It uses orjson when that is
+installed (``pip install orjson``) and the standard library otherwise;
+``JSON_PROVIDER`` can force either. Both encoders write ``date`` and
+``datetime`` values in ISO 8601, exactly like ``isoformat()``, so list rows go
+from SQL ``Row`` tuples to JSON without a per-value conversion pass. Neither
+sorts keys.
+
+List endpoints can also send a page column by column
+(``application/vnd.chemlap.columns+json``): one object mapping each field
+name to the array of its values, so names are sent once per page rather than
+once per row. With the ``msgpack`` package installed the same object is
+offered as MessagePack (``application/msgpack``). Clients choose with
+``Accept``; anything else gets the usual array of objects.
+"""
+import json
+from datetime import date, datetime
+
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_BACKENDS = ('auto', 'orjson', 'stdlib')
+
+# List representations (see list_formats())
+JSON = 'application/json'
+COLUMNS_JSON = 'application/vnd.chemlap.columns+json'
+MSGPACK = 'application/msgpack'
+
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+
+class JSONProvider(DefaultJSONProvider):
+    sort_keys = False
+
+    def __init__(self, app):
+        super().__init__(app)
+        backend = app.config['JSON_PROVIDER']
+        if backend not in JSON_BACKENDS:
+            raise ValueError(f'JSON_PROVIDER must be one of {", ".join(JSON_BACKENDS)}')
+        if backend == 'orjson' and orjson is None:
+            raise RuntimeError('JSON_PROVIDER is orjson but orjson is not installed')
+        self.use_orjson = orjson is not None and backend != 'stdlib'
+
+    def dumps(self, obj, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        if 'indent' not in kwargs:
+            kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, **kwargs)
+
+    def dumpb(self, obj):
+        """``dumps`` to UTF-8 bytes, without the str round trip under orjson."""
+        if self.use_orjson:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return self.dumps(obj).encode()
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if not self.use_orjson:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # Skip the bytes -> str -> bytes round trip
+        body = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def rows_to_dicts(names, rows):
+    """Map each ``Row`` (or tuple) to a dict of its first ``len(names)`` columns."""
+    return [dict(zip(names, row)) for row in rows]
+
+
+def rows_to_columns(names, rows):
+    """Map each of ``names`` to the sequence of that column's values, in row order."""
+    # zip(*rows) transposes in C; columns past len(names) are dropped
+    columns = list(zip(*rows))[:len(names)] or [()] * len(names)
+    return dict(zip(names, columns))
+
+
+def list_formats():
+    """The media types list endpoints can send, preferred first."""
+    return [JSON, COLUMNS_JSON, MSGPACK] if msgpack is not None else [JSON, COLUMNS_JSON]
+
+
+def encode_list(media_type, names, rows):
+    """Encode list rows as ``media_type`` (one of ``list_formats()``), returning bytes."""
+    if media_type == JSON:
+        return current_app.json.dumpb(rows_to_dicts(names, rows))
+    columns = rows_to_columns(names, rows)
+    if media_type == MSGPACK:
+        return msgpack.packb(columns, default=_default)
+    return current_app.json.dumpb(columns)
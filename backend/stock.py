@@ -0,0 +1,123 @@
+"""
+Atomic stock consumption.
+
+An experiment's whole consumption is applied with a single
+``UPDATE chemicals SET quantity = quantity - CASE id ... END`` that is guarded
+by ``quantity >= amount`` and by optional per-chemical version checks. The
+database does the arithmetic, so concurrent consumers can neither lose updates
+nor drive stock negative. The usage rows and stock movements are written in
+the same transaction.
+"""
+from datetime import datetime
+
+from sqlalchemy import case, insert, select, update
+
+from models import db, Chemical, ExperimentChemical
+import changes
+import ledger
+import units
+
+
+class ConsumptionError(Exception):
+    """One or more chemicals could not be consumed; nothing was changed."""
+
+    def __init__(self, problems):
+        super().__init__('Stock consumption failed')
+        self.problems = problems
+
+
+def parse_items(items):
+    """Validate ``[{chemical_id, amount, version?}]``; return ``(amounts, versions)``.
+
+    Repeated chemicals are summed so each row is updated exactly once.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non-empty list')
+    amounts, versions = {}, {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Each item must be an object')
+        chemical_id, amount, version = item.get('chemical_id'), item.get('amount'), item.get('version')
+        if not isinstance(chemical_id, int) or isinstance(chemical_id, bool):
+            raise ValueError('chemical_id must be an integer')
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool) or amount <= 0:
+            raise ValueError('amount must be a positive number')
+        if version is not None:
+            if not isinstance(version, int) or versions.get(chemical_id, version) != version:
+                raise ValueError(f'Invalid version for chemical {chemical_id}')
+            versions[chemical_id] = version
+        amounts[chemical_id] = amounts.get(chemical_id, 0) + amount
+    return amounts, versions
+
+
+def consume(experiment_id, items, user_id=None):
+    """Deduct ``items`` from stock and record them against the experiment.
+
+    Returns ``{'usage': [...], 'chemicals': [...]}``; raises ``ValueError`` for
+    malformed input and ``ConsumptionError`` when any chemical is missing, has
+    insufficient stock or fails its version check.
+    """
+    amounts, versions = parse_items(items)
+    now = datetime.utcnow()
+
+    delta = case(amounts, value=Chemical.id)
+    stmt = (
+        update(Chemical)
+        .where(Chemical.id.in_(amounts), Chemical.quantity >= delta)
+        .values(quantity=Chemical.quantity - delta, version=Chemical.version + 1, updated_at=now,
+                base_quantity=(Chemical.quantity - delta) * units.factor(Chemical.unit))
+        .returning(Chemical.id, Chemical.quantity, Chemical.unit, Chemical.version)
+        .execution_options(synchronize_session=False)
+    )
+    if versions:
+        stmt = stmt.where(Chemical.version == case(versions, value=Chemical.id, else_=Chemical.version))
+    updated = {row.id: row for row in db.session.execute(stmt)}
+
+    if len(updated) != len(amounts):
+        db.session.rollback()
+        raise ConsumptionError(_diagnose(amounts, versions))
+
+    usage = [
+        {'experiment_id': experiment_id, 'chemical_id': chemical_id, 'amount': amount,
+         'unit': updated[chemical_id].unit, 'user_id': user_id, 'created_at': now}
+        for chemical_id, amount in amounts.items()
+    ]
+    db.session.execute(insert(ExperimentChemical), usage)
+    ledger.record(db.session, [
+        {'chemical_id': chemical_id, 'delta': -amount, 'quantity': updated[chemical_id].quantity,
+         'unit': updated[chemical_id].unit, 'reason': 'consume', 'experiment_id': experiment_id,
+         'user_id': user_id, 'created_at': now}
+        for chemical_id, amount in amounts.items()
+    ])
+    changes.record(db.session, 'chemicals', updated, 'update')
+    db.session.commit()
+
+    return {
+        'usage': [{**row, 'created_at': now.isoformat()} for row in usage],
+        'chemicals': [
+            {'id': row.id, 'quantity': row.quantity, 'unit': row.unit, 'version': row.version}
+            for row in updated.values()
+        ],
+    }
+
+
+def _diagnose(amounts, versions):
+    current = {
+        row.id: row for row in db.session.execute(
+            select(Chemical.id, Chemical.quantity, Chemical.version)
+            .where(Chemical.id.in_(amounts))
+        )
+    }
+    problems = []
+    for chemical_id, amount in amounts.items():
+        row = current.get(chemical_id)
+        if row is None:
+            error = 'Chemical not found'
+        elif chemical_id in versions and row.version != versions[chemical_id]:
+            error = f'Version conflict (current version is {row.version})'
+        elif row.quantity < amount:
+            error = f'Insufficient stock ({row.quantity} available)'
+        else:
+            continue
+        problems.append({'chemical_id': chemical_id, 'error': error})
+    return problems or [{'chemical_id': None, 'error': 'Concurrent update, please retry'}]
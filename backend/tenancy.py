@@ -0,0 +1,189 @@
+"""
+Multi-lab tenancy.
+
+One deployment serves many labs. Users and each lab's data (chemicals,
+experiments, safety protocols, alerts, usage rollups and reorder items) carry
+a ``lab_id``, and access tokens carry the user's lab as a ``lab`` claim.
+Every ORM statement a session runs for a lab is scoped to it with
+``with_loader_criteria``: SELECTs, their joins and subqueries, relationship
+loads and ORM UPDATE/DELETE statements only see the lab's rows, and new rows
+are assigned to it on flush. Handlers need no lab filter of their own, and
+the indexes of lab-scoped tables lead with ``lab_id``, so one lab's queries
+never scan another lab's rows.
+
+The lab comes from the verified token. Outside a request (scheduled jobs, the
+CLI) nothing is scoped unless ``scoped(lab_id)`` sets a lab, as the dashboard
+change feed does for each lab it serves. Core statements on ``Table``
+objects and raw connections are never scoped: code using them for lab data
+filters by ``current_lab()`` itself.
+
+Labs listed in ``LAB_DATABASES`` keep their data in a SQLite file of their
+own, bound as ``lab-<id>``. While scoped to such a lab, the session runs
+statements on every table except ``SHARED_TABLES`` against that file, so its
+writes no longer wait on the other labs' write lock. Each lab database
+attaches the main one as ``shared``, where SQLite finds the tables the lab
+file lacks, so joins with ``users`` keep working. Scheduled jobs run once for
+the main database and once per lab database (``each_database``).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import current_app, g, has_request_context
+from flask_jwt_extended import get_jwt
+from sqlalchemy import Table, event, inspect
+from sqlalchemy.orm import Session, with_loader_criteria
+from sqlalchemy.sql.dml import UpdateBase
+
+import auth
+import database
+from models import db, LabScoped, DEFAULT_LAB_ID
+
+# Tables every lab uses, which stay in the main database
+SHARED_TABLES = frozenset({'labs', 'users', 'scheduler_leases', 'job_runs'})
+
+# Lab set by scoped(); takes precedence over the request's token
+_scoped_lab = ContextVar('scoped_lab', default=None)
+
+
+def current_lab():
+    """The id of the lab statements are scoped to, or ``None`` when they are not scoped."""
+    lab_id = _scoped_lab.get()
+    if lab_id is not None or not has_request_context():
+        return lab_id
+    if 'lab_id' not in g:
+        if g.get('resolving_lab'):
+            # Looking up the user of an old token is not scoped
+            return None
+        try:
+            get_jwt()
+        except RuntimeError:
+            # No verified token (yet), as for logins and registrations
+            return None
+        g.resolving_lab = True
+        try:
+            g.lab_id = auth.current_lab()
+        finally:
+            g.resolving_lab = False
+    return g.lab_id
+
+
+def assigned_lab():
+    """The lab new rows are created in: the current one, or the default lab."""
+    lab_id = current_lab()
+    return DEFAULT_LAB_ID if lab_id is None else lab_id
+
+
+@contextmanager
+def scoped(lab_id):
+    """Scope the statements run inside the block to ``lab_id`` (``None``: not scoped)."""
+    token = _scoped_lab.set(lab_id)
+    try:
+        yield
+    finally:
+        _scoped_lab.reset(token)
+
+
+def bind_key(lab_id):
+    return f'lab-{lab_id}'
+
+
+def lab_engines():
+    """``[(lab_id, engine)]`` for every lab with a database of its own."""
+    return [(lab_id, db.engines[bind_key(lab_id)]) for lab_id in sorted(current_app.config['LAB_DATABASES'])]
+
+
+def lab_tables():
+    """The tables a lab database holds."""
+    return [table for table in db.metadata.sorted_tables if table.name not in SHARED_TABLES]
+
+
+def configure(app):
+    """Bind every lab in ``LAB_DATABASES``; call before ``db.init_app``."""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for lab_id, url in app.config['LAB_DATABASES'].items():
+        binds[bind_key(lab_id)] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_app(app):
+    """Attach the main database to every connection of the lab databases (in an app context)."""
+    if not app.config['LAB_DATABASES']:
+        return
+    main = db.engine.url.database
+    if db.engine.dialect.name != 'sqlite' or main in (None, '', ':memory:'):
+        raise RuntimeError('LAB_DATABASES needs DATABASE_URL to be a SQLite database file')
+
+    def attach_main(dbapi_connection, connection_record):
+        dbapi_connection.execute('ATTACH DATABASE ? AS shared', (main,))
+
+    for _, engine in lab_engines():
+        event.listen(engine, 'connect', attach_main)
+        engine.dispose()
+
+
+def each_database(func):
+    """Call ``func()`` on the main database, then scoped to each lab with a database of its own.
+
+    Returns what ``func`` returns, or ``{'main': result, 'lab-<id>': result}``
+    when labs have databases of their own.
+    """
+    labs = current_app.config['LAB_DATABASES']
+    if not labs:
+        return func()
+    results = {'main': func()}
+    for lab_id in sorted(labs):
+        # Ids repeat across databases, so no object may stay in the identity map
+        db.session.remove()
+        with scoped(lab_id):
+            try:
+                results[bind_key(lab_id)] = func()
+            finally:
+                db.session.remove()
+    return results
+
+
+def _table(mapper, clause):
+    if mapper is not None:
+        return inspect(mapper).local_table
+    if isinstance(clause, Table):
+        return clause
+    if isinstance(clause, UpdateBase):
+        return clause.table
+    return None
+
+
+@database.router
+def _lab_database(mapper, clause):
+    if not current_app.config['LAB_DATABASES']:
+        return None
+    lab_id = current_lab()
+    engine = db.engines.get(bind_key(lab_id)) if lab_id is not None else None
+    if engine is None:
+        return None
+    table = _table(mapper, clause)
+    if table is not None and table.name in SHARED_TABLES:
+        return None
+    return engine
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _scope_to_lab(state):
+    if state.is_column_load or state.is_relationship_load:
+        # The statement that loaded the object passes its criteria on
+        return
+    if not (state.is_select or state.is_update or state.is_delete):
+        return
+    lab_id = current_lab()
+    if lab_id is not None:
+        state.statement = state.statement.options(
+            with_loader_criteria(LabScoped, lambda cls: cls.lab_id == lab_id, include_aliases=True)
+        )
+
+
+@event.listens_for(Session, 'before_flush')
+def _assign_lab(session, flush_context, instances):
+    lab_id = None
+    for obj in session.new:
+        if isinstance(obj, LabScoped) and obj.lab_id is None:
+            lab_id = lab_id or assigned_lab()
+            obj.lab_id = lab_id
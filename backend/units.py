@@ -0,0 +1,207 @@
+"""
+Unit registry and conversion to canonical base quantities.
+
+``Chemical.unit`` stays the free-form unit the container is tracked in, but
+every chemical also stores its quantity and minimum stock in the base unit of
+the unit's dimension (``base_unit``, ``base_quantity``,
+``base_minimum_stock``): grams for mass, millilitres for volume, moles for
+amounts of substance and ``each`` for counted items. Containers of one CAS
+number or location can then be totalled with a single ``GROUP BY`` however
+they are labelled. Units the registry does not know leave the base columns
+NULL; their quantities are only ever compared raw.
+
+The base columns are set in Python on ORM flushes and by ``base_values()``
+for Core inserts, and in SQL (``factor()``) by writers that update
+quantities in place, so every write keeps them in step. ``convert()``
+converts whole arrays of quantities with NumPy for bulk reads.
+"""
+import numpy as np
+from sqlalchemy import case, event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from models import db, Chemical
+
+# unit -> (base unit, factor to the base unit)
+UNITS = {
+    'ug': ('g', 1e-6), 'mg': ('g', 1e-3), 'g': ('g', 1.0), 'kg': ('g', 1e3),
+    'ul': ('ml', 1e-3), 'ml': ('ml', 1.0), 'cl': ('ml', 10.0), 'dl': ('ml', 100.0), 'l': ('ml', 1e3),
+    'umol': ('mol', 1e-6), 'mmol': ('mol', 1e-3), 'mol': ('mol', 1.0),
+    'each': ('each', 1.0),
+}
+
+# Other spellings, matched after stripping and lower-casing
+ALIASES = {
+    'µg': 'ug', 'mcg': 'ug', 'milligram': 'mg', 'milligrams': 'mg',
+    'gram': 'g', 'grams': 'g', 'gr': 'g', 'kilogram': 'kg', 'kilograms': 'kg',
+    'µl': 'ul', 'microliter': 'ul', 'microlitre': 'ul', 'cc': 'ml', 'milliliter': 'ml', 'millilitre': 'ml',
+    'milliliters': 'ml', 'millilitres': 'ml', 'liter': 'l', 'litre': 'l', 'liters': 'l', 'litres': 'l', 'lt': 'l',
+    'µmol': 'umol', 'mole': 'mol', 'moles': 'mol',
+    'ea': 'each', 'pc': 'each', 'pcs': 'each', 'piece': 'each', 'pieces': 'each', 'unit': 'each', 'units': 'each',
+}
+
+BASE_UNITS = sorted({base for base, _ in UNITS.values()})
+
+# Columns stock can be totalled by (and filtered on)
+TOTAL_KEYS = {'cas_number': Chemical.cas_number, 'location': Chemical.location}
+
+_SPELLINGS = {**{unit: unit for unit in UNITS}, **ALIASES}
+
+
+class UnitError(ValueError):
+    """A unit is unknown or cannot be converted to the requested one."""
+
+
+def normalize(unit):
+    """Return the registry's name for ``unit``, or ``None`` when it is unknown."""
+    if not isinstance(unit, str):
+        return None
+    return _SPELLINGS.get(unit.strip().lower())
+
+
+def base_of(unit):
+    """Return ``(base unit, factor)`` for ``unit``, or ``(None, None)`` when it is unknown."""
+    return UNITS.get(normalize(unit), (None, None))
+
+
+def base_values(quantity, minimum_stock, unit):
+    """The base columns for a chemical with these values."""
+    base_unit, factor = base_of(unit)
+    if base_unit is None:
+        return {'base_unit': None, 'base_quantity': None, 'base_minimum_stock': None}
+    return {
+        'base_unit': base_unit,
+        'base_quantity': _scaled(quantity, factor),
+        'base_minimum_stock': _scaled(minimum_stock or 0, factor),
+    }
+
+
+def _scaled(value, factor):
+    try:
+        return float(value) * factor
+    except (TypeError, ValueError):
+        return None
+
+
+def factor(unit_column):
+    """SQL expression for the factor from ``unit_column`` to its base unit (NULL if unknown)."""
+    return case({spelling: UNITS[unit][1] for spelling, unit in _SPELLINGS.items()},
+                value=func.lower(func.trim(unit_column)), else_=None)
+
+
+def base_unit(unit_column):
+    """SQL expression for the base unit of ``unit_column`` (NULL if unknown)."""
+    return case({spelling: UNITS[unit][0] for spelling, unit in _SPELLINGS.items()},
+                value=func.lower(func.trim(unit_column)), else_=None)
+
+
+def ratio(from_column, to_column):
+    """SQL expression for the factor from the unit in ``from_column`` to the one in ``to_column``.
+
+    Equal spellings give 1, even of units the registry does not know; units of
+    other dimensions, or unknown ones that differ, give NULL.
+    """
+    return case(
+        # Checked first: the spellings nearly always match exactly
+        (from_column == to_column, 1.0),
+        (func.lower(func.trim(from_column)) == func.lower(func.trim(to_column)), 1.0),
+        (base_unit(from_column) == base_unit(to_column), factor(from_column) / factor(to_column)),
+        else_=None,
+    )
+
+
+def refresh(connection, ids=None):
+    """Recompute the base columns in SQL, for the chemicals in ``ids`` or all of them."""
+    table = Chemical.__table__
+    stmt = update(table).values(
+        base_unit=base_unit(table.c.unit),
+        base_quantity=table.c.quantity * factor(table.c.unit),
+        base_minimum_stock=func.coalesce(table.c.minimum_stock, 0) * factor(table.c.unit),
+    )
+    if ids is not None:
+        ids = list(ids)
+        if not ids:
+            return
+        stmt = stmt.where(table.c.id.in_(ids))
+    connection.execute(stmt)
+
+
+def convert(quantities, from_units, to_unit=None):
+    """Convert an array of quantities, each in its own unit, in one vectorized pass.
+
+    With ``to_unit`` every quantity is converted to that unit and ``UnitError``
+    is raised if any is of another dimension; without it each goes to its base
+    unit. Returns ``(values, units)`` as NumPy arrays; quantities in unknown
+    units come back as NaN with a ``None`` unit.
+    """
+    quantities = np.asarray(quantities, dtype=float)
+    names, positions = np.unique(np.asarray([unit or '' for unit in from_units], dtype=object),
+                                 return_inverse=True)
+    bases = [base_of(name) for name in names]
+    factors = np.array([f if f is not None else np.nan for _, f in bases])
+    units = np.array([base for base, _ in bases], dtype=object)
+
+    if to_unit is not None:
+        target_base, target_factor = base_of(to_unit)
+        if target_base is None:
+            raise UnitError(f'Unknown unit: {to_unit}')
+        mismatched = [str(name) for name, (base, _) in zip(names, bases) if base not in (None, target_base)]
+        if mismatched:
+            raise UnitError(f'Cannot convert {", ".join(mismatched)} to {to_unit}')
+        factors = factors / target_factor
+        units = np.array([normalize(to_unit) if base else None for base, _ in bases], dtype=object)
+    return quantities * factors[positions], units[positions]
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+def stock_totals(by, unit=None, filters=None):
+    """Total stock and minimum stock per ``by`` value and base unit, with one ``GROUP BY``.
+
+    ``filters`` maps ``TOTAL_KEYS`` names to required values. With ``unit``
+    only chemicals of that unit's dimension are totalled, and the totals are
+    given in ``unit``. Chemicals in unknown units form a group per ``by``
+    value with a ``None`` unit and quantity.
+    """
+    target = None
+    if unit:
+        target = base_of(unit)[0]
+        if target is None:
+            raise UnitError(f'Unknown unit: {unit}')
+    key = TOTAL_KEYS[by]
+    stmt = (
+        select(key, Chemical.base_unit, func.sum(Chemical.base_quantity), func.sum(Chemical.base_minimum_stock),
+               func.count(), func.sum(case((Chemical.base_quantity <= Chemical.base_minimum_stock, 1), else_=0)))
+        .group_by(key, Chemical.base_unit)
+        .order_by(key, Chemical.base_unit)
+    )
+    for name, value in (filters or {}).items():
+        stmt = stmt.where(TOTAL_KEYS[name] == value)
+    if target:
+        stmt = stmt.where(Chemical.base_unit == target)
+    rows = db.session.execute(stmt).all()
+    if not rows:
+        return []
+
+    keys, base_units, quantities, minimums, containers, low_stock = zip(*rows)
+    quantities, out_units = convert(quantities, base_units, unit)
+    minimums, _ = convert(minimums, base_units, unit)
+    return [
+        {by: keys[i], 'unit': out_units[i], 'quantity': _number(quantities[i]),
+         'minimum_stock': _number(minimums[i]), 'containers': containers[i], 'low_stock': low_stock[i]}
+        for i in range(len(rows))
+    ]
+
+
+@event.listens_for(Session, 'before_flush')
+def _sync_base_columns(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Chemical):
+            continue
+        state = inspect(obj)
+        if obj in session.new or any(
+            state.attrs[name].history.has_changes() for name in ('quantity', 'minimum_stock', 'unit')
+        ):
+            for column, value in base_values(obj.quantity, obj.minimum_stock, obj.unit).items():
+                setattr(obj, column, value)
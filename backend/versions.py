@@ -0,0 +1,93 @@
+"""
+HTTP validators for the read endpoints.
+
+Every commit bumps a counter for each table it wrote to (``table_versions``)
+in the same transaction, so all worker processes agree on the versions and a
+rollback leaves them untouched. A view decorated with ``conditional(*tables)``
+builds its ETag from those counters, the request URL, its ``Accept`` header
+(list endpoints negotiate their format) and the user's lab with a single
+primary-key lookup. It answers ``If-None-Match`` / ``If-Modified-Since`` with
+``304 Not Modified`` before the view runs its query or serializes anything.
+Views whose result moves with the calendar (the usage and forecast windows)
+pass ``daily=True``, which adds the UTC date to both validators.
+"""
+import hashlib
+from datetime import datetime, time, timezone
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+import tenancy
+from models import db, TableVersion
+from changes import before_commit, tables
+
+
+@before_commit
+def _bump_versions(session, changes):
+    now = datetime.utcnow()
+    table = TableVersion.__table__
+    for name in sorted(tables(changes)):
+        stmt = insert(table).values(table_name=name, version=1, updated_at=now)
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.table_name],
+            set_={'version': table.c.version + 1, 'updated_at': now},
+        ))
+
+
+def current(table_names):
+    """Return ``{table: (version, updated_at)}`` for tables written at least once."""
+    rows = db.session.execute(
+        select(TableVersion.table_name, TableVersion.version, TableVersion.updated_at)
+        .where(TableVersion.table_name.in_(table_names))
+    )
+    return {name: (version, updated_at) for name, version, updated_at in rows}
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        # HTTP dates have one-second resolution
+        return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    return False
+
+
+def conditional(*table_names, daily=False):
+    """Serve the view with ETag/Last-Modified validators derived from ``table_names``.
+
+    The response must depend only on the request URL, ``Accept``, the lab and
+    the contents of those tables, plus the current UTC date with ``daily``
+    (views whose window ends today). Only 200 responses get validators.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            found = current(table_names)
+            state = '.'.join(str(found[name][0]) if name in found else '0' for name in table_names)
+            key = f'{tenancy.current_lab()}:{request.full_path}:{request.headers.get("Accept", "")}'
+            last_modified = max((updated_at for _, updated_at in found.values()), default=None)
+            if daily:
+                today = datetime.utcnow().date()
+                key = f'{key}:{today.isoformat()}'
+                # A copy from before midnight is stale even if no table changed since
+                midnight = datetime.combine(today, time.min)
+                last_modified = max(last_modified or midnight, midnight)
+            digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+            etag = f'{state}-{digest}'
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+            # Browsers may keep the body but must revalidate before reusing it
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,16 @@
+import React from 'react';
+
+// Fetches the next page of a list on demand; hidden after the last page
+function LoadMore({ hasMore, loading, onLoadMore }) {
+  if (!hasMore) return null;
+
+  return (
+    <div style={{ textAlign: 'center', padding: '20px' }}>
+      <button className="btn btn-primary" onClick={onLoadMore} disabled={loading}>
+        {loading ? 'Loading...' : 'Load more'}
+      </button>
+    </div>
+  );
+}
+
+export default LoadMore;
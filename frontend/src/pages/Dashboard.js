@@ -8,6 +8,11 @@ function Dashboard() {
 
   useEffect(() => {
     loadDashboard();
+    // The server pushes new metrics and alerts whenever they change
+    return dashboardService.subscribe({
+      metrics: setMetrics,
+      alerts: (data) => setAlerts(data.alerts),
+    });
   }, []);
 
   const loadDashboard = async () => {
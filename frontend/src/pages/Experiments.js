@@ -1,9 +1,17 @@
 import React, { useState, useEffect } from 'react';
 import { experimentService } from '../services';
+import LoadMore from '../components/LoadMore';
+import usePagedList from '../utils/usePagedList';
 import { isValidJSON, formatErrorMessage } from '../utils/helpers';
 
 function Experiments() {
-  const [experiments, setExperiments] = useState([]);
+  const {
+    items: experiments,
+    hasMore,
+    loadingMore,
+    reload,
+    loadMore,
+  } = usePagedList(experimentService.getPage);
   const [showModal, setShowModal] = useState(false);
   const [editingExperiment, setEditingExperiment] = useState(null);
   const [error, setError] = useState('');
@@ -22,8 +30,7 @@ function Experiments() {
 
   const loadExperiments = async () => {
     try {
-      const data = await experimentService.getAll();
-      setExperiments(data);
+      await reload();
     } catch (error) {
       console.error('Error loading experiments:', error);
     }
@@ -153,6 +160,7 @@ function Experiments() {
           </div>
         ))}
         {experiments.length === 0 && <p style={{ textAlign: 'center', padding: '20px' }}>No experiments found</p>}
+        <LoadMore hasMore={hasMore} loading={loadingMore} onLoadMore={loadMore} />
       </div>
 
       {showModal && (
@@ -1,8 +1,16 @@
 import React, { useState, useEffect } from 'react';
 import { inventoryService } from '../services';
+import LoadMore from '../components/LoadMore';
+import usePagedList from '../utils/usePagedList';
 
 function Inventory() {
-  const [chemicals, setChemicals] = useState([]);
+  const {
+    items: chemicals,
+    hasMore,
+    loadingMore,
+    reload,
+    loadMore,
+  } = usePagedList(inventoryService.getPage);
   const [showModal, setShowModal] = useState(false);
   const [editingChemical, setEditingChemical] = useState(null);
   const [formData, setFormData] = useState({
@@ -22,8 +30,7 @@ function Inventory() {
 
   const loadChemicals = async () => {
     try {
-      const data = await inventoryService.getAll();
-      setChemicals(data);
+      await reload();
     } catch (error) {
       console.error('Error loading chemicals:', error);
     }
@@ -159,6 +166,7 @@ function Inventory() {
           </tbody>
         </table>
         {chemicals.length === 0 && <p style={{ textAlign: 'center', padding: '20px' }}>No chemicals found</p>}
+        <LoadMore hasMore={hasMore} loading={loadingMore} onLoadMore={loadMore} />
       </div>
 
       {showModal && (
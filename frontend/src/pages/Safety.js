@@ -1,9 +1,17 @@
 import React, { useState, useEffect } from 'react';
 import { safetyService } from '../services';
+import LoadMore from '../components/LoadMore';
+import usePagedList from '../utils/usePagedList';
 import { isValidJSON, formatErrorMessage } from '../utils/helpers';
 
 function Safety() {
-  const [protocols, setProtocols] = useState([]);
+  const {
+    items: protocols,
+    hasMore,
+    loadingMore,
+    reload,
+    loadMore,
+  } = usePagedList(safetyService.getPage);
   const [showModal, setShowModal] = useState(false);
   const [editingProtocol, setEditingProtocol] = useState(null);
   const [error, setError] = useState('');
@@ -20,8 +28,7 @@ function Safety() {
 
   const loadProtocols = async () => {
     try {
-      const data = await safetyService.getAll();
-      setProtocols(data);
+      await reload();
     } catch (error) {
       console.error('Error loading safety protocols:', error);
     }
@@ -146,6 +153,7 @@ function Safety() {
           <p style={{ textAlign: 'center', padding: '20px' }}>No safety protocols found</p>
         </div>
       )}
+      <LoadMore hasMore={hasMore} loading={loadingMore} onLoadMore={loadMore} />
 
       {showModal && (
         <div className="modal">
@@ -1,5 +1,18 @@
 import api from './api';
 
+// List endpoints are cursor-paginated: fetch one page, and pass its
+// nextCursor back as params.cursor for the following one
+const fetchPage = async (path, params) => {
+  const response = await api.get(path, { params });
+  return { items: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+};
+
+// Every matching row in one streamed response, for downloads
+const fetchExport = async (path, params) => {
+  const response = await api.get(path, { params: { ...params, format: 'json' } });
+  return response.data;
+};
+
 export const authService = {
   login: async (username, password) => {
     const response = await api.post('/auth/login', { username, password });
@@ -15,8 +28,8 @@ export const authService = {
     return response.data;
   },
 
-  register: async (username, email, password, role = 'technician') => {
-    const response = await api.post('/auth/register', { username, email, password, role });
+  register: async (username, email, password) => {
+    const response = await api.post('/auth/register', { username, email, password });
     return response.data;
   },
 
@@ -50,16 +63,26 @@ export const authService = {
 };
 
 export const inventoryService = {
-  getAll: async () => {
-    const response = await api.get('/inventory/');
-    return response.data;
-  },
+  getPage: async (params) => fetchPage('/inventory/', params),
+
+  exportAll: async (params) => fetchExport('/inventory/export', params),
 
   getById: async (id) => {
     const response = await api.get(`/inventory/${id}`);
     return response.data;
   },
 
+  getExperiments: async (id, params) => fetchPage(`/inventory/${id}/experiments`, params),
+
+  getProtocols: async (id, params) => fetchPage(`/inventory/${id}/protocols`, params),
+
+  getTotals: async (params) => {
+    const response = await api.get('/inventory/totals', { params });
+    return response.data;
+  },
+
+  getMovements: async (id, params) => fetchPage(`/inventory/${id}/movements`, params),
+
   create: async (data) => {
     const response = await api.post('/inventory/', data);
     return response.data;
@@ -77,10 +100,9 @@ export const inventoryService = {
 };
 
 export const experimentService = {
-  getAll: async () => {
-    const response = await api.get('/experiments/');
-    return response.data;
-  },
+  getPage: async (params) => fetchPage('/experiments/', params),
+
+  exportAll: async (params) => fetchExport('/experiments/export', params),
 
   getById: async (id) => {
     const response = await api.get(`/experiments/${id}`);
@@ -101,13 +123,20 @@ export const experimentService = {
     const response = await api.delete(`/experiments/${id}`);
     return response.data;
   },
-};
 
-export const safetyService = {
-  getAll: async () => {
-    const response = await api.get('/safety/');
+  // operations: [{ op: 'create' | 'update' | 'delete', id, data }]; a retried
+  // call with the same idempotencyKey is answered without applying it again
+  batch: async (operations, { atomic = false, idempotencyKey } = {}) => {
+    const headers = idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {};
+    const response = await api.post('/experiments/batch', { operations, atomic }, { headers });
     return response.data;
   },
+};
+
+export const safetyService = {
+  getPage: async (params) => fetchPage('/safety/', params),
+
+  exportAll: async (params) => fetchExport('/safety/export', params),
 
   getById: async (id) => {
     const response = await api.get(`/safety/${id}`);
@@ -128,6 +157,12 @@ export const safetyService = {
     const response = await api.delete(`/safety/${id}`);
     return response.data;
   },
+
+  batch: async (operations, { atomic = false, idempotencyKey } = {}) => {
+    const headers = idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {};
+    const response = await api.post('/safety/batch', { operations, atomic }, { headers });
+    return response.data;
+  },
 };
 
 export const dashboardService = {
@@ -140,4 +175,40 @@ export const dashboardService = {
     const response = await api.get('/dashboard/alerts');
     return response.data;
   },
+
+  getReorderReport: async () => {
+    const response = await api.get('/dashboard/reorder-report');
+    return response.data;
+  },
+
+  getUsage: async (params) => {
+    const response = await api.get('/dashboard/usage', { params });
+    return response.data;
+  },
+
+  getForecast: async (params) => {
+    const response = await api.get('/dashboard/forecast', { params });
+    return response.data;
+  },
+
+  // Live updates: handlers maps event names (metrics, alerts, inventory, ...)
+  // to callbacks receiving the parsed payload. Returns a function that closes
+  // the stream. EventSource cannot send headers, so the token goes in ?jwt=.
+  subscribe: (handlers) => {
+    const token = localStorage.getItem('token');
+    const source = new EventSource(
+      `${api.defaults.baseURL}/dashboard/events?jwt=${encodeURIComponent(token)}`
+    );
+    Object.entries(handlers).forEach(([name, handler]) => {
+      source.addEventListener(name, (event) => handler(JSON.parse(event.data)));
+    });
+    return () => source.close();
+  },
+};
+
+export const searchService = {
+  search: async (q, params) => {
+    const response = await api.get('/search/', { params: { q, ...params } });
+    return response.data;
+  },
 };
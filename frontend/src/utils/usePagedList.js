@@ -0,0 +1,36 @@
+import { useState } from 'react';
+
+/**
+ * Holds the loaded pages of a cursor-paginated list
+ * @param {Function} getPage - Service call taking params and returning { items, nextCursor }
+ * @returns {Object} - items, hasMore, loadingMore, reload() for the first page, loadMore() for the next
+ */
+const usePagedList = (getPage) => {
+  const [items, setItems] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const reload = async () => {
+    const page = await getPage();
+    setItems(page.items);
+    setNextCursor(page.nextCursor);
+  };
+
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await getPage({ cursor: nextCursor });
+      setItems((loaded) => [...loaded, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error loading more items:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  return { items, hasMore: !!nextCursor, loadingMore, reload, loadMore };
+};
+
+export default usePagedList;